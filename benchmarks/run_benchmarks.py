@@ -0,0 +1,352 @@
+"""Training and generation benchmarks for MarkovModel.
+
+Run the suite and store the results as JSON:
+
+    python -m benchmarks.run_benchmarks run --output benchmarks/results/current.json
+
+Flag regressions of a run against a baseline run:
+
+    python -m benchmarks.run_benchmarks compare baseline.json current.json
+
+Every case trains one model in a fresh process so its peak RSS is not inflated by
+the cases run before it.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # peak RSS isn't measured on Windows
+    resource = None
+
+CORPUS_TYPES = ["book", "lyric", "tweet"]
+NGRAM_SIZES = list(range(2, 11))
+
+# characters of synthetic corpus generated by default
+SYNTHETIC_CHARS = 2**20
+
+# chains generated when measuring generation speed
+GENERATED_CHAINS = 2000
+GENERATED_SEQ_LEN = 180
+
+# metrics compared by the compare command and whether higher values are better
+METRICS = {
+    "train_chars_per_sec": True,
+    "pickle_load_seconds": False,
+    "binary_load_seconds": False,
+    "compressed_load_seconds": False,
+    "compressed_bytes": False,
+    "generate_chars_per_sec": True,
+    "acceptance_rate": True,
+    "peak_rss_mb": False,
+}
+
+_WORDS = (
+    "the of and to a in that it was he i his you with for had as her is not but at on "
+    "she be my have by which said all this they from so were me we one him would there "
+    "their no when what love night baby shake time heart holmes watson street door "
+    "great tremendous people country believe never again"
+).split()
+
+
+def synthetic_corpus(num_chars=SYNTHETIC_CHARS, seed=0):
+    """Generates a reproducible corpus of random sentences and lines.
+
+    Parameters
+    ----------
+    num_chars : int, optional
+        Approximate length of the corpus, by default 2**20
+    seed : int, optional
+        Seed of the random words, by default 0
+
+    Returns
+    -------
+    str
+        The corpus text.
+    """
+
+    rng = np.random.default_rng(seed)
+    # zipf distributed word choice like natural text
+    word_ranks = np.minimum(rng.zipf(1.3, size=num_chars // 4), len(_WORDS)) - 1
+    # long enough for book start prompts, which need sentences over 100 characters
+    sentence_lengths = rng.integers(20, 50, size=len(word_ranks))
+
+    lines = []
+    position = 0
+    while position < len(word_ranks):
+        sentence_length = sentence_lengths[position]
+        words = [_WORDS[rank] for rank in word_ranks[position : position + sentence_length]]
+        lines.append(" ".join(words).capitalize() + ".")
+        position += sentence_length
+
+    text = "\n".join(lines)
+
+    return text[:num_chars]
+
+
+def bundled_corpora():
+    """Lists the corpora in data/raw/corpuses of the data folder, empty if none."""
+
+    from src.config import get_settings
+
+    corpuses_path = os.path.join(get_settings().data_dir, "raw", "corpuses")
+    if not os.path.isdir(corpuses_path):
+        return []
+
+    return sorted(
+        name
+        for name in os.listdir(corpuses_path)
+        if os.path.isdir(os.path.join(corpuses_path, name))
+    )
+
+
+def load_corpus_text(corpus_name, synthetic_chars):
+    if corpus_name == "synthetic":
+        return synthetic_corpus(synthetic_chars)
+
+    from src.data.corpus import Corpus
+
+    corpus = Corpus(corpus_name)
+    corpus.load_corpus()
+
+    return corpus.raw_text
+
+
+def peak_rss_mb():
+    """Gets the peak resident memory of this process in MB, None if unknown."""
+
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS bytes
+    if sys.platform == "darwin":
+        return max_rss / 2**20
+
+    return max_rss / 2**10
+
+
+def run_case(corpus_name, corpus_type, n, synthetic_chars):
+    """Benchmarks training, loading and generating with one model.
+
+    Parameters
+    ----------
+    corpus_name : str
+        "synthetic" or the name of a bundled corpus.
+    corpus_type : str
+        The corpus type to train and trim tweets with.
+    n : int
+        The n-gram size.
+    synthetic_chars : int
+        Length of the synthetic corpus.
+
+    Returns
+    -------
+    dict
+        The case and its measured metrics.
+    """
+
+    from src import config
+    from src.models.compressed_format import FILE_EXTENSION as COMPRESSED_EXTENSION
+    from src.models.generation_stats import get_acceptance_stats
+    from src.models.markov_model import MarkovModel
+
+    text = load_corpus_text(corpus_name, synthetic_chars)
+    model_name = f"benchmark-{corpus_name}"
+
+    model = MarkovModel(random_state=0)
+    start = time.perf_counter()
+    model.fit_corpus(model_name, text, n, corpus_type, retrain=True)
+    train_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # this runs in its own process, redirecting the model folder affects nothing else
+        config.set_settings(config.Settings(project_root=tmp_dir))
+        load_seconds = {}
+        # saving a format replaces the one saved before it
+        for file_format in ["pickle", "compressed", "binary"]:
+            model.save_model_weights(file_format=file_format, quantize="auto")
+            start = time.perf_counter()
+            MarkovModel().load_model_weights(model_name, n)
+            load_seconds[file_format] = time.perf_counter() - start
+            if file_format == "compressed":
+                compressed_bytes = os.path.getsize(
+                    os.path.join(
+                        config.get_settings().model_path(model_name),
+                        f"{model_name}_{n}-ngrams{COMPRESSED_EXTENSION}",
+                    )
+                )
+
+    start = time.perf_counter()
+    model.generate_batch(GENERATED_CHAINS, seq_len=GENERATED_SEQ_LEN)
+    generate_seconds = time.perf_counter() - start
+
+    return {
+        "corpus": corpus_name,
+        "corpus_type": corpus_type,
+        "n": n,
+        "corpus_chars": len(text),
+        "train_chars_per_sec": len(text) / train_seconds,
+        "pickle_load_seconds": load_seconds["pickle"],
+        "binary_load_seconds": load_seconds["binary"],
+        "compressed_load_seconds": load_seconds["compressed"],
+        "compressed_bytes": compressed_bytes,
+        "generate_chars_per_sec": GENERATED_CHAINS * GENERATED_SEQ_LEN / generate_seconds,
+        "acceptance_rate": get_acceptance_stats(model_name, corpus_type).acceptance_rate,
+        "model_bytes": model.nbytes,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_suite(corpora, corpus_types, ngram_sizes, synthetic_chars):
+    """Runs every benchmark case, each in a new process.
+
+    Returns
+    -------
+    dict
+        The "meta" data of the run and the "results" of every case.
+    """
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for corpus_name in corpora:
+        for corpus_type in corpus_types:
+            for n in ngram_sizes:
+                with context.Pool(1) as pool:
+                    result = pool.apply(
+                        run_case, (corpus_name, corpus_type, n, synthetic_chars)
+                    )
+                print(
+                    f"{corpus_name:>20} {corpus_type:>6} n={n:<2} "
+                    f"train {result['train_chars_per_sec'] / 1e6:7.2f}M chars/s  "
+                    f"generate {result['generate_chars_per_sec'] / 1e6:7.2f}M chars/s  "
+                    f"acceptance {result['acceptance_rate']}",
+                    flush=True,
+                )
+                results.append(result)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "synthetic_chars": synthetic_chars,
+        },
+        "results": results,
+    }
+
+
+def compare_results(baseline, current, tolerance=0.1):
+    """Finds metrics of a run that got worse than a baseline run.
+
+    Parameters
+    ----------
+    baseline : dict
+        Results of the baseline run, as written by run_suite.
+    current : dict
+        Results of the run to check.
+    tolerance : float, optional
+        Relative change allowed before a metric counts as regressed, by default 0.1
+
+    Returns
+    -------
+    list of dict
+        Every regressed metric with its case, baseline and current values.
+    """
+
+    def case_key(result):
+        return (result["corpus"], result["corpus_type"], result["n"])
+
+    baseline_cases = {case_key(result): result for result in baseline["results"]}
+
+    regressions = []
+    for result in current["results"]:
+        baseline_result = baseline_cases.get(case_key(result))
+        if baseline_result is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = baseline_result.get(metric), result.get(metric)
+            if old is None or new is None or old == 0:
+                continue
+            change = (new - old) / abs(old)
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(
+                    {
+                        "corpus": result["corpus"],
+                        "corpus_type": result["corpus_type"],
+                        "n": result["n"],
+                        "metric": metric,
+                        "baseline": old,
+                        "current": new,
+                        "change": change,
+                    }
+                )
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--output", required=True, help="JSON file to write")
+    run_parser.add_argument(
+        "--corpora",
+        nargs="+",
+        default=None,
+        help="Corpora to train on, by default synthetic and every bundled corpus",
+    )
+    run_parser.add_argument("--corpus-types", nargs="+", default=CORPUS_TYPES)
+    run_parser.add_argument("--n", nargs="+", type=int, default=NGRAM_SIZES)
+    run_parser.add_argument("--synthetic-chars", type=int, default=SYNTHETIC_CHARS)
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="Flag regressions against a baseline"
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=0.1)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        corpora = args.corpora or ["synthetic"] + bundled_corpora()
+        results = run_suite(corpora, args.corpus_types, args.n, args.synthetic_chars)
+        output_dir = os.path.dirname(os.path.abspath(args.output))
+        os.makedirs(output_dir, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    regressions = compare_results(baseline, current, tolerance=args.tolerance)
+    for regression in regressions:
+        print(
+            f"REGRESSION {regression['corpus']} {regression['corpus_type']} "
+            f"n={regression['n']} {regression['metric']}: "
+            f"{regression['baseline']:.4g} -> {regression['current']:.4g} "
+            f"({regression['change']:+.1%})"
+        )
+    print(f"{len(regressions)} regressions against {args.baseline}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""Cold start import time budgets of the entry points.
+
+Measure the import time of every entry point with `python -X importtime` and fail
+if one is over its budget or imports a module it must not:
+
+    python -m benchmarks.startup_budget
+
+Every import is measured in a fresh interpreter, the median of several runs is
+compared with the budget so a single slow run doesn't fail the check.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# project folder the entry points are imported from
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# cumulative import time in milliseconds allowed for every entry point, generous
+# enough for a slow machine but far below the cost of importing numpy
+STARTUP_BUDGETS_MS = {
+    "main": 80,
+    "src.serving.client": 100,
+}
+
+# modules an entry point must leave to be imported on first use
+HEAVY_MODULES = ["numpy", "tweepy", "dotenv", "asyncio", "http.client"]
+
+# heavy modules the entry points need at import anyway
+ALLOWED_HEAVY_MODULES = {
+    "src.serving.client": ["http.client"],
+}
+
+DEFAULT_RUNS = 5
+
+
+def parse_importtime(stderr):
+    """Parses the import times written by `python -X importtime`.
+
+    Parameters
+    ----------
+    stderr : str
+        The standard error of the interpreter.
+
+    Returns
+    -------
+    dict
+        The self and cumulative import time in microseconds keyed by module, modules
+        imported several times keep the first import.
+    """
+
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, module = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            # the header line
+            continue
+        times.setdefault(module.strip(), (int(self_us), int(cumulative_us)))
+
+    return times
+
+
+def measure_import(module):
+    """Imports a module in a fresh interpreter.
+
+    Parameters
+    ----------
+    module : str
+        The module to import.
+
+    Returns
+    -------
+    import_times : dict
+        The self and cumulative import time in microseconds of every module imported.
+    modules : list of str
+        Every module loaded once the import is done.
+    """
+
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"import json, sys, {module}; print(json.dumps(sorted(sys.modules)))",
+        ],
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    return parse_importtime(process.stderr), json.loads(process.stdout)
+
+
+def check_startup(budgets_ms=None, runs=DEFAULT_RUNS):
+    """Measures every entry point against its budget.
+
+    Parameters
+    ----------
+    budgets_ms : dict, optional
+        Import time budget in milliseconds keyed by module, by default
+        STARTUP_BUDGETS_MS
+    runs : int, optional
+        Fresh interpreters every module is imported in, by default 5
+
+    Returns
+    -------
+    results : dict
+        The median import time in milliseconds, the budget and the heavy modules
+        imported by every module.
+    violations : list of str
+        Every budget exceeded and heavy module imported.
+    """
+
+    budgets_ms = STARTUP_BUDGETS_MS if budgets_ms is None else budgets_ms
+
+    results = {}
+    violations = []
+    for module, budget_ms in budgets_ms.items():
+        import_ms = []
+        for _ in range(runs):
+            import_times, modules = measure_import(module)
+            import_ms.append(import_times[module][1] / 1000)
+
+        allowed = ALLOWED_HEAVY_MODULES.get(module, [])
+        heavy_modules = [
+            heavy for heavy in HEAVY_MODULES if heavy in modules and heavy not in allowed
+        ]
+        median_ms = statistics.median(import_ms)
+        results[module] = {
+            "import_ms": median_ms,
+            "budget_ms": budget_ms,
+            "heavy_modules": heavy_modules,
+        }
+
+        if median_ms > budget_ms:
+            violations.append(
+                f"{module} imports in {median_ms:.1f}ms, over its {budget_ms}ms budget"
+            )
+        for heavy in heavy_modules:
+            violations.append(f"{module} imports {heavy} at startup")
+
+    return results, violations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    parser.add_argument("--output", default=None, help="JSON file to write")
+    args = parser.parse_args(argv)
+
+    results, violations = check_startup(runs=args.runs)
+    for module, result in results.items():
+        print(
+            f"{module:>20} {result['import_ms']:7.1f}ms "
+            f"(budget {result['budget_ms']}ms)"
+        )
+    for violation in violations:
+        print(f"VIOLATION {violation}")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    return 1 if violations else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
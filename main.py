@@ -1,3 +1,4 @@
+import json
 import os
 import sys
 
@@ -12,18 +13,26 @@ import random
 # if SRC_PATH not in sys.path:
 #     sys.path.append(SRC_PATH)
 
-from src.models.markov_model import MarkovModel
-from src.twitter.twitter_bot import TwitterBot
+from src.models import instrumentation
+from src.models.tweet_pool import TweetPool
+from src.twitter.tweet_formatting import MODELS, TWEET_FORMATTING
 
 import logging
 import sys
-from logging.handlers import TimedRotatingFileHandler
 
 FORMATTER = logging.Formatter(
     "%(asctime)s — %(name)s — %(levelname)s — %(funcName)s:%(lineno)d — %(message)s"
 )
 LOG_FILE = "my_app.log"
 
+logger = logging.getLogger("markov-model")
+
+# seconds to wait on the rate limit before leaving tweets in the outbox for the next run
+MAX_RATE_LIMIT_WAIT = 15 * 60
+
+# tweets generated before giving up when they all duplicate posted tweets
+MAX_DUPLICATE_ATTEMPTS = 5
+
 
 def get_console_handler():
     console_handler = logging.StreamHandler(sys.stdout)
@@ -32,6 +41,8 @@ def get_console_handler():
 
 
 def get_file_handler():
+    from logging.handlers import TimedRotatingFileHandler
+
     file_handler = TimedRotatingFileHandler(LOG_FILE, when="midnight")
     file_handler.setFormatter(FORMATTER)
     return file_handler
@@ -39,7 +50,8 @@ def get_file_handler():
 
 def get_logger(logger_name):
     logger = logging.getLogger(logger_name)
-    logger.setLevel(logging.DEBUG)  # better to have too much log than not enough
+    # better to have too much log than not enough, LOG_LEVEL quietens it in production
+    logger.setLevel(os.getenv("LOG_LEVEL", "DEBUG"))
     logger.addHandler(get_console_handler())
     logger.addHandler(get_file_handler())
     # with this pattern, it's rarely necessary to propagate the error up to parent
@@ -47,49 +59,115 @@ def get_logger(logger_name):
     return logger
 
 
-def main():
-
-    models = ["taylor-swift", "arthur-conan-doyle", "trump-tweets"]
-    tweet_formatting = {
-        "taylor-swift": {
-            "seq_len": 180,
-            "introduction": "Taylor Swifts new lyrics:\n",
-            "hashtags": " #TaylorSwift",
-        },
-        "arthur-conan-doyle": {
-            "seq_len": 240,
-            "introduction": "From Arthur Conan Doyle: ",
-            "hashtags": " #SherlockHolmes",
-        },
-        "trump-tweets": {
-            "seq_len": 180,
-            "introduction": "Trump Tweeting - ",
-            "hashtags": " #Trump",
-        },
-    }
-
-    random_model = random.choice(models)
-    seq_len = tweet_formatting[random_model]["seq_len"]
-    introduction = tweet_formatting[random_model]["introduction"]
-    hashtags = tweet_formatting[random_model]["hashtags"]
+def load_model_in_process(model_name):
+    # only pay for importing numpy and loading the model when there's no server
+    from src.models.markov_model import MarkovModel
 
     markov_model = MarkovModel()
 
-    markov_model.load_production_model(model_name=random_model)
+    markov_model.load_production_model(model_name=model_name)
+
+    return markov_model
+
+
+async def post_tweet(tweet_text):
+    from src.twitter.posting_queue import Outbox, PostingQueue, TweepyTransport
+
+    # tweets left in the outbox by an earlier run are posted first
+    posting_queue = PostingQueue(Outbox(), TweepyTransport())
+    entry_id = await posting_queue.enqueue(tweet_text)
+    await posting_queue.drain(max_wait=MAX_RATE_LIMIT_WAIT)
+
+    return posting_queue.entry_state(entry_id)
+
+
+def generate_from_server(model_name):
+    # http.client is only imported when the tweet pool is empty
+    from src.serving.client import DEFAULT_HOST, DEFAULT_PORT, GenerationClient
+
+    client = GenerationClient(
+        host=os.getenv("GENERATION_SERVER_HOST", DEFAULT_HOST),
+        port=int(os.getenv("GENERATION_SERVER_PORT", DEFAULT_PORT)),
+        unix_socket=os.getenv("GENERATION_SERVER_SOCKET"),
+    )
+    _, tweet = client.generate(model_name)
+
+    return tweet
+
+
+def generate_unposted(tweet_pool, model_name):
+    # regenerates duplicates of posted tweets, the tweet returned is marked posted
+    # and None is returned if every attempt was a duplicate
+    markov_model = None
+    for _ in range(MAX_DUPLICATE_ATTEMPTS):
+        if markov_model is None:
+            # http.client is only imported when the tweet pool is empty
+            from src.serving.client import GenerationServerError
+
+            try:
+                tweet = generate_from_server(model_name)
+            except (OSError, GenerationServerError, ValueError) as e:
+                logger.warning(
+                    f"Generation server failed ({e}), loading the model in process "
+                    "instead"
+                )
+                markov_model = load_model_in_process(model_name)
+        if markov_model is not None:
+            tweet = markov_model.generate_tweet(
+                seq_len=TWEET_FORMATTING[model_name]["seq_len"]
+            )
+
+        if tweet_pool.mark_posted(tweet):
+            return tweet
+        logger.warning(
+            f"Generated a duplicate of a posted tweet, regenerating: {tweet}"
+        )
+
+    return None
+
+
+def main():
 
-    tweet = markov_model.generate_tweet(seq_len=seq_len)
+    random_model = random.choice(MODELS)
+    introduction = TWEET_FORMATTING[random_model]["introduction"]
+    hashtags = TWEET_FORMATTING[random_model]["hashtags"]
+
+    # pre-generated tweets are posted first, generation is only a fallback
+    tweet_pool = TweetPool(random_model)
+    tweet = tweet_pool.pop()
+    if tweet is None:
+        logger.warning(f"Tweet pool of {random_model} is empty, generating a tweet")
+        tweet = generate_unposted(tweet_pool, random_model)
+    if tweet is None:
+        logger.error(
+            f"Only generated duplicates of posted tweets in {MAX_DUPLICATE_ATTEMPTS} "
+            "attempts, not posting"
+        )
+        return "duplicate"
 
     logger.info(introduction + tweet + hashtags)
 
-    markov_bot = TwitterBot()
-    markov_bot.create_authenticate_api()
+    # the event loop and posting queue are only imported once there's a tweet to post
+    import asyncio
 
-    markov_bot.send_tweet(introduction + tweet)
+    return asyncio.run(post_tweet(introduction + tweet))
 
 
 if __name__ == "__main__":
     logger = get_logger("markov-model")
     logger.info("Starting to generate tweet..")
     os.chdir("/code/my-little-markov-model")
-    main()
-    logger.info("Tweet Successfully Sent, shutting down...")
+    # MARKOV_PROFILE=<path> captures a cProfile of the whole run
+    if os.getenv("MARKOV_PROFILE"):
+        with instrumentation.profile(os.getenv("MARKOV_PROFILE")):
+            state = main()
+    else:
+        state = main()
+    if instrumentation.is_enabled():
+        logger.info(f"Metrics: {json.dumps(instrumentation.report())}")
+    if state == "posted":
+        logger.info("Tweet Successfully Sent, shutting down...")
+    elif state == "queued":
+        logger.warning("Tweet left in the outbox for the next run, shutting down...")
+    else:
+        logger.error(f"Tweet not sent ({state}), shutting down...")
@@ -0,0 +1,288 @@
+"""Where models, corpora and working data are stored.
+
+Every path is resolved through one Settings object, read on first use from
+environment variables, then a JSON config file, then the defaults:
+
+    MARKOV_PROJECT_ROOT  folder holding data/ and models/, by default the folder of
+                         the src package, wherever the process was started from
+    MARKOV_MODEL_DIR     where models are trained into and loaded from, by default
+                         {project root}/models/markov-models
+    MARKOV_MODEL_STORES  folders searched in order for production models, separated
+                         by os.pathsep, e.g. a read only mounted volume, by default
+                         {model dir}/prod-models
+    MARKOV_CACHE_DIR     fast local folder, e.g. an SSD or tmpfs, production models
+                         are copied to and loaded from, by default None to load them
+                         from their store
+    MARKOV_ARTIFACT_DIR  content addressed store of model versions, by default
+                         {project root}/models/artifacts
+    MARKOV_DATA_DIR      corpora, tweet pools and the outbox, by default
+                         {project root}/data
+    MARKOV_CONFIG        JSON file setting any of the above by their lower case
+                         name without the MARKOV_ prefix, e.g. {"cache_dir": "/tmp"}
+"""
+
+import json
+import logging
+import os
+
+logger = logging.getLogger("markov-model")
+
+# settings that are lists of folders rather than a single folder
+_LIST_SETTINGS = ("model_stores",)
+
+_SETTING_NAMES = (
+    "project_root",
+    "model_dir",
+    "model_stores",
+    "cache_dir",
+    "artifact_dir",
+    "data_dir",
+)
+
+_settings = None
+
+
+class Settings:
+    def __init__(
+        self,
+        project_root=None,
+        model_dir=None,
+        model_stores=None,
+        cache_dir=None,
+        artifact_dir=None,
+        data_dir=None,
+    ):
+        """Paths of the model stores and data folders.
+
+        Parameters
+        ----------
+        project_root : str, optional
+            Folder holding data/ and models/, by default the folder of the src package.
+        model_dir : str, optional
+            Where models are trained into and loaded from, by default
+            {project_root}/models/markov-models
+        model_stores : list of str, optional
+            Folders searched in order for production models, by default
+            [{model_dir}/prod-models]
+        cache_dir : str, optional
+            Folder production models are copied to and loaded from, by default None
+            to load them from their store.
+        artifact_dir : str, optional
+            Folder of the content addressed model store, by default
+            {project_root}/models/artifacts
+        data_dir : str, optional
+            Folder of corpora, tweet pools and the outbox, by default
+            {project_root}/data
+        """
+
+        if project_root is None:
+            project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.project_root = project_root
+        self.model_dir = (
+            os.path.join(project_root, "models", "markov-models")
+            if model_dir is None
+            else model_dir
+        )
+        self.model_stores = (
+            [os.path.join(self.model_dir, "prod-models")]
+            if model_stores is None
+            else list(model_stores)
+        )
+        self.cache_dir = cache_dir
+        self.artifact_dir = (
+            os.path.join(project_root, "models", "artifacts")
+            if artifact_dir is None
+            else artifact_dir
+        )
+        self.data_dir = os.path.join(project_root, "data") if data_dir is None else data_dir
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in _SETTING_NAMES)
+        return f"Settings({values})"
+
+    @classmethod
+    def from_env(cls, environ=None):
+        """Reads the settings from environment variables and the MARKOV_CONFIG file.
+
+        Parameters
+        ----------
+        environ : Mapping, optional
+            The environment variables, by default os.environ
+
+        Returns
+        -------
+        Settings
+            The settings, environment variables take precedence over the file.
+        """
+
+        environ = os.environ if environ is None else environ
+
+        values = {}
+        config_path = environ.get("MARKOV_CONFIG")
+        if config_path:
+            with open(config_path) as f:
+                values = json.load(f)
+            unknown = set(values) - set(_SETTING_NAMES)
+            if unknown:
+                raise ValueError(f"Unknown settings {sorted(unknown)} in {config_path}")
+
+        for name in _SETTING_NAMES:
+            value = environ.get(f"MARKOV_{name.upper()}")
+            if value:
+                values[name] = value.split(os.pathsep) if name in _LIST_SETTINGS else value
+
+        return cls(**values)
+
+    def model_path(self, model_name):
+        """Gets the folder a model is trained into, {model_dir}/{model_name}."""
+
+        return os.path.join(self.model_dir, model_name)
+
+    def production_model_names(self):
+        """Lists the production models of every store, in name order."""
+
+        return sorted(
+            {
+                name
+                for store in self.model_stores
+                if os.path.isdir(store)
+                for name in os.listdir(store)
+                if os.path.isdir(os.path.join(store, name))
+            }
+        )
+
+    def production_model_path(self, model_name):
+        """Finds the folder a production model is loaded from.
+
+        The first store holding the model is used. With a cache folder set, the model
+        is copied into it the first time and loaded from the copy after that.
+
+        Parameters
+        ----------
+        model_name : str
+            The production model.
+
+        Returns
+        -------
+        str
+            The folder holding the model files.
+
+        Raises
+        ------
+        FileNotFoundError
+            If no store holds the model.
+        """
+
+        for store in self.model_stores:
+            store_path = os.path.join(store, model_name)
+            if os.path.isdir(store_path):
+                break
+        else:
+            raise FileNotFoundError(
+                f"No production model {model_name} in stores {self.model_stores}"
+            )
+
+        if self.cache_dir is None:
+            return store_path
+
+        return cache_model(store_path, os.path.join(self.cache_dir, model_name))
+
+    def corpus_path(self, corpus_name):
+        """Gets the folder of a raw corpus, {data_dir}/raw/corpuses/{corpus_name}."""
+
+        return os.path.join(self.data_dir, "raw", "corpuses", corpus_name)
+
+    def interim_path(self, *names):
+        """Gets a path of the working data folder, {data_dir}/interim/{names}."""
+
+        return os.path.join(self.data_dir, "interim", *names)
+
+
+def cache_model(store_path, cache_path):
+    """Copies the files of a model folder to a cache folder unless already there.
+
+    Files are copied to a temporary file next to their cached path and moved into
+    place, so processes sharing the cache never load a partly copied file. A cached
+    file is copied again when its size or modification time differs from the store.
+
+    Parameters
+    ----------
+    store_path : str
+        The model folder in its store.
+    cache_path : str
+        The model folder in the cache.
+
+    Returns
+    -------
+    str
+        The cache folder.
+    """
+
+    import shutil
+    import tempfile
+
+    os.makedirs(cache_path, exist_ok=True)
+    store_files = os.listdir(store_path)
+    for file_name in store_files:
+        source = os.path.join(store_path, file_name)
+        target = os.path.join(cache_path, file_name)
+        if not os.path.isfile(source):
+            continue
+
+        source_stat = os.stat(source)
+        if os.path.exists(target):
+            target_stat = os.stat(target)
+            if (target_stat.st_size == source_stat.st_size) and (
+                target_stat.st_mtime == source_stat.st_mtime
+            ):
+                continue
+
+        logger.info(f"Caching {source} in {cache_path}")
+        handle, temp_path = tempfile.mkstemp(dir=cache_path, suffix=".tmp")
+        os.close(handle)
+        try:
+            shutil.copy2(source, temp_path)
+            os.replace(temp_path, target)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    # files since removed from the store, e.g. a pickle replaced by a binary model
+    for file_name in os.listdir(cache_path):
+        if (file_name not in store_files) and not file_name.endswith(".tmp"):
+            os.remove(os.path.join(cache_path, file_name))
+
+    return cache_path
+
+
+def get_settings():
+    """Gets the settings in use, read from the environment on first use."""
+
+    global _settings
+    if _settings is None:
+        _settings = Settings.from_env()
+        logger.debug(f"Using {_settings}")
+
+    return _settings
+
+
+def set_settings(settings=None):
+    """Replaces the settings in use.
+
+    Parameters
+    ----------
+    settings : Settings, optional
+        The new settings, by default None to read them from the environment again on
+        next use.
+
+    Returns
+    -------
+    Settings or None
+        The settings replaced.
+    """
+
+    global _settings
+    previous = _settings
+    _settings = settings
+
+    return previous
@@ -1,5 +1,10 @@
 import os
 
+from src.config import get_settings
+
+# characters read from a corpus file at a time when streaming
+DEFAULT_CHUNK_SIZE = 2**20
+
 
 class Corpus:
     def __init__(self, corpus_name):
@@ -16,24 +21,67 @@ class Corpus:
         self.name = corpus_name
         self.raw_text = None
 
+    def corpus_path(self):
+        """Gets the directory holding the raw corpus files.
+
+        Returns
+        -------
+        str
+            The path to data/raw/corpuses/{corpus_name} of the data folder.
+        """
+
+        return get_settings().corpus_path(self.name)
+
+    def corpus_files(self):
+        """Lists every text file of the corpus.
+
+        Returns
+        -------
+        list of str
+            Paths of the .txt files in the corpus directory, in name order.
+        """
+
+        corpus_path = self.corpus_path()
+
+        return [
+            os.path.join(corpus_path, file)
+            for file in sorted(os.listdir(corpus_path))
+            # Check whether file is in text format or not
+            if file.endswith(".txt")
+        ]
+
     def load_corpus(self):
         """Loads in the raw corpus from the raw data folder by model name.
 
-        Looks in data/raw/corpuses/{model_name}.
+        Looks in data/raw/corpuses/{model_name}, the text of every .txt file is
+        concatenated in file name order.
         """
 
-        cur_dir = os.getcwd()
-        src_path = cur_dir[
-            : cur_dir.index("my-little-markov-model") + len("my-little-markov-model")
-        ]
-        corpus_path = os.path.join(src_path, "data", "raw", "corpuses", self.name)
+        texts = []
+        for file_path in self.corpus_files():
+            with open(file_path, encoding="utf8") as f:
+                texts.append(f.read())
 
-        for file in os.listdir(corpus_path):
-            # Check whether file is in text format or not
-            if file.endswith(".txt"):
-                file_path = os.path.join(corpus_path, file)
+        self.raw_text = "".join(texts)
 
-                with open(file_path, encoding="utf8") as f:
-                    lines = f.read()
+    def iter_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Streams the raw corpus text without loading it all into memory.
+
+        Parameters
+        ----------
+        chunk_size : int, optional
+            Max number of characters per chunk, by default 2**20
+
+        Yields
+        ------
+        str
+            The next piece of corpus text, files are read in file name order.
+        """
 
-        self.raw_text = lines
+        for file_path in self.corpus_files():
+            with open(file_path, encoding="utf8") as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if chunk == "":
+                        break
+                    yield chunk
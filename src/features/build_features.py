@@ -0,0 +1,356 @@
+"""Tokenizers splitting encoded corpus text into the tokens Markov models chain.
+
+Every token is written as a single character, a symbol, so the n-gram engine,
+transition tables and model files work the same whatever the tokenizer. Single
+character tokens are the character itself and longer tokens are given a code point
+of the supplementary private use areas, which corpora don't use.
+
+The character tokenizer keeps the text as it is. The word tokenizer turns the most
+frequent words into single tokens and spells out the rest letter by letter, and the
+subword tokenizer learns byte pair encoding merges so rare words are made of
+frequent pieces. Both need four to five times fewer sampling steps per character
+generated than the character tokenizer.
+"""
+
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+# code point ranges standing for multi character tokens
+_SYMBOL_RANGES = [(0xF0000, 0xFFFFE), (0x100000, 0x10FFFE)]
+
+# most multi character tokens a tokenizer can have
+MAX_PIECES = sum(stop - start for start, stop in _SYMBOL_RANGES)
+
+_FIRST_SYMBOL = chr(_SYMBOL_RANGES[0][0])
+
+# a word with its leading space, or any other single character. Keeping the space
+# with the word after it means text encoded in chunks split at spaces is tokenized
+# the same as the whole text.
+WORD_PATTERN = re.compile(r" ?\w+|.", re.DOTALL)
+
+# steps generated per expected token of the requested length, so the decoded text is
+# rarely shorter than asked for
+_STEP_MARGIN = 1.1
+
+
+def _symbol(index):
+    for start, stop in _SYMBOL_RANGES:
+        if index < stop - start:
+            return chr(start + index)
+        index -= stop - start
+
+    raise ValueError(f"More than {MAX_PIECES} multi character tokens")
+
+
+def _check_symbols_free(text):
+    if len(text) > 0 and max(text) >= _FIRST_SYMBOL:
+        raise ValueError(
+            "Text contains private use characters, they are reserved for tokens"
+        )
+
+
+class CharacterTokenizer:
+    name = "character"
+    # average characters of text per token in the corpus fitted on
+    chars_per_token = 1.0
+
+    def fit(self, texts):
+        """Learns the tokens of a corpus, nothing to learn for characters.
+
+        Parameters
+        ----------
+        texts : iterable of str
+            The encoded corpus text, whole or in pieces.
+
+        Returns
+        -------
+        CharacterTokenizer
+            The fitted tokenizer.
+        """
+
+        return self
+
+    def encode(self, text):
+        """Converts encoded corpus text to token symbols.
+
+        Parameters
+        ----------
+        text : str
+            Encoded corpus text, see MarkovModel.encode_corpus.
+
+        Returns
+        -------
+        str
+            One character per token.
+        """
+
+        return text
+
+    def decode(self, symbols):
+        """Converts token symbols back to encoded corpus text."""
+
+        return symbols
+
+    def num_steps(self, length):
+        """Gets how many tokens to generate for text of at least length characters."""
+
+        return length
+
+    def decode_generated(self, symbols, length):
+        """Converts generated token symbols to text of at most length characters.
+
+        Generated characters are returned as they are, even when the start prompt
+        makes them longer than length.
+        """
+
+        return symbols
+
+    def get_state(self):
+        """Gets everything needed to recreate the tokenizer with tokenizer_from_state."""
+
+        return {"type": self.name}
+
+
+class WordTokenizer(CharacterTokenizer):
+    name = "word"
+
+    def __init__(self, max_vocab=2**16, min_count=2):
+        """Tokenizes words, falling back to characters for rare words.
+
+        Parameters
+        ----------
+        max_vocab : int, optional
+            Most words given their own token, by default 2**16
+        min_count : int, optional
+            Words occurring fewer times in the corpus are spelled out letter by
+            letter, by default 2
+        """
+
+        if max_vocab > MAX_PIECES:
+            raise ValueError(f"max_vocab can't be larger than {MAX_PIECES}")
+
+        self.max_vocab = max_vocab
+        self.min_count = min_count
+        self.chars_per_token = 1.0
+        self._set_pieces([])
+
+    def _set_pieces(self, pieces):
+        self.pieces = list(pieces)
+        self._symbols = {piece: _symbol(i) for i, piece in enumerate(self.pieces)}
+        self._decode_table = {ord(symbol): piece for piece, symbol in self._symbols.items()}
+        # symbols of every word encoded so far
+        self._word_symbols = {}
+
+    def _encode_word(self, word):
+        # rare words are their own characters
+        return self._symbols.get(word, word)
+
+    def _word_counts(self, texts):
+        word_counts = Counter()
+        for text in texts:
+            _check_symbols_free(text)
+            word_counts.update(WORD_PATTERN.findall(text))
+
+        return word_counts
+
+    def _measure(self, word_counts):
+        num_chars = sum(len(word) * count for word, count in word_counts.items())
+        num_tokens = sum(
+            len(self._encode_word(word)) * count for word, count in word_counts.items()
+        )
+        self.chars_per_token = num_chars / max(num_tokens, 1)
+
+    def fit(self, texts):
+        word_counts = self._word_counts(texts)
+        self._set_pieces(
+            word
+            for word, count in word_counts.most_common(self.max_vocab)
+            if (count >= self.min_count) and (len(word) > 1)
+        )
+        self._measure(word_counts)
+
+        return self
+
+    def encode(self, text):
+        _check_symbols_free(text)
+        word_symbols = self._word_symbols
+        symbols = []
+        for word in WORD_PATTERN.findall(text):
+            encoded_word = word_symbols.get(word)
+            if encoded_word is None:
+                encoded_word = word_symbols[word] = self._encode_word(word)
+            symbols.append(encoded_word)
+
+        return "".join(symbols)
+
+    def decode(self, symbols):
+        return symbols.translate(self._decode_table)
+
+    def num_steps(self, length):
+        return math.ceil(length * _STEP_MARGIN / self.chars_per_token)
+
+    def decode_generated(self, symbols, length):
+        return self.decode(symbols)[:length]
+
+    def get_state(self):
+        return {
+            "type": self.name,
+            "max_vocab": self.max_vocab,
+            "min_count": self.min_count,
+            "chars_per_token": self.chars_per_token,
+            "pieces": self.pieces,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        tokenizer = cls(max_vocab=state["max_vocab"], min_count=state["min_count"])
+        tokenizer.chars_per_token = state["chars_per_token"]
+        tokenizer._set_pieces(state["pieces"])
+
+        return tokenizer
+
+
+class SubwordTokenizer(WordTokenizer):
+    name = "subword"
+
+    def __init__(self, max_vocab=2**13, min_count=2):
+        """Tokenizes words into pieces learned with byte pair encoding.
+
+        Parameters
+        ----------
+        max_vocab : int, optional
+            How many merges to learn, every merge adds one multi character piece,
+            by default 2**13
+        min_count : int, optional
+            Pairs of pieces occurring fewer times are not merged, by default 2
+        """
+
+        super().__init__(max_vocab=max_vocab, min_count=min_count)
+        self.merges = []
+
+    def _set_merges(self, merges):
+        self.merges = [tuple(merge) for merge in merges]
+        self._merge_ranks = {merge: rank for rank, merge in enumerate(self.merges)}
+        self._set_pieces(left + right for left, right in self.merges)
+
+    def _encode_word(self, word):
+        pieces = list(word)
+        # apply the earliest learned merge present until none is left
+        while len(pieces) > 1:
+            ranks = [
+                self._merge_ranks.get(pair, math.inf) for pair in zip(pieces, pieces[1:])
+            ]
+            best = min(range(len(ranks)), key=ranks.__getitem__)
+            if ranks[best] == math.inf:
+                break
+            pieces[best : best + 2] = [pieces[best] + pieces[best + 1]]
+
+        return "".join([self._symbols.get(piece, piece) for piece in pieces])
+
+    def fit(self, texts):
+        word_counts = self._word_counts(texts)
+
+        words = [list(word) for word in word_counts]
+        counts = list(word_counts.values())
+        pair_counts = Counter()
+        pair_words = defaultdict(set)
+        for index, pieces in enumerate(words):
+            for pair in zip(pieces, pieces[1:]):
+                pair_counts[pair] += counts[index]
+                pair_words[pair].add(index)
+
+        # max heap of pair counts, entries are checked against pair_counts when
+        # popped as counts change after they're pushed
+        heap = [(-count, pair) for pair, count in pair_counts.items()]
+        heapq.heapify(heap)
+
+        merges = []
+        while len(merges) < self.max_vocab and heap:
+            negative_count, pair = heapq.heappop(heap)
+            count = pair_counts.get(pair, 0)
+            if count != -negative_count:
+                if count > 0:
+                    heapq.heappush(heap, (-count, pair))
+                continue
+            if count < self.min_count:
+                break
+            merges.append(pair)
+            merged = pair[0] + pair[1]
+
+            # only the words containing the pair have their pair counts updated
+            for index in pair_words.pop(pair):
+                pieces = words[index]
+                for old_pair in zip(pieces, pieces[1:]):
+                    pair_counts[old_pair] -= counts[index]
+                    if pair_counts[old_pair] <= 0:
+                        del pair_counts[old_pair]
+
+                position = 0
+                while position < len(pieces) - 1:
+                    if (pieces[position], pieces[position + 1]) == pair:
+                        pieces[position : position + 2] = [merged]
+                    position += 1
+
+                for new_pair in zip(pieces, pieces[1:]):
+                    pair_counts[new_pair] += counts[index]
+                    pair_words[new_pair].add(index)
+                    heapq.heappush(heap, (-pair_counts[new_pair], new_pair))
+
+        self._set_merges(merges)
+        self._measure(word_counts)
+
+        return self
+
+    def get_state(self):
+        state = super().get_state()
+        del state["pieces"]
+        state["merges"] = [list(merge) for merge in self.merges]
+
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        tokenizer = cls(max_vocab=state["max_vocab"], min_count=state["min_count"])
+        tokenizer.chars_per_token = state["chars_per_token"]
+        tokenizer._set_merges(state["merges"])
+
+        return tokenizer
+
+
+TOKENIZERS = {
+    tokenizer.name: tokenizer
+    for tokenizer in [CharacterTokenizer, WordTokenizer, SubwordTokenizer]
+}
+
+
+def get_tokenizer(name, **kwargs):
+    """Creates an unfitted tokenizer by name.
+
+    Parameters
+    ----------
+    name : str
+        One of "character", "word", "subword".
+    **kwargs
+        Options of the tokenizer class.
+
+    Returns
+    -------
+    CharacterTokenizer
+        The tokenizer.
+    """
+
+    if name not in TOKENIZERS:
+        raise ValueError(f"Invalid tokenizer {name}, expect one of {list(TOKENIZERS)}")
+
+    return TOKENIZERS[name](**kwargs)
+
+
+def tokenizer_from_state(state):
+    """Recreates a fitted tokenizer from its get_state dict, characters if None."""
+
+    if state is None or state["type"] == CharacterTokenizer.name:
+        return CharacterTokenizer()
+
+    return TOKENIZERS[state["type"]].from_state(state)
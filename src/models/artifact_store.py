@@ -0,0 +1,605 @@
+"""Content addressed store of model weight files.
+
+A stored file is split into content defined chunks, every chunk is saved once as a
+blob named by its sha256, so versions and repeated promotions of the same weights
+share their chunks instead of copying them. Chunks end where a rolling hash of the
+bytes before them hits a boundary, so inserting or removing bytes only changes the
+chunks around the edit and a retrained model shares the unchanged parts of its file
+with the version before it. A version is named by the sha256 of the whole file and
+records its chunks. The manifest maps every model name to its versions and the
+version in production, it is rewritten atomically under a file lock so promoting a
+version is a single os.replace.
+
+Every hash is computed while streaming the file chunk by chunk. Chunks are checked
+against their names when a version is promoted or checked out, and a checked out
+file is only moved into place once it matches its version. A checked out file is
+reused while its size and modification time match the stamp written with it, and
+is hashed again otherwise.
+
+    python -m src.models.artifact_store put arthur-conan-doyle model.mlmm --promote
+    python -m src.models.artifact_store verify arthur-conan-doyle
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # no file locking on Windows, the store must then only be written by one process
+    fcntl = None
+
+from src.config import get_settings
+
+logger = logging.getLogger("markov-model")
+
+# average bytes of a stored file per blob, chunks are a quarter to four times as long
+CHUNK_SIZE = 2**22
+
+# bytes the rolling hash of a chunk boundary depends on
+HASH_WINDOW = 32
+
+# random uint32 per byte value mixed into the rolling hash, fixed so stored files are
+# always split at the same boundaries
+_GEAR = np.array(
+    [
+        int.from_bytes(hashlib.sha256(bytes([value])).digest()[:4], "little")
+        for value in range(256)
+    ],
+    dtype=np.uint32,
+)
+
+
+class ArtifactIntegrityError(RuntimeError):
+    """Raised when stored bytes don't match the hash they are stored under."""
+
+
+def _list_dir(path):
+    return os.listdir(path) if os.path.isdir(path) else []
+
+
+def _write_atomic(path, chunks):
+    # written next to its final path so os.replace never crosses file systems
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _gear_hashes(values):
+    """Rolling gear hash of the last HASH_WINDOW gear values at every position."""
+
+    # sum of values[i - k] << k for k < HASH_WINDOW, built by doubling the window
+    hashes = values.copy()
+    width = 1
+    while width < HASH_WINDOW:
+        hashes[width:] += hashes[:-width] << np.uint32(width)
+        width *= 2
+
+    return hashes
+
+
+def iter_content_chunks(f, chunk_size=CHUNK_SIZE):
+    """Reads a file in content defined chunks.
+
+    A chunk ends after a byte where the gear hash of the last HASH_WINDOW bytes has
+    its low bits all zero, so the boundaries only depend on the bytes around them.
+
+    Parameters
+    ----------
+    f : file object
+        The file opened in binary mode.
+    chunk_size : int, optional
+        Average length of the chunks, they are between a quarter and four times as
+        long, the last chunk may be shorter. By default 4 MiB
+
+    Yields
+    ------
+    bytes
+        The chunks of the file, in order.
+    """
+
+    min_size = max(chunk_size // 4, 1)
+    max_size = 4 * chunk_size
+    # boundaries are on average this many bytes apart once past the minimum size
+    mask = np.uint32((1 << max((chunk_size - min_size).bit_length() - 1, 0)) - 1)
+
+    buffer = bytearray()
+    start = 0
+    end_of_file = False
+    # offsets after every boundary byte not yet used to end a chunk
+    boundaries = []
+    context = np.zeros(0, dtype=np.uint32)
+    while True:
+        block = f.read(max_size)
+        if block:
+            values = np.concatenate(
+                (context, _GEAR[np.frombuffer(block, dtype=np.uint8)])
+            )
+            hashes = _gear_hashes(values)[len(context) :]
+            offset = start + len(buffer)
+            boundaries.extend(
+                (offset + 1 + np.flatnonzero((hashes & mask) == 0)).tolist()
+            )
+            context = values[-(HASH_WINDOW - 1) :]
+            buffer += block
+        else:
+            end_of_file = True
+
+        while len(buffer) > 0:
+            boundaries = [end for end in boundaries if end >= start + min_size]
+            if boundaries and (boundaries[0] <= start + max_size):
+                end = boundaries[0]
+            elif len(buffer) >= max_size:
+                end = start + max_size
+            elif end_of_file:
+                end = start + len(buffer)
+            else:
+                break
+
+            yield bytes(buffer[: end - start])
+            del buffer[: end - start]
+            start = end
+
+        if end_of_file:
+            return
+
+
+class ArtifactStore:
+    def __init__(self, root=None, chunk_size=CHUNK_SIZE):
+        """Versions of model weight files stored by content.
+
+        Parameters
+        ----------
+        root : str, optional
+            Folder of the store, by default the artifact folder of the settings.
+        chunk_size : int, optional
+            Average bytes per blob of newly stored files, by default 4 MiB
+        """
+
+        self.root = get_settings().artifact_dir if root is None else root
+        self.chunk_size = chunk_size
+        self.manifest_path = os.path.join(self.root, "manifest.json")
+        self._lock = threading.Lock()
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, "blobs", digest[:2], digest)
+
+    def _version_path(self, version):
+        return os.path.join(self.root, "versions", f"{version}.json")
+
+    def _checkout_dir(self, version):
+        return os.path.join(self.root, "checkouts", version)
+
+    @contextmanager
+    def _locked(self, save=True):
+        """Holds the manifest lock and yields the manifest, saving it on exit."""
+
+        os.makedirs(self.root, exist_ok=True)
+
+        with self._lock, open(f"{self.manifest_path}.lock", "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            manifest = self._read_manifest()
+
+            yield manifest
+
+            if save:
+                _write_atomic(
+                    self.manifest_path, [json.dumps(manifest, indent=2).encode("utf8")]
+                )
+
+    def _read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {"models": {}}
+
+        with open(self.manifest_path, encoding="utf8") as f:
+            return json.load(f)
+
+    def read_version(self, version):
+        """Gets the record of a version.
+
+        Returns
+        -------
+        dict
+            The "version" hash, "file_name", "size" and "chunks" hashes.
+        """
+
+        with open(self._version_path(version), encoding="utf8") as f:
+            return json.load(f)
+
+    def put(self, model_name, path):
+        """Stores a model file as a new version of a model.
+
+        Only chunks not already in the store are written. Storing a file identical
+        to an existing version adds nothing but the manifest entry.
+
+        Parameters
+        ----------
+        model_name : str
+            The model the file holds the weights of.
+        path : str
+            The .pkl or .mlmm weights file.
+
+        Returns
+        -------
+        str
+            The version, the sha256 of the file.
+        """
+
+        file_hash = hashlib.sha256()
+        chunks = []
+        size = 0
+        num_written = 0
+        with open(path, "rb") as f:
+            for chunk in iter_content_chunks(f, self.chunk_size):
+                file_hash.update(chunk)
+                digest = hashlib.sha256(chunk).hexdigest()
+                chunks.append(digest)
+                size += len(chunk)
+
+                blob_path = self._blob_path(digest)
+                if not os.path.exists(blob_path):
+                    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                    _write_atomic(blob_path, [chunk])
+                    num_written += 1
+
+        version = file_hash.hexdigest()
+        version_path = self._version_path(version)
+        if not os.path.exists(version_path):
+            os.makedirs(os.path.dirname(version_path), exist_ok=True)
+            record = {
+                "version": version,
+                "file_name": os.path.basename(path),
+                "size": size,
+                "chunks": chunks,
+            }
+            _write_atomic(version_path, [json.dumps(record).encode("utf8")])
+
+        with self._locked() as manifest:
+            model = manifest["models"].setdefault(
+                model_name, {"versions": [], "production": None}
+            )
+            if version not in [entry["version"] for entry in model["versions"]]:
+                model["versions"].append({"version": version, "created": time.time()})
+
+        logger.info(
+            f"Stored {model_name} version {version[:12]}, "
+            f"{num_written} of {len(chunks)} chunks new"
+        )
+
+        return version
+
+    def _iter_chunks(self, record):
+        """Streams the chunks of a version, checking every one against its hash."""
+
+        for digest in record["chunks"]:
+            try:
+                with open(self._blob_path(digest), "rb") as f:
+                    chunk = f.read()
+            except FileNotFoundError as e:
+                raise ArtifactIntegrityError(
+                    f"Chunk {digest} of version {record['version']} is missing"
+                ) from e
+            if hashlib.sha256(chunk).hexdigest() != digest:
+                raise ArtifactIntegrityError(
+                    f"Chunk {digest} of version {record['version']} is corrupt"
+                )
+            yield chunk
+
+    def verify(self, version):
+        """Checks every chunk of a version and the whole file against their hashes.
+
+        Raises
+        ------
+        ArtifactIntegrityError
+            If a chunk is missing or any hash doesn't match.
+        """
+
+        record = self.read_version(version)
+        file_hash = hashlib.sha256()
+        size = 0
+        for chunk in self._iter_chunks(record):
+            file_hash.update(chunk)
+            size += len(chunk)
+
+        if (size != record["size"]) or (file_hash.hexdigest() != version):
+            raise ArtifactIntegrityError(f"Version {version} doesn't match its hash")
+
+    def versions(self, model_name):
+        """Lists the versions of a model, oldest first."""
+
+        model = self._read_manifest()["models"].get(model_name)
+
+        return [] if model is None else [entry["version"] for entry in model["versions"]]
+
+    def production_version(self, model_name):
+        """Gets the version of a model in production, None if there is none."""
+
+        model = self._read_manifest()["models"].get(model_name)
+
+        return None if model is None else model["production"]
+
+    def production_model_names(self):
+        """Lists the models with a version in production, in name order."""
+
+        return sorted(
+            model_name
+            for model_name, model in self._read_manifest()["models"].items()
+            if model["production"] is not None
+        )
+
+    def promote(self, model_name, version):
+        """Puts a stored version of a model in production.
+
+        The version is verified first, the manifest then points at it in one atomic
+        replace, so loaders see either the old or the new version.
+
+        Parameters
+        ----------
+        model_name : str
+            The model to promote a version of.
+        version : str
+            One of the model's stored versions.
+        """
+
+        if version not in self.versions(model_name):
+            raise ValueError(f"No version {version} of model {model_name}")
+
+        self.verify(version)
+        with self._locked() as manifest:
+            manifest["models"][model_name]["production"] = version
+
+        logger.info(f"Promoted {model_name} version {version[:12]} to production")
+
+    def checkout(self, version):
+        """Gets a path of a version's file, assembling it from its chunks if needed.
+
+        The file is assembled into a temporary file while hashing it and only moved
+        into place if it matches the version. Later checkouts of the version reuse
+        it without reading it while it's unchanged since, so memory mapped binary
+        models still load in constant time. A file changed since is hashed again
+        and assembled anew if it no longer matches.
+
+        Parameters
+        ----------
+        version : str
+            The version to check out.
+
+        Returns
+        -------
+        str
+            The path of the file, with the file name it was stored with.
+        """
+
+        record = self.read_version(version)
+        checkout_dir = self._checkout_dir(version)
+        path = os.path.join(checkout_dir, record["file_name"])
+        if self._is_checked_out(path, record):
+            return path
+
+        os.makedirs(checkout_dir, exist_ok=True)
+        file_hash = hashlib.sha256()
+
+        def hashed_chunks():
+            for chunk in self._iter_chunks(record):
+                file_hash.update(chunk)
+                yield chunk
+
+        handle, tmp_path = tempfile.mkstemp(dir=checkout_dir, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as f:
+                for chunk in hashed_chunks():
+                    f.write(chunk)
+            if file_hash.hexdigest() != version:
+                raise ArtifactIntegrityError(f"Version {version} doesn't match its hash")
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self._write_stamp(path)
+
+        return path
+
+    def _stamp_path(self, path):
+        return f"{path}.stamp"
+
+    def _write_stamp(self, path):
+        stat = os.stat(path)
+        stamp = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        _write_atomic(self._stamp_path(path), [json.dumps(stamp).encode("utf8")])
+
+    def _is_checked_out(self, path, record):
+        """Checks a checked out file still holds its version."""
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if stat.st_size != record["size"]:
+            return False
+
+        try:
+            with open(self._stamp_path(path), encoding="utf8") as f:
+                stamp = json.load(f)
+        except (FileNotFoundError, ValueError):
+            stamp = None
+        if stamp == {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}:
+            return True
+
+        # changed since it was checked out, or checked out before stamps were written
+        file_hash = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+                file_hash.update(block)
+        if file_hash.hexdigest() != record["version"]:
+            logger.warning(f"Checked out file {path} doesn't match its version")
+            return False
+
+        self._write_stamp(path)
+
+        return True
+
+    def production_path(self, model_name):
+        """Gets the checked out file of a model's production version.
+
+        Returns
+        -------
+        str or None
+            The path of the file, None if the model has no version in production.
+        """
+
+        version = self.production_version(model_name)
+
+        return None if version is None else self.checkout(version)
+
+    def prune(self, model_name, keep=3):
+        """Forgets all but the newest versions of a model.
+
+        The version in production is always kept. Run collect_garbage to delete
+        what the forgotten versions stored.
+
+        Parameters
+        ----------
+        model_name : str
+            The model to prune.
+        keep : int, optional
+            How many of the newest versions to keep, by default 3
+
+        Returns
+        -------
+        list of str
+            The versions forgotten.
+        """
+
+        with self._locked() as manifest:
+            model = manifest["models"].get(model_name)
+            if model is None:
+                return []
+            kept = model["versions"][-keep:] if keep > 0 else []
+            removed = [
+                entry
+                for entry in model["versions"]
+                if (entry not in kept) and (entry["version"] != model["production"])
+            ]
+            model["versions"] = [entry for entry in model["versions"] if entry not in removed]
+
+        return [entry["version"] for entry in removed]
+
+    def collect_garbage(self, keep_checkouts=False):
+        """Removes the versions, chunks and checkouts no model refers to any more.
+
+        Parameters
+        ----------
+        keep_checkouts : bool, optional
+            Keep the checked out files of versions that are not in production, by
+            default False
+
+        Returns
+        -------
+        int
+            Bytes freed.
+        """
+
+        num_bytes = 0
+        with self._locked(save=False) as manifest:
+            live_versions = {
+                entry["version"]
+                for model in manifest["models"].values()
+                for entry in model["versions"]
+            }
+            production_versions = {
+                model["production"] for model in manifest["models"].values()
+            }
+            live_chunks = set()
+            for version in live_versions:
+                live_chunks.update(self.read_version(version)["chunks"])
+
+            def remove(path):
+                nonlocal num_bytes
+                num_bytes += os.path.getsize(path)
+                os.remove(path)
+
+            versions_dir = os.path.join(self.root, "versions")
+            for file_name in _list_dir(versions_dir):
+                if file_name[: -len(".json")] not in live_versions:
+                    remove(os.path.join(versions_dir, file_name))
+
+            blobs_dir = os.path.join(self.root, "blobs")
+            for dir_path, _, file_names in os.walk(blobs_dir):
+                for file_name in file_names:
+                    if file_name not in live_chunks:
+                        remove(os.path.join(dir_path, file_name))
+
+            checkouts_dir = os.path.join(self.root, "checkouts")
+            kept = live_versions if keep_checkouts else production_versions
+            for version in _list_dir(checkouts_dir):
+                if version in kept:
+                    continue
+                checkout_dir = os.path.join(checkouts_dir, version)
+                for file_name in os.listdir(checkout_dir):
+                    remove(os.path.join(checkout_dir, file_name))
+                os.rmdir(checkout_dir)
+
+        return num_bytes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the model artifact store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    put_parser = subparsers.add_parser("put", help="Store a model file as a version")
+    put_parser.add_argument("model_name")
+    put_parser.add_argument("path")
+    put_parser.add_argument("--promote", action="store_true")
+
+    promote_parser = subparsers.add_parser("promote", help="Put a version in production")
+    promote_parser.add_argument("model_name")
+    promote_parser.add_argument("version")
+
+    verify_parser = subparsers.add_parser(
+        "verify", help="Check every version of a model against its hashes"
+    )
+    verify_parser.add_argument("model_name")
+
+    prune_parser = subparsers.add_parser(
+        "prune", help="Forget all but the newest versions of a model"
+    )
+    prune_parser.add_argument("model_name")
+    prune_parser.add_argument("--keep", type=int, default=3)
+
+    subparsers.add_parser("gc", help="Remove what no model refers to")
+    args = parser.parse_args()
+
+    store = ArtifactStore()
+    if args.command == "put":
+        version = store.put(args.model_name, args.path)
+        if args.promote:
+            store.promote(args.model_name, version)
+        print(version)
+    elif args.command == "promote":
+        store.promote(args.model_name, args.version)
+    elif args.command == "prune":
+        for version in store.prune(args.model_name, keep=args.keep):
+            print(f"Forgot {version}")
+    elif args.command == "verify":
+        for version in store.versions(args.model_name):
+            store.verify(version)
+            print(f"{version} ok")
+    else:
+        print(f"Freed {store.collect_garbage()} bytes")
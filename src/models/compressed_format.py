@@ -0,0 +1,463 @@
+"""Compressed format for Markov model weights, for storing and shipping models.
+
+Layout of a model file, all integers little endian:
+
+    magic          4 bytes, b"MLMZ"
+    version        uint32
+    codec          8 bytes, ascii name of the codec, padded with null bytes
+    payload        the compressed header and sections
+
+The decompressed payload is a uint32 header length, the utf-8 JSON header with the
+model metadata and the offset, dtype and length of every section, then the
+sections. Arrays are packed before compression: n-gram ids are stored as the
+differences between consecutive ids, offsets as row lengths, and both in the
+smallest unsigned type holding them. The cumulative probabilities and row totals
+aren't stored, they are rebuilt from the weights when the model is read. n-gram
+ids overflowing int64 are stored as the codes of every n-gram instead.
+
+Counts can be quantized to uint16 or uint8. The counts of every row whose largest
+count doesn't fit are scaled down, rounded and kept at 1 or more, so every
+transition can still be sampled. Quantizing is refused when any probability would
+move by more than max_error.
+
+Quantized counts aren't true occurence counts anymore, so models read with
+quantized counts can't be updated with partial_fit, retrain them instead. Unlike
+binary models, compressed models are read fully into memory.
+
+    python -m src.models.compressed_format report model.mlmm
+"""
+
+import argparse
+import gzip
+import json
+import lzma
+import os
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+from src.models.ngram_engine import codes_to_ngram_ids, ngram_id_codes
+
+try:
+    import zstandard
+except ImportError:
+    # zstd is optional, gzip and lzma are always available
+    zstandard = None
+
+MAGIC = b"MLMZ"
+FORMAT_VERSION = 1
+FILE_EXTENSION = ".mlmz"
+
+_PREAMBLE = struct.Struct("<4sI8s")
+_HEADER_LENGTH = struct.Struct("<I")
+
+# sections are aligned so the arrays read from the payload are aligned too
+_SECTION_ALIGNMENT = 8
+
+CODECS = ("gzip", "lzma", "zstd")
+DEFAULT_CODEC = "gzip"
+
+# quantizations of the counts, None keeps them exact
+QUANTIZATIONS = {None: None, "uint16": np.uint16, "uint8": np.uint8}
+
+# largest change of any transition probability quantizing may cause
+DEFAULT_MAX_ERROR = 1e-3
+
+
+class QuantizationError(ValueError):
+    """Raised when quantized counts would change probabilities by more than allowed."""
+
+
+def _compress(codec, data):
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if codec == "lzma":
+        return lzma.compress(data, preset=6)
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("The zstd codec needs the zstandard package installed")
+        return zstandard.ZstdCompressor(level=19).compress(data)
+
+    raise ValueError(f"Invalid codec {codec}, expect one of {list(CODECS)}")
+
+
+def _decompress(codec, data):
+    if codec == "gzip":
+        return gzip.decompress(data)
+    if codec == "lzma":
+        return lzma.decompress(data)
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("Reading zstd models needs the zstandard package installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def available_codecs():
+    """Lists the codecs usable in this environment."""
+
+    return [codec for codec in CODECS if codec != "zstd" or zstandard is not None]
+
+
+def _smallest_uint(values):
+    max_value = int(values.max()) if len(values) else 0
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+
+
+def _row_probabilities(weights, offsets):
+    totals = np.add.reduceat(weights, offsets[:-1], dtype=np.float64)
+
+    return weights / np.repeat(totals, np.diff(offsets))
+
+
+def quantize_counts(weights, offsets, dtype):
+    """Scales the counts of every row to fit an unsigned integer type.
+
+    Rows whose counts all fit are kept exactly, the others are scaled so their
+    largest count is the largest value of the type. Scaled counts are rounded and
+    kept at 1 or more so no transition is lost.
+
+    Parameters
+    ----------
+    weights : np.ndarray
+        The counts or probabilities of every transition.
+    offsets : np.ndarray
+        Start of each row's transitions, one longer than the number of rows.
+    dtype : type
+        np.uint16 or np.uint8.
+
+    Returns
+    -------
+    quantized : np.ndarray
+        The counts of every transition in dtype.
+    max_error : float
+        The largest change of any transition probability.
+    """
+
+    if len(weights) == 0:
+        return np.zeros(0, dtype=dtype), 0.0
+
+    max_value = np.iinfo(dtype).max
+    row_lengths = np.diff(offsets)
+    row_max = np.maximum.reduceat(weights, offsets[:-1]).astype(np.float64)
+    # probabilities are always scaled, counts only in rows too large for the type
+    is_count = np.issubdtype(weights.dtype, np.integer)
+    scales = max_value / row_max
+    if is_count:
+        scales = np.minimum(scales, 1.0)
+
+    scaled = np.rint(weights * np.repeat(scales, row_lengths))
+    quantized = np.clip(scaled, 1, max_value).astype(dtype)
+
+    max_error = float(
+        np.abs(
+            _row_probabilities(weights, offsets) - _row_probabilities(quantized, offsets)
+        ).max()
+    )
+
+    return quantized, max_error
+
+
+def _aligned(offset):
+    return -(-offset // _SECTION_ALIGNMENT) * _SECTION_ALIGNMENT
+
+
+def write_compressed_model(
+    path,
+    markov_model_dict,
+    codec=DEFAULT_CODEC,
+    quantize=None,
+    max_error=DEFAULT_MAX_ERROR,
+):
+    """Writes model weights in the compressed format.
+
+    Parameters
+    ----------
+    path : str
+        Where to write the model file.
+    markov_model_dict : dict
+        The model weights, see write_binary_model.
+    codec : str, optional
+        "gzip", "lzma" or "zstd", by default "gzip"
+    quantize : str, optional
+        "uint16" or "uint8" to quantize the counts, "auto" for the smallest of them
+        within max_error, by default None to keep them exact.
+    max_error : float, optional
+        Largest change of any transition probability quantizing may cause, by
+        default 1e-3
+
+    Returns
+    -------
+    dict
+        The "quantize" type used and the "max_error" it caused.
+
+    Raises
+    ------
+    QuantizationError
+        If the requested quantization changes a probability by more than max_error.
+    """
+
+    if quantize not in QUANTIZATIONS and quantize != "auto":
+        raise ValueError(
+            f"Invalid quantization {quantize}, expect one of "
+            f"{list(QUANTIZATIONS) + ['auto']}"
+        )
+
+    table = markov_model_dict["transition_table"]
+    weights = np.asarray(table.weights)
+    offsets = np.asarray(table.offsets)
+
+    error = 0.0
+    if quantize is not None:
+        candidates = ["uint8", "uint16"] if quantize == "auto" else [quantize]
+        for candidate in candidates:
+            quantized, error = quantize_counts(weights, offsets, QUANTIZATIONS[candidate])
+            if error <= max_error:
+                quantize, weights = candidate, quantized
+                break
+        else:
+            if quantize != "auto":
+                raise QuantizationError(
+                    f"Quantizing to {quantize} changes probabilities by up to "
+                    f"{error:.2g}, more than the allowed {max_error:.2g}"
+                )
+            quantize, error = None, 0.0
+
+    if quantize is None and np.issubdtype(weights.dtype, np.integer):
+        weights = weights.astype(_smallest_uint(weights))
+
+    ngram_ids = np.asarray(table.ngram_ids)
+    if ngram_ids.dtype == object:
+        ngram_codes = ngram_id_codes(ngram_ids, table.n, table.base).reshape(-1)
+        arrays = {"ngram_codes": ngram_codes.astype(_smallest_uint(ngram_codes))}
+        first_ngram_id = 0
+    else:
+        id_deltas = np.diff(ngram_ids)
+        arrays = {"ngram_id_deltas": id_deltas.astype(_smallest_uint(id_deltas))}
+        first_ngram_id = int(ngram_ids[0]) if len(ngram_ids) else 0
+    row_lengths = np.diff(offsets)
+    arrays.update(
+        {
+            "row_lengths": row_lengths.astype(_smallest_uint(row_lengths)),
+            "next_codes": np.asarray(table.next_codes),
+            "weights": weights,
+        }
+    )
+
+    sections = {}
+    position = 0
+    for name, array in arrays.items():
+        position = _aligned(position)
+        sections[name] = {
+            "offset": position,
+            "dtype": array.dtype.newbyteorder("<").str,
+            "length": len(array),
+        }
+        position += array.nbytes
+
+    header = {
+        "model_name": markov_model_dict["model_name"],
+        "n": markov_model_dict["n"],
+        "corpus_type": markov_model_dict["corpus_type"],
+        "start_prompts": list(markov_model_dict["start_prompts"]),
+        "tokenizer": markov_model_dict.get("tokenizer"),
+        "alphabet": table.alphabet,
+        "first_ngram_id": first_ngram_id,
+        # weights quantized before they were passed in stay quantized
+        "quantize": table.quantize if quantize is None else quantize,
+        "max_error": error,
+        "sections": sections,
+    }
+    header_bytes = json.dumps(header).encode("utf8")
+    data_start = _aligned(_HEADER_LENGTH.size + len(header_bytes))
+
+    payload = bytearray(data_start + position)
+    _HEADER_LENGTH.pack_into(payload, 0, len(header_bytes))
+    payload[_HEADER_LENGTH.size : _HEADER_LENGTH.size + len(header_bytes)] = header_bytes
+    for name, array in arrays.items():
+        start = data_start + sections[name]["offset"]
+        data = array.astype(sections[name]["dtype"], copy=False).tobytes()
+        payload[start : start + len(data)] = data
+
+    compressed = _compress(codec, bytes(payload))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, codec.encode("ascii")))
+        f.write(compressed)
+    os.replace(tmp_path, path)
+
+    return {"quantize": quantize, "max_error": error}
+
+
+def read_compressed_model(path):
+    """Reads a compressed model file.
+
+    Parameters
+    ----------
+    path : str
+        The model file to read.
+
+    Returns
+    -------
+    dict
+        The model weights in the same layout as the pickled weights.
+    """
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    magic, version, codec = _PREAMBLE.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a compressed Markov model file")
+    if version != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported model format version {version}, expected {FORMAT_VERSION}"
+        )
+
+    payload = _decompress(codec.rstrip(b"\0").decode("ascii"), data[_PREAMBLE.size :])
+    (header_length,) = _HEADER_LENGTH.unpack_from(payload, 0)
+    header = json.loads(payload[_HEADER_LENGTH.size : _HEADER_LENGTH.size + header_length])
+    data_start = _aligned(_HEADER_LENGTH.size + header_length)
+
+    arrays = {}
+    for name, section in header["sections"].items():
+        arrays[name] = np.frombuffer(
+            payload,
+            dtype=np.dtype(section["dtype"]),
+            count=section["length"],
+            offset=data_start + section["offset"],
+        )
+
+    num_rows = len(arrays["row_lengths"])
+    if "ngram_codes" in arrays:
+        ngram_codes = arrays["ngram_codes"].reshape(num_rows, header["n"])
+        ngram_ids = codes_to_ngram_ids(ngram_codes, len(header["alphabet"]))
+    else:
+        ngram_ids = np.full(num_rows, header["first_ngram_id"], dtype=np.int64)
+        ngram_ids[1:] += np.cumsum(arrays["ngram_id_deltas"].astype(np.int64))
+
+    offsets = np.zeros(num_rows + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(arrays["row_lengths"].astype(np.int64))
+
+    return {
+        "model_name": header["model_name"],
+        "n": header["n"],
+        "corpus_type": header["corpus_type"],
+        "start_prompts": header["start_prompts"],
+        "tokenizer": header.get("tokenizer"),
+        # the cdf and row totals are rebuilt by TransitionTable.from_state
+        "transition_table": {
+            "alphabet": header["alphabet"],
+            "n": header["n"],
+            "ngram_ids": ngram_ids,
+            "offsets": offsets,
+            "next_codes": arrays["next_codes"],
+            "weights": arrays["weights"],
+            "quantize": header["quantize"],
+        },
+    }
+
+
+def format_report(markov_model_dict, codecs=None, max_error=DEFAULT_MAX_ERROR):
+    """Measures the size and load time of a model in every file format.
+
+    Parameters
+    ----------
+    markov_model_dict : dict
+        The model weights, see MarkovModel.get_weights.
+    codecs : list of str, optional
+        Codecs to compress with, by default every available codec.
+    max_error : float, optional
+        Error bound of the quantized formats, by default 1e-3
+
+    Returns
+    -------
+    list of dict
+        The "format", "codec", "quantize", file "bytes", "load_seconds" to a
+        transition table and "max_error" of every format, quantizations beyond the
+        bound are left out.
+    """
+
+    from src.models.markov_model import read_model_file
+    from src.models.model_format import write_binary_model
+    from src.models.transition_table import TransitionTable
+
+    codecs = available_codecs() if codecs is None else codecs
+
+    def measure(path):
+        # loading includes rebuilding the cdf of formats that don't store it
+        start = time.perf_counter()
+        TransitionTable.from_state(read_model_file(path)["transition_table"])
+        return os.path.getsize(path), time.perf_counter() - start
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "model.mlmm")
+        write_binary_model(path, markov_model_dict)
+        num_bytes, load_seconds = measure(path)
+        rows.append(
+            {
+                "format": "binary",
+                "codec": None,
+                "quantize": None,
+                "bytes": num_bytes,
+                "load_seconds": load_seconds,
+                "max_error": 0.0,
+            }
+        )
+
+        for codec in codecs:
+            for quantize in QUANTIZATIONS:
+                path = os.path.join(tmp_dir, f"model-{codec}-{quantize}{FILE_EXTENSION}")
+                try:
+                    written = write_compressed_model(
+                        path,
+                        markov_model_dict,
+                        codec=codec,
+                        quantize=quantize,
+                        max_error=max_error,
+                    )
+                except QuantizationError:
+                    continue
+                num_bytes, load_seconds = measure(path)
+                rows.append(
+                    {
+                        "format": "compressed",
+                        "codec": codec,
+                        "quantize": quantize,
+                        "bytes": num_bytes,
+                        "load_seconds": load_seconds,
+                        "max_error": written["max_error"],
+                    }
+                )
+
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report the size and load time of a model in every file format."
+    )
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("model_path", help="A .pkl, .mlmm or .mlmz model file")
+    parser.add_argument("--max-error", type=float, default=DEFAULT_MAX_ERROR)
+    args = parser.parse_args()
+
+    from src.models.markov_model import MarkovModel, read_model_file
+
+    model = MarkovModel()
+    model._set_weights(None, read_model_file(args.model_path))
+    weights = model.get_weights()
+
+    for row in format_report(weights, max_error=args.max_error):
+        print(
+            f"{row['format']:>10} {str(row['codec']):>5} {str(row['quantize']):>6} "
+            f"{row['bytes'] / 2**20:9.2f}MB load {row['load_seconds'] * 1000:8.1f}ms "
+            f"max error {row['max_error']:.2g}"
+        )
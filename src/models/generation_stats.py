@@ -0,0 +1,92 @@
+import threading
+
+
+class AcceptanceStats:
+    def __init__(self):
+        """Counts how many generated candidates pass validation."""
+
+        self.candidates = 0
+        self.accepted = 0
+        self._lock = threading.Lock()
+
+    def record(self, accepted):
+        """Records the validation result of one candidate.
+
+        Parameters
+        ----------
+        accepted : bool
+            Whether the candidate passed validation.
+        """
+
+        with self._lock:
+            self.candidates += 1
+            if accepted:
+                self.accepted += 1
+
+    @property
+    def acceptance_rate(self):
+        """Fraction of candidates that passed validation, None before any candidate."""
+
+        if self.candidates == 0:
+            return None
+
+        return self.accepted / self.candidates
+
+    def as_dict(self):
+        return {
+            "candidates": self.candidates,
+            "accepted": self.accepted,
+            "acceptance_rate": self.acceptance_rate,
+        }
+
+
+# acceptance statistics of every model in the process, keyed by (model_name, corpus_type)
+_acceptance_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_acceptance_stats(model_name, corpus_type):
+    """Gets the acceptance statistics for a model, creating them on first use.
+
+    Parameters
+    ----------
+    model_name : str
+        Name of the model generating candidates.
+    corpus_type : str
+        The corpus type of the model.
+
+    Returns
+    -------
+    AcceptanceStats
+        The shared statistics of the model.
+    """
+
+    key = (model_name, corpus_type)
+    with _stats_lock:
+        if key not in _acceptance_stats:
+            _acceptance_stats[key] = AcceptanceStats()
+
+        return _acceptance_stats[key]
+
+
+def acceptance_report():
+    """Summarises the acceptance statistics of every model.
+
+    Returns
+    -------
+    dict
+        Mapping of "{model_name}/{corpus_type}" to its candidate and acceptance counts.
+    """
+
+    with _stats_lock:
+        return {
+            f"{model_name}/{corpus_type}": stats.as_dict()
+            for (model_name, corpus_type), stats in _acceptance_stats.items()
+        }
+
+
+def reset_acceptance_stats():
+    """Clears the acceptance statistics of every model."""
+
+    with _stats_lock:
+        _acceptance_stats.clear()
@@ -0,0 +1,264 @@
+"""Opt in timings and counters for the training, generation and posting hot paths.
+
+Instrumentation is off unless enabled with enable() or the MARKOV_INSTRUMENTATION
+environment variable. While off, timed() returns a shared no-op context manager and
+increment() returns straight away, so instrumented code pays one flag check.
+
+Recorded metrics are exported with report() as a dict for JSON, or with
+to_prometheus() in the Prometheus text exposition format. profile() captures a
+cProfile of any block of code, independent of the metrics.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("markov-model")
+
+_enabled = os.getenv("MARKOV_INSTRUMENTATION", "") not in ("", "0", "false")
+_lock = threading.Lock()
+
+# (name, labels) -> [count, total seconds, max seconds]
+_timers = {}
+# (name, labels) -> total
+_counters = {}
+
+
+def enable():
+    """Starts recording metrics."""
+
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Stops recording metrics, already recorded ones are kept."""
+
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Clears every recorded metric."""
+
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+
+def observe(name, seconds, count=1, labels=None):
+    """Records a duration.
+
+    Parameters
+    ----------
+    name : str
+        The timer name.
+    seconds : float
+        The measured duration.
+    count : int, optional
+        How many events the duration covers, e.g. characters sampled, so the
+        exported mean is the time per event, by default 1
+    labels : dict, optional
+        Label values distinguishing this series, e.g. the model name, by default None
+    """
+
+    if not _enabled:
+        return
+
+    key = _key(name, labels)
+    with _lock:
+        timer = _timers.setdefault(key, [0, 0.0, 0.0])
+        timer[0] += count
+        timer[1] += seconds
+        timer[2] = max(timer[2], seconds / max(count, 1))
+
+
+def increment(name, value=1, labels=None):
+    """Adds to a counter.
+
+    Parameters
+    ----------
+    name : str
+        The counter name.
+    value : int, optional
+        How much to add, by default 1
+    labels : dict, optional
+        Label values distinguishing this series, by default None
+    """
+
+    if not _enabled:
+        return
+
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+class _Timer:
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        # set inside the block when it covers several events
+        self.count = 1
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(
+            self.name, time.perf_counter() - self.start, count=self.count, labels=self.labels
+        )
+        return False
+
+
+class _NullTimer:
+    count = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(name, labels=None):
+    """Times a block of code.
+
+    Set `count` on the returned timer inside the block when it covers several events.
+
+    Parameters
+    ----------
+    name : str
+        The timer name.
+    labels : dict, optional
+        Label values distinguishing this series, by default None
+
+    Returns
+    -------
+    context manager
+        Records the block's duration on exit, a no-op when instrumentation is off.
+    """
+
+    if not _enabled:
+        return _NULL_TIMER
+
+    return _Timer(name, labels)
+
+
+def report():
+    """Gets every recorded metric.
+
+    Returns
+    -------
+    dict
+        "timers" with the count, total, mean and max seconds of every timer and
+        "counters" with every counter total, keyed by name then label string.
+    """
+
+    def label_string(labels):
+        return ",".join(f"{name}={value}" for name, value in labels)
+
+    with _lock:
+        timers = {}
+        for (name, labels), (count, total, max_seconds) in _timers.items():
+            timers.setdefault(name, {})[label_string(labels)] = {
+                "count": count,
+                "total_seconds": total,
+                "mean_seconds": total / count if count else None,
+                "max_seconds": max_seconds,
+            }
+        counters = {}
+        for (name, labels), total in _counters.items():
+            counters.setdefault(name, {})[label_string(labels)] = total
+
+    return {"timers": timers, "counters": counters}
+
+
+def to_prometheus():
+    """Gets every recorded metric in the Prometheus text exposition format.
+
+    Timers are exported as summaries with _count and _sum series, counters as
+    counters.
+
+    Returns
+    -------
+    str
+        The exposition text.
+    """
+
+    def series(name, labels, value):
+        label_text = ",".join(f'{label}="{label_value}"' for label, label_value in labels)
+        if label_text:
+            return f"{name}{{{label_text}}} {value}"
+        return f"{name} {value}"
+
+    with _lock:
+        timers = sorted(_timers.items())
+        counters = sorted(_counters.items())
+
+    lines = []
+    for name in sorted({name for (name, _), _ in timers}):
+        lines.append(f"# TYPE {name} summary")
+        for (timer_name, labels), (count, total, _) in timers:
+            if timer_name == name:
+                lines.append(series(f"{name}_count", labels, count))
+                lines.append(series(f"{name}_sum", labels, repr(total)))
+    for name in sorted({name for (name, _), _ in counters}):
+        lines.append(f"# TYPE {name} counter")
+        for (counter_name, labels), total in counters:
+            if counter_name == name:
+                lines.append(series(name, labels, total))
+
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def profile(output_path=None, sort="cumulative", limit=30):
+    """Captures a cProfile of a block of code.
+
+    Parameters
+    ----------
+    output_path : str, optional
+        Where to dump the raw profile for pstats or snakeviz, by default None to only
+        log the top functions.
+    sort : str, optional
+        pstats sort key of the logged functions, by default "cumulative"
+    limit : int, optional
+        How many functions to log, by default 30
+
+    Yields
+    ------
+    cProfile.Profile
+        The running profiler.
+    """
+
+    # profiling modules are only imported when profiling
+    import cProfile
+    import io
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if output_path is not None:
+            profiler.dump_stats(output_path)
+        stats_text = io.StringIO()
+        pstats.Stats(profiler, stream=stats_text).sort_stats(sort).print_stats(limit)
+        logger.info(f"Profile:\n{stats_text.getvalue()}")
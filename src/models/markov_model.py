@@ -1,39 +1,181 @@
 import os
+import math
+import time
 
 import numpy as np
 from collections import defaultdict, Counter
 import pickle
 import logging
-
-cur_dir = os.getcwd()
+import threading
+
+from src.models.ngram_engine import (
+    codepoints_to_text,
+    encode_alphabet,
+    encode_corpus_codepoints,
+    text_to_codepoints,
+    SentenceReservoir,
+    encode_with_alphabet,
+    count_transitions,
+    merge_transition_counts,
+    remap_codes,
+    remap_ngram_ids,
+    ChunkedEncoder,
+)
+from src.models.parallel_counting import count_transitions_parallel
+from src.models.transition_table import TransitionTable, TransitionDictView
+from src.models.generation_stats import get_acceptance_stats
+from src.models.post_processing import PostProcessor
+from src.models import instrumentation
+from src.models.model_format import (
+    FILE_EXTENSION as BINARY_EXTENSION,
+    read_binary_model,
+    write_binary_model,
+)
+from src.models.compressed_format import (
+    DEFAULT_CODEC,
+    DEFAULT_MAX_ERROR,
+    FILE_EXTENSION as COMPRESSED_EXTENSION,
+    read_compressed_model,
+    write_compressed_model,
+)
+from src.data.corpus import DEFAULT_CHUNK_SIZE
+from src.features.build_features import CharacterTokenizer, tokenizer_from_state
+from src.config import get_settings
+from src.models.artifact_store import ArtifactStore
+
+# number of sentences sampled across the corpus as start prompts, only their first n
+# characters are kept
+NUM_START_PROMPTS = 1000
+
+# extension of the append only log of counts added by partial_fit
+DELTA_EXTENSION = ".deltas"
+
+# number of chunk counts accumulated before merging them when streaming a corpus
+MERGE_EVERY_CHUNKS = 16
+
+# lowest acceptance rate assumed when sizing a batch of candidates
+MIN_ACCEPTANCE_RATE = 0.05
 
 logger = logging.getLogger("markov-model")
 
 
-try:
-    SRC_PATH = cur_dir[
-        : cur_dir.index("my-little-markov-model") + len("my-little-markov-model")
-    ]
-except ValueError as e:
-    logger.info(
-        "ValueError: No parent directory by name my-little-markov-model, assumed to be running in container. "
-        "Setting src path to code/my-little-markov-model"
-    )
-    SRC_PATH = "code/my-little-markov-model"
+def read_model_file(model_path):
+    """Reads model weights from a .pkl, binary .mlmm or compressed .mlmz file.
+
+    Parameters
+    ----------
+    model_path : str
+        The saved model file.
+
+    Returns
+    -------
+    dict
+        The model weights, see MarkovModel.get_weights.
+    """
+
+    if model_path.endswith(BINARY_EXTENSION):
+        return read_binary_model(model_path)
+    if model_path.endswith(COMPRESSED_EXTENSION):
+        return read_compressed_model(model_path)
+
+    with open(model_path, "rb") as f:  # "rb" because we want to read in binary mode
+        return pickle.load(f)
+
+
+class GenerationBudgetExceeded(RuntimeError):
+    """Raised when no valid text is generated within the attempt or time budget."""
 
 
 class MarkovModel:
-    def __init__(self):
-        """Creates a MarkovModel object."""
+    def __init__(self, random_state=None):
+        """Creates a MarkovModel object.
 
+        Parameters
+        ----------
+        random_state : int or np.random.Generator, optional
+            Seed or generator used for all sampling so generated text can be
+            reproduced, by default None for a fresh unseeded generator.
+        """
+
+        self.rng = np.random.default_rng(random_state)
         self.n = None
         self.model_name = None
-        self.letter_probabilities = None
+        self.transitions = None
         self.start_prompts = None
         self.corpus_type = None
+        self._post_processor = None
+        self.tokenizer = CharacterTokenizer()
+        self._space_codes = None
+        # transition counts added by partial_fit since the model was last saved
+        self.pending_deltas = []
+        # the random generator and code caches are shared by every thread generating
+        # with the model, like the generation server's workers and pool refiller
+        self._generation_lock = threading.RLock()
+
+    @property
+    def start_prompts(self):
+        """The first n characters of sentences sampled across the corpus."""
+
+        return self._start_prompts
+
+    @start_prompts.setter
+    def start_prompts(self, start_prompts):
+        self._start_prompts = start_prompts
+        self._start_prompt_codes = None
+
+    @property
+    def post_processor(self):
+        """The trimming and validation rules of the model's corpus type."""
+
+        if (self._post_processor is None) or (
+            self._post_processor.corpus_type != self.corpus_type
+        ):
+            self._post_processor = PostProcessor(self.corpus_type)
+
+        return self._post_processor
+
+    @property
+    def letter_probabilities(self):
+        """Dict view of the next letter probabilities for every n-gram.
+
+        Converts rows of the compact transition table on access, kept for callers
+        expecting the original dict of dicts format.
+        """
+
+        if self.transitions is None:
+            return None
+
+        return TransitionDictView(self.transitions)
+
+    @letter_probabilities.setter
+    def letter_probabilities(self, ngram_dict):
+        if ngram_dict is None:
+            self.transitions = None
+        else:
+            self.transitions = TransitionTable.from_dict(ngram_dict, self.n)
+
+    @property
+    def nbytes(self):
+        """Size of the model weights in bytes, 0 before the model is trained or loaded."""
+
+        if self.transitions is None:
+            return 0
+
+        return self.transitions.nbytes
 
     def fit_corpus(
-        self, model_name, corpus, n, corpus_type, retrain=False, save_model=False
+        self,
+        model_name,
+        corpus,
+        n,
+        corpus_type,
+        retrain=False,
+        save_model=False,
+        engine="numpy",
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        workers=1,
+        num_start_prompts=NUM_START_PROMPTS,
+        tokenizer=None,
     ):
         """Generates next letter probability for every n-gram.
 
@@ -41,8 +183,9 @@ class MarkovModel:
         ----------
         model_name : str
             Name of the model ro be used for internal reference and exporting of weights
-        corpus : str
-            Full text file for which to generate the ngram results for.
+        corpus : str or Corpus
+            Full text file for which to generate the ngram results for, or a Corpus
+            to stream the text of all its files from disk in chunks.
         n : int
             How large the n-grams should be.
         corpus_type : str
@@ -53,11 +196,34 @@ class MarkovModel:
             and n-gram size if it already exists, by default False so it loads existing weights
         save_model : bool, optional
             Whether to save off the model weights under the models folder, by default False
+        engine : str, optional
+            Which counting engine to train with, "numpy" counts integer coded n-grams in
+            bulk array operations, "python" uses the original character loop. Both produce
+            the same probabilities, by default "numpy". Streamed corpuses are always
+            counted with the numpy engine.
+        chunk_size : int, optional
+            Characters read at a time when streaming a Corpus, by default 2**20
+        workers : int, optional
+            How many processes the numpy engine counts an in memory corpus with, None
+            uses every core. The counts are identical for any number of workers, by
+            default 1
+        num_start_prompts : int, optional
+            How many sentences to sample across the corpus as start prompts, by
+            default 1000
+        tokenizer : CharacterTokenizer, optional
+            Splits the encoded corpus into the tokens chained by the model, n counts
+            tokens. A WordTokenizer or SubwordTokenizer from src.features.build_features
+            generates text in fewer steps, use a smaller n with them, by default None
+            for characters
         """
 
+        if engine not in ("numpy", "python"):
+            raise ValueError(f"Invalid engine {engine}, expect one of 'numpy', 'python'")
+
         self.n = n
         self.model_name = model_name
         self.corpus_type = corpus_type
+        self.tokenizer = CharacterTokenizer() if tokenizer is None else tokenizer
         if retrain == False:
             try:
                 self.load_model_weights(self.model_name, self.n)
@@ -68,105 +234,503 @@ class MarkovModel:
                 )
                 pass
 
-        # make text circular so Markov chain doesn't get stuck when generating
-        circ_text = corpus + corpus[: self.n]
+        if not isinstance(corpus, str):
+            self.transitions = self._count_ngrams_stream(
+                lambda: corpus.iter_chunks(chunk_size), num_start_prompts
+            )
+        else:
+            # make text circular so Markov chain doesn't get stuck when generating
+            circ_text = corpus + corpus[: self.n]
+
+            # the encoded corpus stays a code point array all the way to the counts
+            with instrumentation.timed("markov_encode_seconds"):
+                encoded_codepoints = encode_corpus_codepoints(circ_text)
+                if self.tokenizer.name != CharacterTokenizer.name:
+                    encoded_text = codepoints_to_text(encoded_codepoints)
+                    self.tokenizer.fit([encoded_text])
+                    encoded_codepoints = text_to_codepoints(
+                        self.tokenizer.encode(encoded_text)
+                    )
+
+            self.generate_start_prompts(encoded_codepoints, num_start_prompts)
+
+            if engine == "numpy":
+                self.transitions = self._count_ngrams_numpy(encoded_codepoints, workers)
+            else:
+                self.transitions = TransitionTable.from_dict(
+                    self._count_ngrams_python(codepoints_to_text(encoded_codepoints)),
+                    self.n,
+                )
+
+        # counts are normalized into conditional probabilites on lookup
+        less_than_3 = int(np.count_nonzero(self.transitions.row_totals <= 3))
+        num_ngrams = len(self.transitions)
+
+        logger.info(
+            f"No of ngrams <3 occurences: {less_than_3}, total n_grams: {num_ngrams}, percent: {less_than_3/max(num_ngrams, 1)*100:.2f}%"
+        )
+
+        # option to export saved model to models folder
+        if save_model is True:
+            self.save_model_weights()
 
-        encoded_text = self.encode_corpus(circ_text)
+    def _count_ngrams_python(self, encoded_text):
+        """Counts letter occurences following ngram instances one character at a time.
 
-        self.generate_start_prompts(encoded_text)
+        Parameters
+        ----------
+        encoded_text : str
+            The encoded corpus text.
+
+        Returns
+        -------
+        defaultdict
+            Counts of the next letter keyed by n-gram.
+        """
 
-        # count letter occurences followin ngram instances
         ngram_dict = defaultdict(Counter)
         for i in range(0, len(encoded_text) - self.n):
             ngram_dict[encoded_text[i : i + self.n]][encoded_text[i + self.n]] += 1
 
-        # normalize counts into conditional probabilites
-        less_than_3 = 0
-        for ngram in ngram_dict:
-            sum_occurences = sum(ngram_dict[ngram].values())
-            if sum_occurences <= 3:
-                less_than_3 += 1
-            ngram_dict[ngram] = {
-                key: value / sum_occurences for key, value in ngram_dict[ngram].items()
-            }
+        return ngram_dict
 
-        logger.info(
-            f"No of ngrams <3 occurences: {less_than_3}, total n_grams: {len(ngram_dict)}, percent: {less_than_3/len(ngram_dict)*100:.2f}%"
-        )
+    def _count_ngrams_numpy(self, encoded_text, workers=1):
+        """Counts letter occurences following ngram instances with bulk array operations.
 
-        self.letter_probabilities = ngram_dict
+        Parameters
+        ----------
+        encoded_text : str or np.ndarray
+            The encoded corpus text or its code points.
+        workers : int, optional
+            How many processes to split the counting across, by default 1
 
-        # option to export saved model to models folder
-        if save_model is True:
-            self.save_model_weights()
+        Returns
+        -------
+        TransitionTable
+            Counts of the next letter for every n-gram.
+        """
+
+        with instrumentation.timed("markov_count_seconds"):
+            alphabet, codes = encode_alphabet(encoded_text)
+            context_ids, next_codes, counts = count_transitions_parallel(
+                codes, self.n, len(alphabet), workers=workers
+            )
+
+        # building the table computes the normalized cumulative probabilities
+        with instrumentation.timed("markov_normalize_seconds"):
+            return TransitionTable.from_transitions(
+                alphabet, self.n, context_ids, next_codes, counts
+            )
+
+    def _iter_encoded_chunks(self, iter_chunks):
+        """Encodes a chunked corpus, appending its first n characters to the end.
+
+        Parameters
+        ----------
+        iter_chunks : callable
+            Returns an iterator over the raw corpus text chunks.
+
+        Yields
+        ------
+        str
+            The next piece of encoded text.
+        """
+
+        encoder = ChunkedEncoder(self.encode_corpus)
+        head = ""
+        for chunk in iter_chunks():
+            if len(head) < self.n:
+                head += chunk[: self.n - len(head)]
+            yield encoder.feed(chunk)
+
+        # make text circular so Markov chain doesn't get stuck when generating
+        yield encoder.feed(head)
+        yield encoder.flush()
+
+    def _count_ngrams_stream(self, iter_chunks, num_start_prompts=NUM_START_PROMPTS):
+        """Counts letter occurences following ngram instances over a chunked corpus.
+
+        The corpus is read twice, first to find its alphabet and start prompts, then
+        to count every chunk with the last n codes of the previous chunk carried over
+        so n-grams spanning chunks are counted. Memory use is bounded by the chunk
+        size and number of distinct transitions rather than the corpus size.
+
+        Parameters
+        ----------
+        iter_chunks : callable
+            Returns a new iterator over the raw corpus text chunks on every call.
+        num_start_prompts : int, optional
+            How many sentences to sample as start prompts, by default 1000
 
-    def save_model_weights(self):
-        """Saves model weights into models/markov-models folder by model name."""
+        Returns
+        -------
+        TransitionTable
+            Counts of the next letter for every n-gram.
+        """
+
+        if self.tokenizer.name != CharacterTokenizer.name:
+            self.tokenizer.fit(self._iter_encoded_chunks(iter_chunks))
+
+        alphabet = set()
+        reservoir = self._start_prompt_reservoir(num_start_prompts)
+        for encoded_chunk in self._iter_encoded_chunks(iter_chunks):
+            encoded_chunk = self.tokenizer.encode(encoded_chunk)
+            alphabet.update(encoded_chunk)
+            reservoir.feed(text_to_codepoints(encoded_chunk))
+        self.start_prompts = reservoir.flush()
+        alphabet = "".join(sorted(alphabet))
+        base = len(alphabet)
+
+        parts = []
+        carry = np.zeros(0, dtype=np.int64)
+        for encoded_chunk in self._iter_encoded_chunks(iter_chunks):
+            encoded_chunk = self.tokenizer.encode(encoded_chunk)
+            codes = np.concatenate((carry, encode_with_alphabet(encoded_chunk, alphabet)))
+            with instrumentation.timed("markov_count_seconds"):
+                parts.append(count_transitions(codes, self.n, base))
+            carry = codes[-self.n :]
+            if len(parts) >= MERGE_EVERY_CHUNKS:
+                parts = [merge_transition_counts(parts, base, self.n)]
+
+        context_ids, next_codes, counts = merge_transition_counts(parts, base, self.n)
+
+        with instrumentation.timed("markov_normalize_seconds"):
+            return TransitionTable.from_transitions(
+                alphabet, self.n, context_ids, next_codes, counts
+            )
+
+    def get_weights(self):
+        """Gets the model weights and metadata needed to save the model.
+
+        Returns
+        -------
+        dict
+            The model name, n, start prompts, corpus type, tokenizer and transition
+            table.
+        """
 
-        pickle_dict = {
+        return {
             "model_name": self.model_name,
             "n": self.n,
             "start_prompts": self.start_prompts,
             "corpus_type": self.corpus_type,
-            "letter_probabilities": self.letter_probabilities,
+            "tokenizer": self.tokenizer.get_state(),
+            "transition_table": self.transitions,
         }
 
-        model_directory_path = os.path.join(
-            SRC_PATH, "models", "markov-models", self.model_name
+    def save_model_weights(
+        self,
+        file_format="pickle",
+        codec=DEFAULT_CODEC,
+        quantize=None,
+        max_error=DEFAULT_MAX_ERROR,
+    ):
+        """Saves model weights into the model folder of the settings by model name.
+
+        Weights of the same model and n saved in another format are removed along
+        with the delta log, so load_model_weights reads the weights just written.
+
+        Parameters
+        ----------
+        file_format : str, optional
+            "pickle" to write a .pkl file, "binary" to write the memory mapped .mlmm
+            format that loads in constant time, or "compressed" to write the smallest
+            .mlmz format, by default "pickle"
+        codec : str, optional
+            Codec of the compressed format, "gzip", "lzma" or "zstd", by default "gzip"
+        quantize : str, optional
+            Quantization of the counts in the compressed format, "uint16", "uint8" or
+            "auto", by default None to keep them exact.
+        max_error : float, optional
+            Largest change of any transition probability quantizing may cause, by
+            default 1e-3
+        """
+
+        model_directory_path = get_settings().model_path(self.model_name)
+
+        if not os.path.isdir(model_directory_path):
+            os.makedirs(model_directory_path)
+
+        model_path = self._write_weights(
+            model_directory_path,
+            file_format,
+            codec=codec,
+            quantize=quantize,
+            max_error=max_error,
         )
 
+        # weights saved in other formats are stale and could be loaded instead of
+        # these, and these include every delta so the delta log is compacted away
+        base_path = os.path.join(
+            model_directory_path, f"{self.model_name}_{self.n}-ngrams"
+        )
+        extensions = [BINARY_EXTENSION, COMPRESSED_EXTENSION, ".pkl", DELTA_EXTENSION]
+        for extension in extensions:
+            stale_path = base_path + extension
+            if (stale_path != model_path) and os.path.exists(stale_path):
+                logger.info(f"Removing {stale_path} replaced by {model_path}")
+                os.remove(stale_path)
+        self.pending_deltas = []
+
+    def _write_weights(self, directory_path, file_format, **format_options):
+        if file_format not in ("pickle", "binary", "compressed"):
+            raise ValueError(
+                f"Invalid file format {file_format}, expect one of 'pickle', 'binary', "
+                "'compressed'"
+            )
+
+        if file_format == "binary":
+            file_name = f"{self.model_name}_{self.n}-ngrams{BINARY_EXTENSION}"
+            write_binary_model(os.path.join(directory_path, file_name), self.get_weights())
+        elif file_format == "compressed":
+            file_name = f"{self.model_name}_{self.n}-ngrams{COMPRESSED_EXTENSION}"
+            written = write_compressed_model(
+                os.path.join(directory_path, file_name),
+                self.get_weights(),
+                **format_options,
+            )
+            logger.info(
+                f"Saved {file_name} quantized to {written['quantize']}, probabilities "
+                f"within {written['max_error']:.2g} of the trained model"
+            )
+        else:
+            pickle_dict = self.get_weights()
+            pickle_dict["transition_table"] = self.transitions.get_state()
+
+            file_name = f"{self.model_name}_{self.n}-ngrams.pkl"
+
+            with open(os.path.join(directory_path, file_name), "wb") as handle:
+
+                pickle.dump(pickle_dict, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+        return os.path.join(directory_path, file_name)
+
+    def publish_model(
+        self, file_format="binary", promote=False, store=None, **format_options
+    ):
+        """Stores the model weights as a new version in the artifact store.
+
+        Parameters
+        ----------
+        file_format : str, optional
+            "pickle", "binary" or "compressed", see save_model_weights, by default
+            "binary"
+        promote : bool, optional
+            Whether to put the version in production straight away, by default False
+        store : ArtifactStore, optional
+            The store, by default the one in the artifact folder of the settings.
+        **format_options
+            codec, quantize and max_error of the compressed format.
+
+        Returns
+        -------
+        str
+            The stored version.
+        """
+
+        import tempfile
+
+        store = ArtifactStore() if store is None else store
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            version = store.put(
+                self.model_name,
+                self._write_weights(tmp_dir, file_format, **format_options),
+            )
+        if promote:
+            store.promote(self.model_name, version)
+
+        return version
+
+    def save_model_delta(self):
+        """Appends the counts added by partial_fit since the last save to the delta log.
+
+        The log sits next to the saved model weights and is replayed on top of them by
+        load_model_weights, so saving costs time proportional to the new text only.
+        """
+
+        model_directory_path = get_settings().model_path(self.model_name)
+
         if not os.path.isdir(model_directory_path):
             os.makedirs(model_directory_path)
 
-        file_name = f"{self.model_name}_{self.n}-ngrams.pkl"
+        delta_path = os.path.join(
+            model_directory_path, f"{self.model_name}_{self.n}-ngrams{DELTA_EXTENSION}"
+        )
 
-        with open(os.path.join(model_directory_path, file_name), "wb") as handle:
+        with open(delta_path, "ab") as handle:
+            for delta in self.pending_deltas:
+                pickle.dump(delta, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
-            pickle.dump(pickle_dict, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        self.pending_deltas = []
+
+    def apply_delta_log(self, delta_path):
+        """Replays the transition counts of a delta log onto the model.
+
+        Parameters
+        ----------
+        delta_path : str
+            The delta log written by save_model_delta.
+        """
+
+        deltas = []
+        with open(delta_path, "rb") as f:
+            while True:
+                try:
+                    deltas.append(pickle.load(f))
+                except EOFError:
+                    break
+        if not deltas:
+            return
+
+        # merge the deltas first so the table is only spliced once
+        alphabet = "".join(sorted(set().union(*[delta["alphabet"] for delta in deltas])))
+        context_ids, next_codes, counts = merge_transition_counts(
+            [
+                (
+                    remap_ngram_ids(
+                        delta["context_ids"], self.n, delta["alphabet"], alphabet
+                    ),
+                    remap_codes(delta["next_codes"], delta["alphabet"], alphabet),
+                    delta["counts"],
+                )
+                for delta in deltas
+            ],
+            len(alphabet),
+            self.n,
+        )
+        self.transitions = self.transitions.add_counts(
+            alphabet, context_ids, next_codes, counts
+        )
+
+    def partial_fit(self, text):
+        """Updates a trained model with new text without retraining on the full corpus.
+
+        The new transition counts are merged into the model and only the n-grams they
+        touch are renormalized. Call save_model_delta to persist them.
+
+        Parameters
+        ----------
+        text : str
+            The new raw text to learn from.
+
+        Raises
+        ------
+        ValueError
+            If the model isn't trained, or only has probabilities or quantized
+            counts to add to, like models loaded from older pickles.
+        """
+
+        if self.transitions is None:
+            raise ValueError("partial_fit requires a trained or loaded model")
+
+        encoded_text = self.tokenizer.encode(self.encode_corpus(text))
+        alphabet = "".join(sorted(set(self.transitions.alphabet) | set(encoded_text)))
+        codes = encode_with_alphabet(encoded_text, alphabet)
+        context_ids, next_codes, counts = count_transitions(codes, self.n, len(alphabet))
+
+        self.transitions = self.transitions.add_counts(
+            alphabet, context_ids, next_codes, counts
+        )
+        self.pending_deltas.append(
+            {
+                "alphabet": alphabet,
+                "context_ids": context_ids,
+                "next_codes": next_codes.astype(np.uint32),
+                "counts": counts.astype(np.uint32),
+            }
+        )
 
     def load_model_weights(self, model_name, n):
         """Reads in pre-trained Markov Model weights.
 
+        A binary .mlmm model is preferred over a compressed .mlmz one, and both over
+        the .pkl one when several are saved.
+
         Parameters
         ----------
         model_name : str
-            Which model name to read in from models/markov-models directpry
+            Which model name to read in from the model folder of the settings
         n : int
             What n-gram size to read in the model weights for, can have multiple saved.
         """
 
-        file_name = f"{model_name}_{n}-ngrams.pkl"
-        model_path = os.path.join(
-            SRC_PATH, "models", "markov-models", model_name, file_name
-        )
+        model_directory_path = get_settings().model_path(model_name)
+        for extension in [BINARY_EXTENSION, COMPRESSED_EXTENSION, ".pkl"]:
+            model_path = os.path.join(
+                model_directory_path, f"{model_name}_{n}-ngrams{extension}"
+            )
+            if os.path.exists(model_path):
+                break
 
         if not os.path.exists(model_path):
 
             logger.error("Model not saved by that name/n-grams.")
 
-        with open(model_path, "rb") as f:  # "rb" because we want to read in binary mode
-            markov_model_dict = pickle.load(f)
+        with instrumentation.timed("markov_load_seconds", {"model": model_name}):
+            self._set_weights(model_name, read_model_file(model_path))
+
+        delta_path = os.path.join(
+            model_directory_path, f"{model_name}_{n}-ngrams{DELTA_EXTENSION}"
+        )
+        if os.path.exists(delta_path):
+            self.apply_delta_log(delta_path)
+
+    def _set_weights(self, model_name, markov_model_dict):
+        """Sets the model state from a dict of loaded model weights.
+
+        Parameters
+        ----------
+        model_name : str
+            The name of the loaded model.
+        markov_model_dict : dict
+            The loaded weights, either with a packed "transition_table" state or the
+            "letter_probabilities" dict of dicts written by older versions.
+        """
 
         self.n = markov_model_dict["n"]
         self.model_name = model_name
         self.corpus_type = markov_model_dict["corpus_type"]
-        self.letter_probabilities = markov_model_dict["letter_probabilities"]
+        if "transition_table" in markov_model_dict:
+            self.transitions = TransitionTable.from_state(
+                markov_model_dict["transition_table"]
+            )
+        else:
+            self.letter_probabilities = markov_model_dict["letter_probabilities"]
         self.start_prompts = markov_model_dict["start_prompts"]
+        # models saved before tokenizers were added are character models
+        self.tokenizer = tokenizer_from_state(markov_model_dict.get("tokenizer"))
 
     def load_production_model(self, model_name):
         """Reads in production Markov Model weights.
 
+        The version in production in the artifact store is read if there is one.
+        Otherwise the model is read from the first model store of the settings
+        holding it, or from its copy in the cache folder when one is set.
+
         Parameters
         ----------
         model_name : str
-            Which model name to read in from models/markov-models directpry
+            Which production model to read in.
         """
 
-        model_path = os.path.join(
-            os.getcwd(), "models", "markov-models", "prod-models", model_name
-        )
+        artifact_path = ArtifactStore().production_path(model_name)
+        if artifact_path is not None:
+            with instrumentation.timed("markov_load_seconds", {"model": model_name}):
+                self._set_weights(model_name, read_model_file(artifact_path))
+            return
+
+        model_path = get_settings().production_model_path(model_name)
         prod_model_files = os.listdir(model_path)
         logger.info(f"prod_model_files: {prod_model_files}")
+        # a converted binary model takes precedence over a compressed one, and both
+        # over the pickle they came from
+        for extension in [BINARY_EXTENSION, COMPRESSED_EXTENSION]:
+            converted_model_files = [
+                f for f in prod_model_files if f.endswith(extension)
+            ]
+            if len(converted_model_files) == 1:
+                prod_model_files = converted_model_files
+                break
         if not os.path.exists(model_path) | (len(prod_model_files) == 0):
             logger.error(
                 f"No production model by the name: {model_name}, models available: {prod_model_files}"
@@ -175,56 +739,346 @@ class MarkovModel:
             logger.error("More than one model in production folder")
         else:
             for model_file in prod_model_files:
-                with open(
-                    os.path.join(model_path, model_file), "rb"
-                ) as f:  # "rb" because we want to read in binary mode
-                    markov_model_dict = pickle.load(f)
+                with instrumentation.timed("markov_load_seconds", {"model": model_name}):
+                    markov_model_dict = read_model_file(
+                        os.path.join(model_path, model_file)
+                    )
 
-        self.n = markov_model_dict["n"]
-        self.model_name = model_name
-        self.corpus_type = markov_model_dict["corpus_type"]
-        self.letter_probabilities = markov_model_dict["letter_probabilities"]
-        self.start_prompts = markov_model_dict["start_prompts"]
+        self._set_weights(model_name, markov_model_dict)
 
-    def generate_tweet(self, seq_len=80):
+    def generate_tweet(
+        self, seq_len=80, max_attempts=1000, time_budget=None, batch_size=1
+    ):
         """Uses the Markov Models to create a tweet including quality checks.
 
+        Candidates are generated until one passes validation or the attempt or
+        time budget runs out.
+
         Parameters
         ----------
         seq_len : int, optional
             Max length the tweet should be, may be shorter if text ends in incomplete
             sentences, by default 80
+        max_attempts : int, optional
+            Max number of candidates to generate before giving up, by default 1000
+        time_budget : float, optional
+            Max seconds to spend generating before giving up, checked between
+            candidates (or batches), by default None for no time limit
+        batch_size : int, optional
+            How many candidates to over-generate together with generate_batch's
+            vectorized engine, the first valid one is returned, by default 1
 
         Returns
         -------
         str
             The generated tweet.
+
+        Raises
+        ------
+        GenerationBudgetExceeded
+            If no valid tweet was generated within the attempt or time budget.
+        """
+
+        stats = get_acceptance_stats(self.model_name, self.corpus_type)
+        labels = {"model": self.model_name}
+        start_time = time.perf_counter()
+        attempts = 0
+
+        while attempts < max_attempts:
+            # the timer starts once the lock is held, waiting isn't sampling time
+            with self._generation_lock, instrumentation.timed(
+                "markov_sample_seconds_per_char", labels
+            ) as timer:
+                if batch_size > 1:
+                    candidates = self._generate_raw_batch(
+                        min(batch_size, max_attempts - attempts), seq_len
+                    )
+                else:
+                    candidates = [self._generate_raw(seq_len)]
+                timer.count = len(candidates) * seq_len
+
+            for trimmed_tweet in self._process_candidates(candidates):
+                attempts += 1
+                is_valid = trimmed_tweet is not None
+                stats.record(is_valid)
+                instrumentation.increment("markov_candidates_total", labels=labels)
+                if not is_valid:
+                    instrumentation.increment("markov_rejected_total", labels=labels)
+
+                if is_valid:
+                    return self.decode_generated_text(trimmed_tweet)
+
+            if (time_budget is not None) and (
+                time.perf_counter() - start_time > time_budget
+            ):
+                break
+
+        raise GenerationBudgetExceeded(
+            f"No valid tweet for {self.model_name} after {attempts} attempts in "
+            f"{time.perf_counter() - start_time:.2f}s, acceptance rate: {stats.acceptance_rate}"
+        )
+
+    def _space_code(self, table):
+        """Gets the code generated after an n-gram missing from the table.
+
+        Parameters
+        ----------
+        table : TransitionTable
+            The table generated from.
+
+        Returns
+        -------
+        int or None
+            The code of a space, for token models without a lone space token the
+            most frequent token starting with one. None if there is neither.
+        """
+
+        code = table.char_codes.get(" ")
+        if (code is not None) or (self.tokenizer.name == CharacterTokenizer.name):
+            return code
+
+        cached = self._space_codes
+        if cached is not None and cached[0] is table:
+            return cached[1]
+
+        # subword tokens can join every space to the word following it
+        frequencies = np.bincount(
+            table.next_codes, weights=table.weights, minlength=table.base
+        )
+        spaced = [
+            code
+            for code, symbol in enumerate(table.alphabet)
+            if self.tokenizer.decode(symbol).startswith(" ")
+        ]
+        code = max(spaced, key=frequencies.__getitem__) if spaced else None
+        self._space_codes = (table, code)
+
+        return code
+
+    def _generate_raw(self, seq_len):
+        """Generates untrimmed text for a single Markov chain.
+
+        Parameters
+        ----------
+        seq_len : int
+            Length of the generated text.
+
+        Returns
+        -------
+        str
+            The raw generated text, before trimming and validation. Spaces
+            padded on after an unseen n-gram are left off the end.
         """
 
+        table = self.transitions
         s = self.get_start_prompt()
+        ngram_id = table.encode_ngram(s[-self.n :]) if len(s) >= self.n else None
 
-        while len(s) < seq_len:
-            current_ngram = s[-self.n :]
+        # start of the trailing run of spaces padded on for unseen n-grams
+        fallback_from = None
+        num_steps = self.tokenizer.num_steps(seq_len)
+        while len(s) < num_steps:
+            row = table.find_row_id(ngram_id)
 
-            if current_ngram in self.letter_probabilities.keys():
-                next_letter = np.random.choice(
-                    a=list(self.letter_probabilities[current_ngram].keys()),
-                    p=list(self.letter_probabilities[current_ngram].values()),
-                )
+            if row >= 0:
+                code = table.sample_code(row, self.rng.random())
+                next_letter = table.alphabet[code]
+                fallback_from = None
 
             else:
-                next_letter = " "
+                if fallback_from is None:
+                    fallback_from = len(s)
+                code = self._space_code(table)
+                next_letter = " " if code is None else table.alphabet[code]
 
             s = s + next_letter
 
-        trimmed_tweet = self.trim_tweet(s)
+            # roll the current n-gram id forward instead of re-encoding the string
+            if (ngram_id is not None) and (code is not None):
+                ngram_id = table.shift_ngram_id(ngram_id, code)
+            elif len(s) >= self.n:
+                ngram_id = table.encode_ngram(s[-self.n :])
 
-        # if valid tweet return otherwise generate a new one
-        if self.validate_tweet(trimmed_tweet) is True:
-            decoded_tweet = self.decode_generated_text(trimmed_tweet)
-            return decoded_tweet
-        else:
-            return self.generate_tweet(seq_len)
+        if fallback_from is not None:
+            s = s[:fallback_from]
+
+        return self.tokenizer.decode_generated(s, seq_len)
+
+    def generate_batch(self, num, seq_len=80, chunk_size=10000):
+        """Generates many tweets at once by advancing all Markov chains together.
+
+        Candidates failing validation are dropped rather than regenerated, so
+        fewer than num tweets may be returned.
+
+        Parameters
+        ----------
+        num : int
+            How many candidate tweets to generate.
+        seq_len : int, optional
+            Max length the tweets should be, may be shorter if text ends in incomplete
+            sentences, by default 80
+        chunk_size : int, optional
+            How many chains to advance together, bounds memory use for large num,
+            by default 10000
+
+        Returns
+        -------
+        list of str
+            The valid, decoded tweets.
+        """
+
+        stats = get_acceptance_stats(self.model_name, self.corpus_type)
+        labels = {"model": self.model_name}
+        tweets = []
+        for chunk_start in range(0, num, chunk_size):
+            with self._generation_lock, instrumentation.timed(
+                "markov_sample_seconds_per_char", labels
+            ) as timer:
+                raw_tweets = self._generate_raw_batch(
+                    min(chunk_size, num - chunk_start), seq_len
+                )
+                timer.count = len(raw_tweets) * seq_len
+            num_valid = len(tweets)
+            for trimmed_tweet in self._process_candidates(raw_tweets):
+                stats.record(trimmed_tweet is not None)
+                if trimmed_tweet is not None:
+                    tweets.append(self.decode_generated_text(trimmed_tweet))
+            instrumentation.increment(
+                "markov_candidates_total", len(raw_tweets), labels=labels
+            )
+            instrumentation.increment(
+                "markov_rejected_total",
+                len(raw_tweets) - (len(tweets) - num_valid),
+                labels=labels,
+            )
+
+        return tweets
+
+    def generate_tweets(self, num, seq_len=80, max_rounds=20):
+        """Generates exactly num valid tweets with batch generation.
+
+        Every round generates enough candidates for the remaining tweets at the
+        acceptance rate observed so far, so one round usually suffices.
+
+        Parameters
+        ----------
+        num : int
+            How many valid tweets to generate.
+        seq_len : int, optional
+            Max length the tweets should be, by default 80
+        max_rounds : int, optional
+            Batches of candidates generated before giving up, by default 20
+
+        Returns
+        -------
+        list of str
+            num valid, decoded tweets.
+        """
+
+        stats = get_acceptance_stats(self.model_name, self.corpus_type)
+
+        tweets = []
+        for _ in range(max_rounds):
+            acceptance_rate = max(stats.acceptance_rate or 1, MIN_ACCEPTANCE_RATE)
+            num_candidates = math.ceil((num - len(tweets)) / acceptance_rate)
+            tweets.extend(self.generate_batch(num_candidates, seq_len=seq_len))
+            if len(tweets) >= num:
+                return tweets[:num]
+
+        raise GenerationBudgetExceeded(
+            f"Only generated {len(tweets)} of {num} valid tweets for {self.model_name} in "
+            f"{max_rounds} rounds, acceptance rate: {stats.acceptance_rate}"
+        )
+
+    def _generate_raw_batch(self, num, seq_len):
+        """Generates untrimmed text for many chains using integer coded array lookups.
+
+        Parameters
+        ----------
+        num : int
+            How many chains to generate.
+        seq_len : int
+            Length of every generated text.
+
+        Returns
+        -------
+        list of str
+            The raw generated texts, before trimming and validation. Spaces
+            padded on after an unseen n-gram are left off the end.
+        """
+
+        table = self.transitions
+        space_code = self._space_code(table)
+        if space_code is None:
+            raise ValueError("Batch generation requires a space in the model alphabet")
+
+        prompt_codes = self.start_prompt_codes(table.char_codes)
+
+        # token models take fewer steps than characters generated
+        num_steps = max(self.tokenizer.num_steps(seq_len), self.n)
+        codes = np.empty((num, num_steps), dtype=table.next_codes.dtype)
+        codes[:, : self.n] = prompt_codes[self.rng.integers(len(prompt_codes), size=num)]
+
+        ngram_ids = np.zeros(num, dtype=table.ngram_ids.dtype)
+        for k in range(self.n):
+            ngram_ids = ngram_ids * table.base + codes[:, k].astype(ngram_ids.dtype)
+
+        # start of every chain's trailing run of spaces padded on for unseen n-grams
+        fallback_from = np.full(num, num_steps, dtype=np.int64)
+        for position in range(self.n, num_steps):
+            rows = table.find_rows(ngram_ids)
+            found = rows >= 0
+            next_codes = np.full(num, space_code, dtype=np.int64)
+            next_codes[found] = table.sample_codes(
+                rows[found], self.rng.random(int(found.sum()))
+            )
+            codes[:, position] = next_codes
+            fallback_from[found] = num_steps
+            fallback_from[~found & (fallback_from == num_steps)] = position
+            ngram_ids = (ngram_ids % table.leading_power) * table.base + next_codes.astype(
+                ngram_ids.dtype
+            )
+
+        codepoints = np.frombuffer(table.alphabet.encode("utf-32-le"), dtype=np.uint32)
+        text = codepoints[codes].tobytes().decode("utf-32-le")
+
+        return [
+            self.tokenizer.decode_generated(text[i : i + end], seq_len)
+            for i, end in zip(range(0, len(text), num_steps), fallback_from.tolist())
+        ]
+
+    def _process_candidates(self, raw_tweets):
+        """Trims and validates generated candidates.
+
+        The post processor does both in one pass, unless trim_tweet or
+        validate_tweet are overridden, then every candidate goes through them.
+
+        Parameters
+        ----------
+        raw_tweets : list of str
+            The raw generated texts.
+
+        Returns
+        -------
+        list of str or None
+            The trimmed tweet of every text, None for the invalid ones.
+        """
+
+        trim_tweet = getattr(self.trim_tweet, "__func__", None)
+        validate_tweet = getattr(self.validate_tweet, "__func__", None)
+        if (trim_tweet is _DEFAULT_TRIM_TWEET) and (
+            validate_tweet is _DEFAULT_VALIDATE_TWEET
+        ):
+            # rejected candidates may not be trimmed to the end
+            return self.post_processor.process_batch(raw_tweets)
+
+        processed = []
+        for raw_tweet in raw_tweets:
+            trimmed_tweet = self.trim_tweet(raw_tweet)
+            is_valid = self.validate_tweet(trimmed_tweet)
+            processed.append(trimmed_tweet if is_valid else None)
+
+        return processed
 
     def trim_tweet(self, raw_tweet):
         """CLeans up generated tweet to remove incomplete sentences.
@@ -240,71 +1094,7 @@ class MarkovModel:
             The cleaned up tweet.
         """
 
-        trimmed_tweet = raw_tweet
-
-        if self.corpus_type == "book":
-            # remove last incomplete sentence if one complete sentence exists.
-            if "^" in trimmed_tweet:
-                # remove last trailing line as likely incomplete
-                if len(trimmed_tweet.split("^")) > 1:
-                    lines = trimmed_tweet.split("^")[0:-1]
-                else:
-                    lines = trimmed_tweet.split("^")
-                # remove last trailing sentence, likely incomplete
-                sentences = [l.split(".")[0:-1] for l in lines]
-                # capitalizes and removes leading spaces to help ensure new lines start with no space
-                trimmed_tweet = [
-                    sent.strip().capitalize() + ". "
-                    for line in sentences
-                    for sent in line
-                ]
-                # join with no spaces as spaces are maintained by the period insertion
-                trimmed_tweet = "".join(trimmed_tweet)
-            trimmed_tweet = trimmed_tweet.replace("“", "").replace("”", "")
-
-        elif self.corpus_type == "tweet":
-            # just get complete lines of tweets and make one complete sentence
-            if "^" in trimmed_tweet:
-                # remove last trailing line as likely incomplete
-                if len(trimmed_tweet.split("^")) > 1:
-                    lines = trimmed_tweet.split("^")[0:-1]
-                else:
-                    lines = trimmed_tweet.split("^")
-                # remove last trailing sentence, if only one sentence, don't remove
-                sentences = [
-                    l.split(".")[0:-1] if len(l.split(".")) > 1 else l.strip()
-                    for l in lines
-                ]
-                # capitalizes and removes leading spaces to help ensure new lines start with no space
-                trimmed_tweet = [
-                    sent.strip().capitalize() + ". "
-                    for line in sentences
-                    for sent in line
-                ]
-                # re-inserts the new line characters after they were removed in the split
-                trimmed_tweet = [
-                    "^" if sent == ". " else sent for sent in trimmed_tweet
-                ]
-                # join with no spaces as spaces are maintained by the period insertion
-                trimmed_tweet = "".join(trimmed_tweet)
-            # missing unique closing quote character, remove the quotes
-            # if (trimmed_tweet.count("“") + trimmed_tweet.count("”")) % 2 != 0:
-            trimmed_tweet = trimmed_tweet.replace("“", "").replace("”", "")
-            if trimmed_tweet.count('"') % 2 != 0:
-                trimmed_tweet = trimmed_tweet.replace('"', "")
-
-        elif self.corpus_type == "lyric":
-            # just get complete lines of lyrics
-            if "^" in trimmed_tweet:
-                lines = trimmed_tweet.split("^")[0:-1]
-                lines = [l.capitalize() for l in lines]
-                trimmed_tweet = "^".join(lines)
-            trimmed_tweet = trimmed_tweet.replace("“", "").replace("”", "")
-
-        # capitalize output
-        trimmed_tweet = trimmed_tweet.capitalize()
-
-        return trimmed_tweet
+        return self.post_processor.trim(raw_tweet)
 
     def validate_tweet(self, trimmed_tweet):
         """Final checks if generated tweet meets criteria for being posted.
@@ -320,16 +1110,7 @@ class MarkovModel:
             Result of the validation, True if it's a valid tweet, False if it's not.
         """
 
-        validation = True
-
-        # if there are two many new lines for a valid tweet
-        if trimmed_tweet.count("^") >= 3:
-            validation = False
-        # we don't want to post super short tweets
-        if len(trimmed_tweet) < 60:
-            validation = False
-
-        return validation
+        return self.post_processor.validate(trimmed_tweet)
 
     def encode_corpus(self, corpus):
         """Encodes certain text values to single characters so on generation new text follows
@@ -346,13 +1127,7 @@ class MarkovModel:
             The corpus with transformations applied.
         """
 
-        encoded_text = " ".join(
-            str.split(
-                corpus.lower().replace("\n", "^").replace('""', "").replace("&amp", "&")
-            )
-        )
-
-        return encoded_text
+        return codepoints_to_text(encode_corpus_codepoints(corpus))
 
     def decode_generated_text(self, string):
         """Reverses the transformations made during corpus encoding but on generated text.
@@ -370,46 +1145,82 @@ class MarkovModel:
 
         return string.replace("^", "\n")
 
-    def generate_start_prompts(self, corpus, num_sentences=100):
-        """Gets sentences for which the starts of will be used when generating new text.
+    def _start_prompt_reservoir(self, num_sentences):
+        """Creates the sampler of start prompts for the corpus type of the model."""
 
-        Parameters
-        ----------
-        corpus : str
-            The full encoded corpus from which to pull sentences from.
-        num_sentences : int, optional
-            How many sentences to extract and store for use while generating. The more
-            sentence options, the more varied the text will be, by default 100
-        """
+        # if song lyrics, not many periods, split by encoded new line character instead
+        # reduce minimum number of characters as well
         if (self.corpus_type == "tweet") | (self.corpus_type == "lyric"):
-            raw_sentences = corpus.split("^")
-            min_char_count = 30
+            separator, min_char_count = "^", 30
         elif self.corpus_type == "book":
-            raw_sentences = corpus.split(".")
-            min_char_count = 100
+            separator, min_char_count = ".", 100
         else:
             raise ValueError(
                 "Invalid corpus type {}, expect one of 'book', 'tweet', 'lyric'"
             )
 
-        # if song lyrics, not many periods, split by encoded new line character instead
-        # reduce minimum number of characters as well
+        # sentences are measured in tokens
+        min_length = math.ceil(min_char_count / self.tokenizer.chars_per_token)
 
-        verified_sentences = []
-        sentence_index = 0
+        return SentenceReservoir(separator, min_length, num_sentences, self.n)
 
-        # asearch for valid prompts until quota filled or reach end of possible sentences
-        while (len(verified_sentences) < num_sentences) & (
-            sentence_index < len(raw_sentences)
-        ):
+    def generate_start_prompts(self, corpus, num_sentences=NUM_START_PROMPTS):
+        """Gets sentences for which the starts of will be used when generating new text.
+
+        The sentences are sampled uniformly across the whole corpus, the same corpus
+        always gives the same sample.
+
+        Parameters
+        ----------
+        corpus : str or np.ndarray
+            The full encoded corpus from which to pull sentences from, or its code points.
+        num_sentences : int, optional
+            How many sentences to extract and store for use while generating. The more
+            sentence options, the more varied the text will be, by default 1000
+        """
+
+        if isinstance(corpus, str):
+            corpus = text_to_codepoints(corpus)
+
+        reservoir = self._start_prompt_reservoir(num_sentences)
+        reservoir.feed(corpus)
+        self.start_prompts = reservoir.flush()
+
+    def start_prompt_codes(self, char_codes, unknown_code=None):
+        """Gets the start prompts of at least n characters as an array of letter codes.
+
+        The array is built once and reused until the prompts, n or alphabet change,
+        so drawing prompts for a batch is a single array index.
 
-            if len(raw_sentences[sentence_index]) > min_char_count:
+        Parameters
+        ----------
+        char_codes : dict
+            The code of every letter in the alphabet generated with.
+        unknown_code : int, optional
+            Code of letters missing from the alphabet, by default None to raise a
+            KeyError for them.
 
-                verified_sentences.append(raw_sentences[sentence_index])
+        Returns
+        -------
+        np.ndarray
+            The (num prompts, n) int64 letter codes of the prompts.
+        """
 
-            sentence_index += 1
+        cached = self._start_prompt_codes
+        if cached is not None and cached[:3] == (self.n, unknown_code, char_codes):
+            return cached[3]
 
-        self.start_prompts = verified_sentences
+        prompts = [p[: self.n] for p in self.start_prompts if len(p) >= self.n]
+        if len(prompts) == 0:
+            raise ValueError(f"No start prompts of at least {self.n} characters")
+        if unknown_code is None:
+            rows = [[char_codes[char] for char in prompt] for prompt in prompts]
+        else:
+            rows = [[char_codes.get(char, unknown_code) for char in p] for p in prompts]
+        prompt_codes = np.array(rows, dtype=np.int64)
+        self._start_prompt_codes = (self.n, unknown_code, char_codes, prompt_codes)
+
+        return prompt_codes
 
     def get_start_prompt(self):
         """Randomly selects a start prompt to use when generating new text.
@@ -420,6 +1231,11 @@ class MarkovModel:
             A string of length n to start the text generation from.
         """
 
-        sentence = np.random.choice(self.start_prompts)
+        sentence = self.start_prompts[self.rng.integers(len(self.start_prompts))]
 
         return sentence[0 : self.n]
+
+
+# hooks of MarkovModel, generation only calls overrides of them one candidate at a time
+_DEFAULT_TRIM_TWEET = MarkovModel.trim_tweet
+_DEFAULT_VALIDATE_TWEET = MarkovModel.validate_tweet
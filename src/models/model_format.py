@@ -0,0 +1,198 @@
+"""Memory mapped binary format for Markov model weights.
+
+Layout of a model file, all integers little endian:
+
+    magic          4 bytes, b"MLMM"
+    version        uint32
+    header_length  uint32
+    header         header_length bytes of utf-8 JSON with the model metadata and
+                   the offset, dtype and length of every array section
+    sections       the raw arrays of the transition table, each aligned to
+                   SECTION_ALIGNMENT bytes
+
+Opening a file only parses the header, the arrays are views into a read only
+memory map so pages are loaded from disk as generation touches them. Tables whose
+n-gram ids overflow int64 store the codes of every n-gram in an "ngram_codes"
+section instead of "ngram_ids", the ids are rebuilt in memory when opening them.
+"""
+
+import argparse
+import json
+import mmap
+import os
+import pickle
+import struct
+
+import numpy as np
+
+from src.models.ngram_engine import codes_to_ngram_ids, ngram_id_codes
+from src.models.transition_table import smallest_code_dtype
+
+MAGIC = b"MLMM"
+FORMAT_VERSION = 1
+FILE_EXTENSION = ".mlmm"
+SECTION_ALIGNMENT = 64
+
+_PREAMBLE = struct.Struct("<4sII")
+
+# transition table arrays stored in the file, in order
+SECTIONS = ("ngram_ids", "offsets", "next_codes", "weights", "cdf", "row_totals")
+
+
+def _aligned(offset):
+    return -(-offset // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
+
+
+def write_binary_model(path, markov_model_dict):
+    """Writes model weights in the memory mapped binary format.
+
+    Parameters
+    ----------
+    path : str
+        Where to write the model file.
+    markov_model_dict : dict
+        The model weights with "model_name", "n", "corpus_type", "start_prompts",
+        optionally the "tokenizer" state, and a "transition_table" holding a
+        TransitionTable.
+    """
+
+    table = markov_model_dict["transition_table"]
+    arrays = {name: np.ascontiguousarray(getattr(table, name)) for name in SECTIONS}
+    if arrays["ngram_ids"].dtype == object:
+        codes = ngram_id_codes(arrays.pop("ngram_ids"), table.n, table.base)
+        arrays = {
+            "ngram_codes": codes.astype(smallest_code_dtype(table.base)).reshape(-1),
+            **arrays,
+        }
+
+    # the header stores section offsets relative to the end of the header
+    sections = {}
+    position = 0
+    for name in arrays:
+        position = _aligned(position)
+        sections[name] = {
+            "offset": position,
+            "dtype": arrays[name].dtype.newbyteorder("<").str,
+            "length": len(arrays[name]),
+        }
+        position += arrays[name].nbytes
+
+    header = {
+        "model_name": markov_model_dict["model_name"],
+        "n": markov_model_dict["n"],
+        "corpus_type": markov_model_dict["corpus_type"],
+        "start_prompts": list(markov_model_dict["start_prompts"]),
+        "tokenizer": markov_model_dict.get("tokenizer"),
+        "alphabet": table.alphabet,
+        "quantize": table.quantize,
+        "sections": sections,
+    }
+    header_bytes = json.dumps(header).encode("utf8")
+    data_start = _aligned(_PREAMBLE.size + len(header_bytes))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name in arrays:
+            f.seek(data_start + sections[name]["offset"])
+            f.write(arrays[name].astype(sections[name]["dtype"], copy=False).tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_binary_model(path):
+    """Opens a binary model file without reading its arrays into memory.
+
+    Parameters
+    ----------
+    path : str
+        The model file to open.
+
+    Returns
+    -------
+    dict
+        The model weights in the same layout as the pickled weights, the
+        "transition_table" state holds read only arrays backed by a memory map.
+    """
+
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, header_length = _PREAMBLE.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a binary Markov model file")
+    if version != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported model format version {version}, expected {FORMAT_VERSION}"
+        )
+
+    header = json.loads(buffer[_PREAMBLE.size : _PREAMBLE.size + header_length])
+    data_start = _aligned(_PREAMBLE.size + header_length)
+
+    state = {
+        "alphabet": header["alphabet"],
+        "n": header["n"],
+        "quantize": header.get("quantize"),
+    }
+    for name, section in header["sections"].items():
+        state[name] = np.frombuffer(
+            buffer,
+            dtype=np.dtype(section["dtype"]),
+            count=section["length"],
+            offset=data_start + section["offset"],
+        )
+    if "ngram_codes" in state:
+        ngram_codes = state.pop("ngram_codes").reshape(-1, header["n"])
+        state["ngram_ids"] = codes_to_ngram_ids(ngram_codes, len(header["alphabet"]))
+
+    return {
+        "model_name": header["model_name"],
+        "n": header["n"],
+        "corpus_type": header["corpus_type"],
+        "start_prompts": header["start_prompts"],
+        "tokenizer": header.get("tokenizer"),
+        "transition_table": state,
+    }
+
+
+def convert_pickle_model(pickle_path, output_path=None):
+    """Converts weights written by MarkovModel.save_model_weights to the binary format.
+
+    Parameters
+    ----------
+    pickle_path : str
+        The .pkl model weights to convert.
+    output_path : str, optional
+        Where to write the binary model, by default next to the pickle with the
+        .mlmm extension.
+
+    Returns
+    -------
+    str
+        The path of the written binary model.
+    """
+
+    from src.models.markov_model import MarkovModel
+
+    if output_path is None:
+        output_path = os.path.splitext(pickle_path)[0] + FILE_EXTENSION
+
+    with open(pickle_path, "rb") as f:
+        markov_model_dict = pickle.load(f)
+
+    model = MarkovModel()
+    model._set_weights(markov_model_dict.get("model_name"), markov_model_dict)
+    write_binary_model(output_path, model.get_weights())
+
+    return output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert pickled Markov model weights to the binary format."
+    )
+    parser.add_argument("pickle_paths", nargs="+", help="The .pkl files to convert")
+    args = parser.parse_args()
+
+    for pickle_path in args.pickle_paths:
+        print(f"{pickle_path} -> {convert_pickle_model(pickle_path)}")
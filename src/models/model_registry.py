@@ -0,0 +1,180 @@
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from src.config import get_settings
+from src.models.artifact_store import ArtifactStore
+from src.models.markov_model import MarkovModel
+
+logger = logging.getLogger("markov-model")
+
+# bytes of model weights kept loaded by default
+DEFAULT_MEMORY_BUDGET = 2**30
+
+
+def production_model_names():
+    """Lists the production models available to load.
+
+    Returns
+    -------
+    list of str
+        The models in production in the artifact store and the model directories
+        of every model store of the settings, in name order.
+    """
+
+    return sorted(
+        set(ArtifactStore().production_model_names())
+        | set(get_settings().production_model_names())
+    )
+
+
+def load_production_model(model_name):
+    """Loads a production model into a new MarkovModel."""
+
+    model = MarkovModel()
+    model.load_production_model(model_name=model_name)
+
+    return model
+
+
+class ModelRegistry(Mapping):
+    def __init__(
+        self,
+        model_names=None,
+        memory_budget=DEFAULT_MEMORY_BUDGET,
+        loader=load_production_model,
+    ):
+        """Loads models on first use and keeps the recently used ones in memory.
+
+        Models are evicted least recently used first once the total size of the
+        loaded weights exceeds the memory budget. The registry is a read only
+        mapping from model name to loaded model, looking a model up loads it if
+        needed. get follows the Mapping contract and returns its default for
+        unknown models.
+
+        Parameters
+        ----------
+        model_names : list of str, optional
+            The models that can be loaded, by default every production model.
+        memory_budget : int, optional
+            Total bytes of model weights to keep loaded, by default 1 GiB. The most
+            recently used model is always kept, even if it alone exceeds the budget.
+        loader : callable, optional
+            Function loading a model by name, by default loads the production model.
+        """
+
+        if model_names is None:
+            model_names = production_model_names()
+
+        self.model_names = list(model_names)
+        self.memory_budget = memory_budget
+        self.loader = loader
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._models = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.RLock()
+
+    def __getitem__(self, model_name):
+        return self.load(model_name)
+
+    def __iter__(self):
+        return iter(self.model_names)
+
+    def __len__(self):
+        return len(self.model_names)
+
+    def __contains__(self, model_name):
+        return model_name in self.model_names
+
+    @property
+    def nbytes(self):
+        """Total size of the loaded model weights in bytes."""
+
+        return sum(self._sizes.values())
+
+    def loaded_models(self):
+        """Names of the models currently in memory, least recently used first."""
+
+        with self._lock:
+            return list(self._models)
+
+    def load(self, model_name):
+        """Gets a model, loading it and evicting others if needed.
+
+        Parameters
+        ----------
+        model_name : str
+            Which model to get.
+
+        Returns
+        -------
+        MarkovModel
+            The loaded model.
+
+        Raises
+        ------
+        KeyError
+            If the model isn't one of the registry's models.
+        """
+
+        if model_name not in self.model_names:
+            raise KeyError(model_name)
+
+        with self._lock:
+            if model_name in self._models:
+                self.hits += 1
+                self._models.move_to_end(model_name)
+                return self._models[model_name]
+
+            self.misses += 1
+            model = self.loader(model_name)
+            self._models[model_name] = model
+            self._sizes[model_name] = model.nbytes
+            logger.info(f"Loaded model {model_name}, {model.nbytes} bytes")
+            self._evict_over_budget()
+
+            return model
+
+    def evict(self, model_name):
+        """Removes a model from memory, it is reloaded on its next use.
+
+        Parameters
+        ----------
+        model_name : str
+            Which model to evict.
+        """
+
+        with self._lock:
+            if model_name in self._models:
+                del self._models[model_name]
+                del self._sizes[model_name]
+                self.evictions += 1
+                logger.info(f"Evicted model {model_name}")
+
+    def _evict_over_budget(self):
+        while self.nbytes > self.memory_budget and len(self._models) > 1:
+            self.evict(next(iter(self._models)))
+
+    def stats(self):
+        """Gets the cache counters.
+
+        Returns
+        -------
+        dict
+            The hits, misses, evictions, loaded models and their total bytes.
+        """
+
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "loaded": list(self._models),
+                "nbytes": self.nbytes,
+                "memory_budget": self.memory_budget,
+            }
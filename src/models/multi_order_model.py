@@ -0,0 +1,227 @@
+import os
+import pickle
+import logging
+
+import numpy as np
+
+from src.config import get_settings
+from src.models.markov_model import MarkovModel
+from src.models.ngram_engine import encode_alphabet, encode_corpus_codepoints
+from src.models.ngram_trie import NGramTrie
+
+logger = logging.getLogger("markov-model")
+
+
+class MultiOrderMarkovModel(MarkovModel):
+    def __init__(self, random_state=None, smoothing=None):
+        """Creates a Markov model holding every n-gram size up to a max in one trie.
+
+        Parameters
+        ----------
+        random_state : int or np.random.Generator, optional
+            Seed or generator used for all sampling so generated text can be
+            reproduced, by default None for a fresh unseeded generator.
+        smoothing : str, optional
+            How to generate after an n-gram that was never seen. None appends a
+            space like MarkovModel, "backoff" samples from the longest suffix of the
+            n-gram that was seen, down to the unigram counts, so every step yields a
+            real letter, by default None
+        """
+
+        if smoothing not in (None, "backoff"):
+            raise ValueError(f"Invalid smoothing {smoothing}, expect one of None, 'backoff'")
+
+        super().__init__(random_state=random_state)
+        self.max_n = None
+        self.trie = None
+        self.smoothing = smoothing
+
+    def fit_corpus(
+        self, model_name, corpus, max_n, corpus_type, retrain=False, save_model=False
+    ):
+        """Counts next letters for every n-gram size from 1 to max_n in a single pass.
+
+        Generation uses n = max_n until set_order picks another size.
+
+        Parameters
+        ----------
+        model_name : str
+            Name of the model to be used for internal reference and exporting of weights
+        corpus : str
+            Full text file for which to generate the ngram results for.
+        max_n : int
+            The largest n-gram size to count.
+        corpus_type : str
+            What style of writing the text to be generated is.
+            Options are: "book", "lyric", "tweet"
+        retrain : bool, optional
+            Whether to retrain or load pre-exisiting weights for the given model name
+            and max_n if it already exists, by default False so it loads existing weights
+        save_model : bool, optional
+            Whether to save off the model weights under the models folder, by default False
+        """
+
+        self.max_n = max_n
+        self.n = max_n
+        self.model_name = model_name
+        self.corpus_type = corpus_type
+        if retrain == False:
+            try:
+                self.load_model_weights(self.model_name, self.max_n)
+                return
+            except FileNotFoundError as e:
+                logger.error(
+                    f"Didn't find existing model weights for {self.model_name}, max n = {self.max_n}. Training now..."
+                )
+
+        # make text circular so Markov chain doesn't get stuck when generating, the
+        # wrap covers the largest order so every order shares the same encoded text
+        circ_text = corpus + corpus[: self.max_n]
+
+        encoded_codepoints = encode_corpus_codepoints(circ_text)
+
+        self.generate_start_prompts(encoded_codepoints)
+
+        alphabet, codes = encode_alphabet(encoded_codepoints)
+        self.trie = NGramTrie.from_codes(alphabet, codes, self.max_n)
+        self.set_order(self.max_n)
+
+        if save_model is True:
+            self.save_model_weights()
+
+    @property
+    def nbytes(self):
+        """Size of the trie of every order in bytes, 0 before the model is trained."""
+
+        if self.trie is None:
+            return 0
+
+        # the table of the current order holds copies of its level's arrays
+        return self.trie.nbytes + self.transitions.nbytes
+
+    def set_order(self, n):
+        """Switches the n-gram size used for generation without retraining.
+
+        Parameters
+        ----------
+        n : int
+            The n-gram size, between 1 and max_n.
+        """
+
+        self.transitions = self.trie.transition_table(n)
+        self.n = n
+
+    def _generate_raw(self, seq_len):
+        """Generates untrimmed text for a single chain, backing off on unseen n-grams.
+
+        Parameters
+        ----------
+        seq_len : int
+            Length of the generated text.
+
+        Returns
+        -------
+        str
+            The raw generated text, before trimming and validation.
+        """
+
+        if self.smoothing != "backoff":
+            return super()._generate_raw(seq_len)
+
+        trie = self.trie
+        s = self.get_start_prompt()
+        context = [trie.char_codes.get(char) for char in s[-self.n :]]
+        letters = [s]
+
+        for _ in range(seq_len - len(s)):
+            order, node = trie.find_context(context, self.n)
+            code = trie.sample_code(order, node, self.rng.random())
+            letters.append(trie.alphabet[code])
+            context = context[1:] + [code] if len(context) >= self.n else context + [code]
+
+        return "".join(letters)
+
+    def _generate_raw_batch(self, num, seq_len):
+        """Generates untrimmed text for many chains, backing off on unseen n-grams.
+
+        Parameters
+        ----------
+        num : int
+            How many chains to generate.
+        seq_len : int
+            Length of every generated text.
+
+        Returns
+        -------
+        list of str
+            The raw generated texts, before trimming and validation.
+        """
+
+        if self.smoothing != "backoff":
+            return super()._generate_raw_batch(num, seq_len)
+
+        trie = self.trie
+        # letters outside the alphabet are coded -1 so they never match a trie node
+        prompt_codes = self.start_prompt_codes(trie.char_codes, unknown_code=-1)
+
+        seq_len = max(seq_len, self.n)
+        codes = np.empty((num, seq_len), dtype=np.int64)
+        codes[:, : self.n] = prompt_codes[self.rng.integers(len(prompt_codes), size=num)]
+
+        for position in range(self.n, seq_len):
+            orders, nodes = trie.find_contexts(codes[:, position - self.n : position])
+            codes[:, position] = trie.sample_codes(orders, nodes, self.rng.random(num))
+
+        # code -1 decodes to the trailing space, those letters only come from prompts
+        # made outside the corpus
+        codepoints = np.frombuffer(
+            (trie.alphabet + " ").encode("utf-32-le"), dtype=np.uint32
+        )
+        text = codepoints[codes].tobytes().decode("utf-32-le")
+
+        return [text[i : i + seq_len] for i in range(0, len(text), seq_len)]
+
+    def _model_path(self, model_name, max_n):
+        return os.path.join(
+            get_settings().model_path(model_name), f"{model_name}_1-{max_n}-ngrams.pkl"
+        )
+
+    def save_model_weights(self):
+        """Saves the trie of every order into the model folder by model name."""
+
+        pickle_dict = {
+            "model_name": self.model_name,
+            "max_n": self.max_n,
+            "start_prompts": self.start_prompts,
+            "corpus_type": self.corpus_type,
+            "ngram_trie": self.trie.get_state(),
+        }
+
+        model_path = self._model_path(self.model_name, self.max_n)
+
+        if not os.path.isdir(os.path.dirname(model_path)):
+            os.makedirs(os.path.dirname(model_path))
+
+        with open(model_path, "wb") as handle:
+            pickle.dump(pickle_dict, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load_model_weights(self, model_name, max_n):
+        """Reads in pre-trained multi order weights, generating with n = max_n.
+
+        Parameters
+        ----------
+        model_name : str
+            Which model name to read in from the model folder of the settings
+        max_n : int
+            The largest n-gram size the saved model was trained with.
+        """
+
+        with open(self._model_path(model_name, max_n), "rb") as f:
+            markov_model_dict = pickle.load(f)
+
+        self.model_name = model_name
+        self.max_n = markov_model_dict["max_n"]
+        self.corpus_type = markov_model_dict["corpus_type"]
+        self.start_prompts = markov_model_dict["start_prompts"]
+        self.trie = NGramTrie.from_state(markov_model_dict["ngram_trie"])
+        self.set_order(self.max_n)
@@ -0,0 +1,704 @@
+import unicodedata
+
+import numpy as np
+
+# largest n-gram id space that can be represented without overflowing int64, larger
+# id spaces are stored as Python ints
+MAX_ID_SPACE = np.iinfo(np.int64).max
+
+# id spaces up to this size are counted with a dense bincount instead of a sort,
+# when they are also no more than DENSE_COUNT_RATIO times the number of ids counted
+DENSE_COUNT_LIMIT = 2**24
+DENSE_COUNT_RATIO = 4
+
+# largest code point str.split treats as whitespace, U+3000 IDEOGRAPHIC SPACE
+_MAX_WHITESPACE = 0x3000
+
+# whether every code point up to _MAX_WHITESPACE, plus one catch all entry for the
+# larger ones, is whitespace to str.split. New lines are encoded before collapsing
+# whitespace so they aren't included.
+_IS_WHITESPACE = np.array(
+    [chr(c).isspace() and c != ord("\n") for c in range(_MAX_WHITESPACE + 1)] + [False]
+)
+
+_QUOTE, _AMPERSAND, _NEW_LINE, _CARET, _SPACE = (ord(c) for c in '"&\n^ ')
+_AMP = [ord(c) for c in "amp"]
+
+# categories of the letters and digits ChunkedEncoder cuts a word between. Only the
+# lower casing of a capital sigma looks past a character, skipping case ignorable
+# ones like "^" or combining marks, and it stops at any of these.
+_SPLITTABLE_CATEGORIES = frozenset(["Lu", "Ll", "Lt", "Lo", "Nd"])
+
+# lower cased letters ChunkedEncoder never cuts a word next to, the letters of "&amp"
+# which is replaced, also once quotes inside it are removed, and sigma itself
+_UNSPLITTABLE = frozenset("amp\u03c3")
+
+# characters ChunkedEncoder holds back before cutting text without spaces
+MAX_PENDING_CHARS = 2**20
+
+
+def text_to_codepoints(text):
+    """Gets the code points of a text as an array.
+
+    Parameters
+    ----------
+    text : str
+        The text to convert.
+
+    Returns
+    -------
+    np.ndarray
+        uint8 code points if every character is latin-1, so ascii corpora take one
+        byte per character, uint32 code points otherwise.
+    """
+
+    try:
+        return np.frombuffer(text.encode("latin-1"), dtype=np.uint8)
+    except UnicodeEncodeError:
+        return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+
+
+def codepoints_to_text(codepoints):
+    """Converts an array of code points from text_to_codepoints back to text."""
+
+    if codepoints.dtype == np.uint8:
+        return codepoints.tobytes().decode("latin-1")
+
+    return codepoints.astype(np.uint32).tobytes().decode("utf-32-le")
+
+
+def encode_corpus_codepoints(corpus):
+    """Applies the MarkovModel.encode_corpus transformations as array operations.
+
+    The corpus is lower cased, new lines become "^", pairs of double quotes are
+    removed, "&amp" becomes "&" and runs of whitespace become a single space, without
+    building a full size copy of the text for every step.
+
+    Parameters
+    ----------
+    corpus : str
+        The raw corpus text.
+
+    Returns
+    -------
+    np.ndarray
+        The code points of the encoded corpus, see text_to_codepoints.
+    """
+
+    lowered = corpus.lower()
+    has_quote_pairs = '""' in lowered
+    codepoints = text_to_codepoints(lowered)
+    del lowered
+
+    if has_quote_pairs:
+        # str.replace removes pairs left to right, leaving one quote of odd length runs
+        quotes = np.flatnonzero(codepoints == _QUOTE)
+        is_run_start = np.concatenate(([True], np.diff(quotes) != 1))
+        run_starts = np.flatnonzero(is_run_start)
+        run_ids = np.cumsum(is_run_start) - 1
+        run_lengths = np.diff(np.append(run_starts, len(quotes)))[run_ids]
+        is_last = np.arange(len(quotes)) - run_starts[run_ids] == run_lengths - 1
+        keep = np.ones(len(codepoints), dtype=bool)
+        keep[quotes[~(is_last & (run_lengths % 2 == 1))]] = False
+        codepoints = codepoints[keep]
+
+    if codepoints.dtype == np.uint8:
+        is_whitespace = _IS_WHITESPACE[codepoints]
+    else:
+        is_whitespace = _IS_WHITESPACE[np.minimum(codepoints, _MAX_WHITESPACE + 1)]
+    # whitespace following whitespace or the start of the text is dropped
+    keep = ~(is_whitespace & np.concatenate(([True], is_whitespace[:-1])))
+
+    # "&amp" can't overlap itself, so every match is replaced like str.replace would
+    ampersands = np.flatnonzero(codepoints[: max(len(codepoints) - 3, 0)] == _AMPERSAND)
+    for k, letter in enumerate(_AMP, start=1):
+        ampersands = ampersands[codepoints[ampersands + k] == letter]
+    for k in range(1, 4):
+        keep[ampersands + k] = False
+
+    codepoints = np.where(
+        is_whitespace,
+        _SPACE,
+        np.where(codepoints == _NEW_LINE, _CARET, codepoints),
+    ).astype(codepoints.dtype)[keep]
+
+    if len(codepoints) > 0 and codepoints[-1] == _SPACE:
+        codepoints = codepoints[:-1]
+
+    return codepoints
+
+
+class SentenceReservoir:
+    def __init__(self, separator, min_length, size, prefix_length, seed=0):
+        """Uniformly samples sentences of an encoded corpus arriving in pieces.
+
+        Reservoir sampling keeps every qualifying sentence of the whole corpus equally
+        likely to be picked while only holding the sample in memory. Only the first
+        prefix_length characters of the picked sentences are kept. The sample only
+        depends on the seed and the concatenated text, not how it was split.
+
+        Parameters
+        ----------
+        separator : str
+            The character sentences are separated by, like text.split(separator).
+        min_length : int
+            Sentences must be longer than this many characters.
+        size : int
+            How many sentences to sample at most.
+        prefix_length : int
+            How many characters of every sampled sentence to keep.
+        seed : int, optional
+            Seed of the sampling, by default 0
+        """
+
+        self.separator = ord(separator)
+        self.min_length = min_length
+        self.size = size
+        self.prefix_length = prefix_length
+        self.rng = np.random.default_rng(seed)
+        # (sentence index, prefix) of every sampled sentence
+        self.sample = []
+        self.num_seen = 0
+        # start and length of the sentence continuing into the next piece
+        self.pending_prefix = np.zeros(0, dtype=np.uint32)
+        self.pending_length = 0
+
+    def _offer(self, lengths, get_prefix):
+        """Runs the reservoir step for a batch of sentences in corpus order."""
+
+        candidates = np.flatnonzero(lengths > self.min_length)
+        if len(candidates) == 0:
+            return
+
+        # sentence i replaces a random slot with probability size / (i + 1)
+        indexes = self.num_seen + np.arange(len(candidates))
+        slots = np.floor(self.rng.random(len(candidates)) * (indexes + 1)).astype(np.int64)
+        slots = np.where(indexes < self.size, indexes, slots)
+        self.num_seen += len(candidates)
+
+        accepted = slots < self.size
+        for candidate, index, slot in zip(
+            candidates[accepted], indexes[accepted], slots[accepted]
+        ):
+            entry = (int(index), codepoints_to_text(get_prefix(candidate)))
+            if slot == len(self.sample):
+                self.sample.append(entry)
+            else:
+                self.sample[slot] = entry
+
+    def feed(self, codepoints):
+        """Samples the sentences completed by the next piece of the encoded corpus.
+
+        Parameters
+        ----------
+        codepoints : np.ndarray
+            The code points of the next piece, see text_to_codepoints.
+        """
+
+        boundaries = np.flatnonzero(codepoints == self.separator)
+        if len(boundaries) == 0:
+            self._extend_pending(codepoints)
+            return
+
+        starts = np.concatenate(([0], boundaries[:-1] + 1))
+        lengths = boundaries - starts
+        lengths[0] += self.pending_length
+        first_prefix = np.concatenate(
+            (self.pending_prefix, codepoints[: boundaries[0]][: self.prefix_length])
+        )[: self.prefix_length]
+
+        def get_prefix(i):
+            if i == 0:
+                return first_prefix
+            return codepoints[starts[i] : starts[i] + min(lengths[i], self.prefix_length)]
+
+        self._offer(lengths, get_prefix)
+
+        self.pending_prefix = np.zeros(0, dtype=np.uint32)
+        self.pending_length = 0
+        self._extend_pending(codepoints[boundaries[-1] + 1 :])
+
+    def _extend_pending(self, codepoints):
+        missing = self.prefix_length - len(self.pending_prefix)
+        if missing > 0:
+            self.pending_prefix = np.concatenate(
+                (self.pending_prefix, codepoints[:missing])
+            )
+        self.pending_length += len(codepoints)
+
+    def flush(self):
+        """Samples the last sentence and gets the sample.
+
+        Returns
+        -------
+        list of str
+            The prefixes of the sampled sentences in corpus order.
+        """
+
+        self._offer(np.array([self.pending_length]), lambda i: self.pending_prefix)
+        self.pending_prefix = np.zeros(0, dtype=np.uint32)
+        self.pending_length = 0
+
+        return [prefix for _, prefix in sorted(self.sample)]
+
+
+def encode_alphabet(text):
+    """Maps every character in the text to an integer code.
+
+    Parameters
+    ----------
+    text : str or np.ndarray
+        The (already encoded) corpus text, or its code points from
+        text_to_codepoints or encode_corpus_codepoints.
+
+    Returns
+    -------
+    alphabet : str
+        The sorted unique characters of the text, code i refers to alphabet[i].
+    codes : np.ndarray
+        The text as an array of integer codes into the alphabet.
+    """
+
+    codepoints = text_to_codepoints(text) if isinstance(text, str) else text
+
+    # a lookup table over the code points avoids sorting the whole text
+    occurrences = np.bincount(codepoints, minlength=1)
+    unique_codepoints = np.flatnonzero(occurrences)
+    code_lookup = np.zeros(len(occurrences), dtype=np.int64)
+    code_lookup[unique_codepoints] = np.arange(len(unique_codepoints))
+    alphabet = codepoints_to_text(unique_codepoints.astype(np.uint32))
+
+    return alphabet, code_lookup[codepoints]
+
+
+def ngram_id_dtype(base, n):
+    """Gets the dtype the ids of n-grams over an alphabet are stored in.
+
+    Parameters
+    ----------
+    base : int
+        The size of the alphabet.
+    n : int
+        How large the n-grams are.
+
+    Returns
+    -------
+    np.dtype
+        int64 if every id fits in it, otherwise object holding Python ints, which
+        can't overflow for any n but are slower to compute with.
+    """
+
+    return np.dtype(np.int64) if base**n <= MAX_ID_SPACE else np.dtype(object)
+
+
+def codes_to_ngram_ids(ngram_codes, base):
+    """Computes the id of n-grams given as rows of codes.
+
+    Parameters
+    ----------
+    ngram_codes : np.ndarray
+        2d array of integer codes, one n-gram per row.
+    base : int
+        The size of the alphabet the codes index into.
+
+    Returns
+    -------
+    np.ndarray
+        The n-gram id of every row, see ngram_ids.
+    """
+
+    num_ngrams, n = ngram_codes.shape
+    ids = np.zeros(num_ngrams, dtype=ngram_id_dtype(base, n))
+    for k in range(n):
+        ids = ids * base + ngram_codes[:, k].astype(ids.dtype)
+
+    return ids
+
+
+def ngram_id_codes(ids, n, base):
+    """Splits n-gram ids back into the codes of their characters.
+
+    Parameters
+    ----------
+    ids : np.ndarray
+        The n-gram ids.
+    n : int
+        How large the n-grams are.
+    base : int
+        The size of the alphabet the ids were built from.
+
+    Returns
+    -------
+    np.ndarray
+        The (len(ids), n) int64 codes of every n-gram.
+    """
+
+    ids = np.asarray(ids, dtype=ngram_id_dtype(base, n))
+    codes = np.empty((len(ids), n), dtype=np.int64)
+    for k in range(n - 1, -1, -1):
+        codes[:, k] = ids % base
+        ids = ids // base
+
+    return codes
+
+
+def ngram_ids(codes, n, base, num_windows=None):
+    """Computes a unique integer id for the n-gram starting at every position.
+
+    The id is the n-gram read as a base `base` number, so sorting ids sorts the
+    n-grams by their character codes.
+
+    Parameters
+    ----------
+    codes : np.ndarray
+        The integer coded text.
+    n : int
+        How large the n-grams should be.
+    base : int
+        The size of the alphabet the codes index into.
+    num_windows : int, optional
+        How many n-grams to compute from the start of the text, by default every
+        complete n-gram.
+
+    Returns
+    -------
+    np.ndarray
+        The n-gram id for every window, int64 unless the ids overflow it, see
+        ngram_id_dtype.
+    """
+
+    if num_windows is None:
+        num_windows = len(codes) - n + 1
+    num_windows = max(num_windows, 0)
+
+    ids = np.zeros(num_windows, dtype=ngram_id_dtype(base, n))
+    for k in range(n):
+        ids *= base
+        ids += codes[k : k + num_windows].astype(ids.dtype)
+
+    return ids
+
+
+def use_dense_count(id_space, num_ids):
+    """Checks whether ids are cheaper to count with a bincount than with a sort.
+
+    The bincount allocates the whole id space, so it's only used when the space
+    is small both in absolute terms and relative to the number of ids counted.
+
+    Parameters
+    ----------
+    id_space : int
+        How many different ids there could be.
+    num_ids : int
+        How many ids are counted.
+
+    Returns
+    -------
+    bool
+        True if the ids should be counted with a dense bincount.
+    """
+
+    return id_space <= min(DENSE_COUNT_LIMIT, DENSE_COUNT_RATIO * num_ids)
+
+
+def count_transitions(codes, n, base):
+    """Counts how often every code follows every n-gram in the coded text.
+
+    Parameters
+    ----------
+    codes : np.ndarray
+        The integer coded text.
+    n : int
+        How large the n-grams should be.
+    base : int
+        The size of the alphabet the codes index into.
+
+    Returns
+    -------
+    context_ids : np.ndarray
+        The n-gram id of every observed transition, sorted ascending.
+    next_codes : np.ndarray
+        The code following the n-gram, sorted ascending within each n-gram.
+    counts : np.ndarray
+        How many times each transition occurs.
+    """
+
+    num_transitions = max(len(codes) - n, 0)
+    context_ids = ngram_ids(codes, n, base, num_windows=num_transitions)
+    next_codes = np.asarray(codes[n : n + num_transitions], dtype=np.int64)
+
+    if base ** (n + 1) <= MAX_ID_SPACE:
+        keys = context_ids * base + next_codes
+        id_space = base ** (n + 1)
+        if use_dense_count(id_space, num_transitions):
+            dense_counts = np.bincount(keys, minlength=id_space)
+            unique_keys = np.flatnonzero(dense_counts)
+            counts = dense_counts[unique_keys]
+        else:
+            unique_keys, counts = np.unique(keys, return_counts=True)
+        return unique_keys // base, unique_keys % base, counts.astype(np.int64)
+
+    # transition keys don't fit in int64, sort the pairs lexicographically instead
+    order = np.lexsort((next_codes, context_ids))
+    context_ids = context_ids[order]
+    next_codes = next_codes[order]
+    boundaries = np.flatnonzero(
+        np.diff(context_ids) | np.diff(next_codes)
+    ) + 1
+    starts = np.concatenate(([0], boundaries)).astype(np.int64)
+    counts = np.diff(np.concatenate((starts, [num_transitions])))
+    if num_transitions == 0:
+        starts = starts[:0]
+        counts = counts[:0]
+
+    return context_ids[starts], next_codes[starts], counts.astype(np.int64)
+
+
+def decode_ngram_ids(ids, n, alphabet):
+    """Converts n-gram ids back into their n-gram strings.
+
+    Parameters
+    ----------
+    ids : np.ndarray
+        The n-gram ids to decode.
+    n : int
+        How large the n-grams are.
+    alphabet : str
+        The alphabet the ids were built from.
+
+    Returns
+    -------
+    list of str
+        The n-gram for every id.
+    """
+
+    codes = ngram_id_codes(ids, n, len(alphabet))
+
+    codepoints = np.frombuffer(alphabet.encode("utf-32-le"), dtype=np.uint32)
+    text = codepoints[codes].tobytes().decode("utf-32-le")
+
+    return [text[i : i + n] for i in range(0, len(text), n)]
+
+
+def encode_with_alphabet(text, alphabet):
+    """Maps the characters of a text to the codes of an existing alphabet.
+
+    Parameters
+    ----------
+    text : str
+        The (already encoded) text, every character must be in the alphabet.
+    alphabet : str
+        The sorted alphabet from encode_alphabet.
+
+    Returns
+    -------
+    np.ndarray
+        The text as an array of integer codes into the alphabet.
+    """
+
+    codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    alphabet_codepoints = np.frombuffer(alphabet.encode("utf-32-le"), dtype=np.uint32)
+
+    return np.searchsorted(alphabet_codepoints, codepoints).astype(np.int64)
+
+
+def merge_transition_counts(parts, base, n):
+    """Merges transition counts from several parts of a corpus into one.
+
+    Parameters
+    ----------
+    parts : list of tuple
+        (context_ids, next_codes, counts) arrays as returned by count_transitions.
+    base : int
+        The size of the alphabet the codes index into.
+    n : int
+        How large the n-grams are.
+
+    Returns
+    -------
+    tuple of np.ndarray
+        The merged context_ids, next_codes and counts sorted like count_transitions.
+    """
+
+    context_ids = np.concatenate([part[0] for part in parts]).astype(
+        ngram_id_dtype(base, n)
+    )
+    next_codes = np.concatenate([part[1] for part in parts]).astype(np.int64)
+    counts = np.concatenate([part[2] for part in parts]).astype(np.int64)
+
+    if base ** (n + 1) <= MAX_ID_SPACE:
+        keys = context_ids * base + next_codes
+        order = np.argsort(keys, kind="stable")
+        is_new = np.diff(keys[order]) != 0
+    else:
+        order = np.lexsort((next_codes, context_ids))
+        is_new = (np.diff(context_ids[order]) | np.diff(next_codes[order])) != 0
+
+    if len(order) == 0:
+        return context_ids, next_codes, counts
+
+    starts = np.concatenate(([0], np.flatnonzero(is_new) + 1))
+    order_starts = order[starts]
+
+    return (
+        context_ids[order_starts],
+        next_codes[order_starts],
+        np.add.reduceat(counts[order], starts),
+    )
+
+
+class ChunkedEncoder:
+    def __init__(self, encode, max_pending=MAX_PENDING_CHARS):
+        """Applies a corpus encoding function to text arriving in chunks.
+
+        The encoding is applied to the text up to the last space seen so far, the
+        rest is held back until the next chunk. Because every transformation of
+        MarkovModel.encode_corpus is local to the text between spaces, the joined
+        output is identical to encoding the whole text at once. Text without spaces,
+        like minified or CJK text, is instead cut inside a word once more than
+        max_pending characters are held back, between two letters or digits no
+        transformation spans, so the output stays identical. Text with no such
+        pair, like a long run of punctuation, is held back until the next space.
+        Tokenizers encoding the output piece by piece see a cut word as two words.
+
+        Parameters
+        ----------
+        encode : callable
+            Function mapping raw text to encoded text, e.g. MarkovModel.encode_corpus.
+        max_pending : int, optional
+            Most characters held back before cutting inside a word, by default 2**20
+        """
+
+        self.encode = encode
+        self.max_pending = max_pending
+        self.pending = ""
+        # how many leading pending characters are known to hold no cut
+        self.scanned = 0
+        self.has_output = False
+        self.separator = ""
+
+    def _join(self, encoded, ends_at_space=True):
+        if encoded != "":
+            encoded = self.separator + encoded
+            self.has_output = True
+        # text cut inside a word continues without a space
+        if self.has_output:
+            self.separator = " " if ends_at_space else ""
+
+        return encoded
+
+    def _word_split_index(self, text, start=0):
+        """Finds the last index text can be cut at inside a word, 0 if there's none.
+
+        Only cuts after the first start characters are considered.
+        """
+
+        for index in range(len(text) - 1, max(start, 1) - 1, -1):
+            if all(
+                (unicodedata.category(char) in _SPLITTABLE_CATEGORIES)
+                and (char.lower() not in _UNSPLITTABLE)
+                for char in text[index - 1 : index + 1]
+            ):
+                return index
+
+        return 0
+
+    def feed(self, chunk):
+        """Encodes all complete words of the text received so far.
+
+        Parameters
+        ----------
+        chunk : str
+            The next piece of raw text.
+
+        Returns
+        -------
+        str
+            The encoded text, possibly empty, that follows the previous output.
+        """
+
+        text = self.pending + chunk
+        split_index = text.rfind(" ") + 1
+        self.pending = text[split_index:]
+        encoded = ""
+        if split_index > 0:
+            encoded = self._join(self.encode(text[:split_index]))
+            self.scanned = 0
+
+        if len(self.pending) > self.max_pending:
+            text = self.pending
+            split_index = self._word_split_index(text, self.scanned)
+            if split_index > 0:
+                self.pending = text[split_index:]
+                encoded += self._join(
+                    self.encode(text[:split_index]), ends_at_space=False
+                )
+            # no cut is left in the held back text, the next feed only checks new text
+            self.scanned = len(self.pending)
+
+        return encoded
+
+    def flush(self):
+        """Encodes any held back text at the end of the input.
+
+        Returns
+        -------
+        str
+            The encoded remainder of the text.
+        """
+
+        text, self.pending = self.pending, ""
+        self.scanned = 0
+
+        return self._join(self.encode(text))
+
+
+def remap_codes(codes, old_alphabet, new_alphabet):
+    """Maps codes of an alphabet to the codes of a superset alphabet.
+
+    Parameters
+    ----------
+    codes : np.ndarray
+        Codes into old_alphabet.
+    old_alphabet : str
+        The sorted alphabet the codes index into.
+    new_alphabet : str
+        A sorted alphabet containing every character of old_alphabet.
+
+    Returns
+    -------
+    np.ndarray
+        The int64 codes into new_alphabet.
+    """
+
+    code_map = encode_with_alphabet(old_alphabet, new_alphabet)
+
+    return code_map[np.asarray(codes, dtype=np.int64)]
+
+
+def remap_ngram_ids(ids, n, old_alphabet, new_alphabet):
+    """Re-encodes n-gram ids of an alphabet with the codes of a superset alphabet.
+
+    Both alphabets are sorted so the remapped ids keep their relative order.
+
+    Parameters
+    ----------
+    ids : np.ndarray
+        n-gram ids built from old_alphabet.
+    n : int
+        How large the n-grams are.
+    old_alphabet : str
+        The sorted alphabet the ids were built from.
+    new_alphabet : str
+        A sorted alphabet containing every character of old_alphabet.
+
+    Returns
+    -------
+    np.ndarray
+        The n-gram ids over new_alphabet, see ngram_id_dtype.
+    """
+
+    code_map = encode_with_alphabet(old_alphabet, new_alphabet)
+    codes = ngram_id_codes(ids, n, len(old_alphabet))
+
+    return codes_to_ngram_ids(code_map[codes], len(new_alphabet))
@@ -0,0 +1,385 @@
+import numpy as np
+
+from src.models.ngram_engine import ngram_id_dtype, use_dense_count
+from src.models.transition_table import (
+    TransitionTable,
+    cumulative_rows,
+    sample_rows,
+    smallest_code_dtype,
+    sum_rows,
+)
+
+
+def unique_keys(keys, key_space):
+    """Finds the sorted unique keys, their counts and the index of every key.
+
+    Uses a dense bincount when the key space is small relative to the number of keys
+    and falls back to sorting otherwise.
+
+    Parameters
+    ----------
+    keys : np.ndarray
+        Non negative int64 keys.
+    key_space : int
+        Upper bound (exclusive) on the keys.
+
+    Returns
+    -------
+    unique : np.ndarray
+        The sorted unique keys.
+    counts : np.ndarray
+        How many times each unique key occurs.
+    inverse : np.ndarray
+        The index into unique of every key.
+    """
+
+    if use_dense_count(key_space, len(keys)):
+        dense_counts = np.bincount(keys, minlength=key_space)
+        unique = np.flatnonzero(dense_counts)
+        dense_index = np.cumsum(dense_counts > 0) - 1
+
+        return unique, dense_counts[unique], dense_index[keys]
+
+    unique, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+
+    return unique, counts, inverse.reshape(-1)
+
+
+class NGramTrie:
+    def __init__(self, alphabet, max_order, level_keys, offsets, next_codes, weights):
+        """Next letter counts of every context of order 0 to max_order in one trie.
+
+        Contexts are stored read backwards from the letter being predicted, so the
+        order k context "abc" is the child of its order k-1 context "bc" and every
+        order shares the nodes of the orders below it. Node i of level k is identified
+        by level_keys[k][i] = parent * len(alphabet) + code, where parent is its node
+        in level k-1 and code is the letter furthest from the prediction. Level 0 is a
+        single root node holding the unigram counts.
+
+        Every level stores its next letter transitions in the same CSR layout as a
+        TransitionTable, row i holding the transitions of node i.
+
+        Parameters
+        ----------
+        alphabet : str
+            The sorted characters the codes index into.
+        max_order : int
+            The largest context length stored.
+        level_keys : list of np.ndarray
+            Sorted int64 node keys of every level, level 0 holds the single root key 0.
+        offsets : list of np.ndarray
+            Start of each node's transitions for every level.
+        next_codes : list of np.ndarray
+            Packed code of the letter following each node's context for every level.
+        weights : list of np.ndarray
+            uint32 occurence count of each transition for every level.
+        """
+
+        self.alphabet = alphabet
+        self.base = len(alphabet)
+        self.max_order = max_order
+        self.level_keys = level_keys
+        self.offsets = offsets
+        self.next_codes = next_codes
+        self.weights = weights
+
+        self.char_codes = {char: code for code, char in enumerate(alphabet)}
+        self.row_totals = [
+            sum_rows(level_weights, level_offsets)
+            for level_weights, level_offsets in zip(weights, offsets)
+        ]
+        self.cdf = [
+            cumulative_rows(level_weights, level_offsets, level_totals)
+            for level_weights, level_offsets, level_totals in zip(
+                weights, offsets, self.row_totals
+            )
+        ]
+        self._tables = {}
+
+    @classmethod
+    def from_codes(cls, alphabet, codes, max_order):
+        """Counts the transitions of every context order in one pass over coded text.
+
+        Parameters
+        ----------
+        alphabet : str
+            The sorted characters the codes index into.
+        codes : np.ndarray
+            The integer coded text.
+        max_order : int
+            The largest context length to count.
+
+        Returns
+        -------
+        NGramTrie
+            The trie of contexts of order 0 to max_order.
+        """
+
+        base = len(alphabet)
+        code_dtype = smallest_code_dtype(base)
+        codes = np.asarray(codes, dtype=np.int64)
+        num_codes = len(codes)
+
+        level_keys = [np.zeros(1, dtype=np.int64)]
+        offsets, next_codes, weights = [], [], []
+
+        # node of the order k context ending before position t, for t = k..len - 1
+        nodes = np.zeros(num_codes, dtype=np.int64)
+        for order in range(max_order + 1):
+            num_nodes = len(level_keys[-1])
+            if order > 0:
+                keys = nodes[1:] * base + codes[: num_codes - order]
+                node_keys, _, nodes = unique_keys(keys, num_nodes * base)
+                level_keys.append(node_keys)
+                num_nodes = len(node_keys)
+
+            transition_keys, counts, _ = unique_keys(
+                nodes * base + codes[order:], num_nodes * base
+            )
+            rows = transition_keys // base
+            offsets.append(
+                np.concatenate(
+                    ([0], np.cumsum(np.bincount(rows, minlength=len(level_keys[order]))))
+                ).astype(np.int64)
+            )
+            next_codes.append((transition_keys % base).astype(code_dtype))
+            weights.append(counts.astype(np.uint32))
+
+        return cls(alphabet, max_order, level_keys, offsets, next_codes, weights)
+
+    @property
+    def nbytes(self):
+        """Total size of the trie arrays in bytes."""
+
+        return sum(
+            array.nbytes
+            for level_arrays in (
+                self.level_keys,
+                self.offsets,
+                self.next_codes,
+                self.weights,
+                self.row_totals,
+                self.cdf,
+            )
+            for array in level_arrays
+        )
+
+    def find_context(self, context_codes, max_order=None):
+        """Finds the longest stored suffix of a context.
+
+        Parameters
+        ----------
+        context_codes : sequence of int
+            Codes of the context, the letter just before the prediction last. None
+            entries mark letters outside the alphabet.
+        max_order : int, optional
+            Longest suffix to look for, by default the trie's max_order.
+
+        Returns
+        -------
+        order : int
+            Length of the longest suffix found, 0 if not even the last letter was seen.
+        node : int
+            The node of that suffix in level `order`.
+        """
+
+        if max_order is None:
+            max_order = self.max_order
+        max_order = min(max_order, self.max_order, len(context_codes))
+
+        node = 0
+        for order in range(1, max_order + 1):
+            code = context_codes[-order]
+            if code is None:
+                return order - 1, node
+            key = node * self.base + code
+            level_keys = self.level_keys[order]
+            child = int(np.searchsorted(level_keys, key))
+            if child >= len(level_keys) or level_keys[child] != key:
+                return order - 1, node
+            node = child
+
+        return max_order, node
+
+    def find_contexts(self, context_codes, max_order=None):
+        """Finds the longest stored suffix of many contexts at once.
+
+        Parameters
+        ----------
+        context_codes : np.ndarray
+            2d array with one context per row, the letter just before the prediction
+            in the last column. Negative entries mark letters outside the alphabet.
+        max_order : int, optional
+            Longest suffix to look for, by default the trie's max_order.
+
+        Returns
+        -------
+        orders : np.ndarray
+            Length of the longest suffix found for every context.
+        nodes : np.ndarray
+            The node of that suffix in level orders[i].
+        """
+
+        if max_order is None:
+            max_order = self.max_order
+        max_order = min(max_order, self.max_order, context_codes.shape[1])
+
+        num_contexts = len(context_codes)
+        orders = np.zeros(num_contexts, dtype=np.int64)
+        nodes = np.zeros(num_contexts, dtype=np.int64)
+        searching = np.ones(num_contexts, dtype=bool)
+        for order in range(1, max_order + 1):
+            level_keys = self.level_keys[order]
+            if len(level_keys) == 0:
+                break
+            codes = context_codes[:, -order]
+            keys = nodes * self.base + codes
+            children = np.minimum(np.searchsorted(level_keys, keys), len(level_keys) - 1)
+            searching &= (codes >= 0) & (level_keys[children] == keys)
+            if not searching.any():
+                break
+            nodes = np.where(searching, children, nodes)
+            orders[searching] = order
+
+        return orders, nodes
+
+    def sample_codes(self, orders, nodes, uniforms):
+        """Draws the next letter following many context nodes at once.
+
+        Parameters
+        ----------
+        orders : np.ndarray
+            The level of every node.
+        nodes : np.ndarray
+            The nodes from find_contexts.
+        uniforms : np.ndarray
+            A uniform random draw in [0, 1) for every node.
+
+        Returns
+        -------
+        np.ndarray
+            The int64 code of the sampled next letter for every node.
+        """
+
+        codes = np.empty(len(nodes), dtype=np.int64)
+        for order in np.unique(orders):
+            at_order = orders == order
+            codes[at_order] = sample_rows(
+                self.offsets[order],
+                self.cdf[order],
+                self.next_codes[order],
+                nodes[at_order],
+                uniforms[at_order],
+            )
+
+        return codes
+
+    def sample_code(self, order, node, uniform):
+        """Draws the next letter following a context node.
+
+        Parameters
+        ----------
+        order : int
+            The level of the node.
+        node : int
+            The node from find_context.
+        uniform : float
+            A uniform random draw in [0, 1).
+
+        Returns
+        -------
+        int
+            The code of the sampled next letter.
+        """
+
+        start, end = self.offsets[order][node], self.offsets[order][node + 1]
+        index = np.searchsorted(self.cdf[order][start:end], uniform, side="right")
+
+        return int(self.next_codes[order][start + index])
+
+    def node_ngram_ids(self, order):
+        """Gets the TransitionTable n-gram id of every node of a level.
+
+        Parameters
+        ----------
+        order : int
+            The level to compute ids for.
+
+        Returns
+        -------
+        np.ndarray
+            The n-gram id of every node in node order, Python ints when the ids
+            overflow int64.
+        """
+
+        ids = np.zeros(1, dtype=ngram_id_dtype(self.base, order))
+        for level in range(1, order + 1):
+            parents, codes = np.divmod(self.level_keys[level], self.base)
+            ids = codes.astype(ids.dtype) * self.base ** (level - 1) + ids[parents]
+
+        return ids
+
+    def transition_table(self, order):
+        """Gets the transitions of a single context order as a TransitionTable.
+
+        Parameters
+        ----------
+        order : int
+            The n-gram size, between 1 and max_order.
+
+        Returns
+        -------
+        TransitionTable
+            The transitions of every n-gram of that size, cached after the first call.
+        """
+
+        if not 1 <= order <= self.max_order:
+            raise ValueError(f"Order must be between 1 and {self.max_order}, got {order}")
+
+        if order not in self._tables:
+            ngram_ids = self.node_ngram_ids(order)
+            node_order = np.argsort(ngram_ids)
+            row_lengths = np.diff(self.offsets[order])[node_order]
+            offsets = np.concatenate(([0], np.cumsum(row_lengths))).astype(np.int64)
+            # position of every transition once rows are sorted by n-gram id
+            gather = np.repeat(
+                self.offsets[order][node_order] - offsets[:-1], row_lengths
+            ) + np.arange(offsets[-1])
+
+            self._tables[order] = TransitionTable(
+                self.alphabet,
+                order,
+                ngram_ids[node_order],
+                offsets,
+                self.next_codes[order][gather],
+                self.weights[order][gather],
+                cdf=self.cdf[order][gather],
+                row_totals=self.row_totals[order][node_order],
+            )
+
+        return self._tables[order]
+
+    def get_state(self):
+        """Gets the trie as a dict of plain arrays for serialization."""
+
+        return {
+            "alphabet": self.alphabet,
+            "max_order": self.max_order,
+            "level_keys": self.level_keys,
+            "offsets": self.offsets,
+            "next_codes": self.next_codes,
+            "weights": self.weights,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuilds a trie from the output of get_state."""
+
+        return cls(
+            state["alphabet"],
+            state["max_order"],
+            state["level_keys"],
+            state["offsets"],
+            state["next_codes"],
+            state["weights"],
+        )
@@ -0,0 +1,134 @@
+import os
+
+import numpy as np
+
+from src.models.ngram_engine import count_transitions, merge_transition_counts
+
+# shards smaller than this are not worth the cost of a worker process
+MIN_SHARD_SIZE = 2**18
+
+
+def resolve_workers(workers):
+    """Gets the number of worker processes to count with.
+
+    Parameters
+    ----------
+    workers : int or None
+        The requested number of workers, None uses every available core.
+
+    Returns
+    -------
+    int
+        The number of worker processes, at least 1.
+    """
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError(f"Number of workers must be at least 1, got {workers}")
+
+    return workers
+
+
+def shard_bounds(num_transitions, num_shards):
+    """Splits the transition positions of a text into contiguous shards.
+
+    Parameters
+    ----------
+    num_transitions : int
+        Number of transitions in the text, len(codes) - n.
+    num_shards : int
+        How many shards to split into.
+
+    Returns
+    -------
+    list of tuple
+        The (start, stop) transition positions of every shard.
+    """
+
+    edges = np.linspace(0, num_transitions, num_shards + 1).astype(np.int64)
+
+    return [(int(start), int(stop)) for start, stop in zip(edges[:-1], edges[1:])]
+
+
+def _attach(name):
+    from multiprocessing import shared_memory
+
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python < 3.13 can't opt out of tracking, the block is still unlinked by
+        # the parent process that created it
+        return shared_memory.SharedMemory(name=name)
+
+
+def _count_shard(shm_name, num_codes, start, stop, n, base):
+    """Counts the transitions at positions start to stop of the shared coded text.
+
+    Runs in a worker process, the shard reads n codes past stop so the n-grams
+    crossing into the next shard are counted exactly once.
+    """
+
+    shm = _attach(shm_name)
+    codes = np.ndarray((num_codes,), dtype=np.int64, buffer=shm.buf)
+    # copy the results out so nothing references the shared buffer on close
+    counts = tuple(
+        np.array(array) for array in count_transitions(codes[start : stop + n], n, base)
+    )
+    del codes
+    shm.close()
+
+    return counts
+
+
+def count_transitions_parallel(codes, n, base, workers=None):
+    """Counts transitions like count_transitions across several processes.
+
+    The coded text is placed in shared memory once and every worker counts a
+    contiguous shard of it, overlapping the next shard by n codes. The shard counts
+    are merged into exactly the arrays count_transitions returns for the whole text.
+
+    Parameters
+    ----------
+    codes : np.ndarray
+        The integer coded text.
+    n : int
+        How large the n-grams should be.
+    base : int
+        The size of the alphabet the codes index into.
+    workers : int, optional
+        How many worker processes to count with, by default one per core.
+
+    Returns
+    -------
+    tuple of np.ndarray
+        The context_ids, next_codes and counts sorted like count_transitions.
+    """
+
+    workers = resolve_workers(workers)
+    num_transitions = max(len(codes) - n, 0)
+    num_shards = min(workers, num_transitions // MIN_SHARD_SIZE)
+    if num_shards <= 1:
+        return count_transitions(codes, n, base)
+
+    # process pools and shared memory are only imported for corpora large enough
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(create=True, size=len(codes) * 8)
+    try:
+        shared_codes = np.ndarray((len(codes),), dtype=np.int64, buffer=shm.buf)
+        shared_codes[:] = codes
+        del shared_codes
+
+        with ProcessPoolExecutor(max_workers=num_shards) as executor:
+            futures = [
+                executor.submit(_count_shard, shm.name, len(codes), start, stop, n, base)
+                for start, stop in shard_bounds(num_transitions, num_shards)
+            ]
+            parts = [future.result() for future in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return merge_transition_counts(parts, base, n)
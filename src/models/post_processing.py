@@ -0,0 +1,186 @@
+"""Trimming and validation of generated text into tweets.
+
+The rules of every corpus type are picked once when a PostProcessor is created and
+split each candidate a single time. process rejects a candidate as soon as it's
+certain to fail validation, before the trim is finished.
+"""
+
+# tweets shorter than this aren't posted
+MIN_TWEET_LENGTH = 60
+
+# tweets with this many encoded new lines or more aren't posted
+MAX_NEW_LINES = 3
+
+
+def _remove_curly_quotes(text):
+    return text.replace("“", "").replace("”", "")
+
+
+class PostProcessor:
+    def __init__(
+        self, corpus_type, min_length=MIN_TWEET_LENGTH, max_new_lines=MAX_NEW_LINES
+    ):
+        """Trims and validates generated text with the rules of a corpus type.
+
+        Parameters
+        ----------
+        corpus_type : str
+            What style of writing the text was generated in, "book", "lyric" or
+            "tweet". Other corpus types are only capitalized.
+        min_length : int, optional
+            Shortest valid tweet, by default 60
+        max_new_lines : int, optional
+            Tweets with this many encoded new lines or more are invalid, by default 3
+        """
+
+        self.corpus_type = corpus_type
+        self.min_length = min_length
+        self.max_new_lines = max_new_lines
+        self._trim_lines = {
+            "book": self._trim_book,
+            "tweet": self._trim_tweet,
+            "lyric": self._trim_lyric,
+        }.get(corpus_type, self._trim_other)
+
+    def _trim_book(self, raw_tweet, max_new_lines=None):
+        end = raw_tweet.rfind("^")
+        if end >= 0:
+            # keep the complete sentences of every line but the last, likely incomplete
+            # one, joined into a single paragraph. Every piece ended by a period is a
+            # sentence once the start of it on a previous line is cut off.
+            pieces = raw_tweet[:end].split(".")
+            del pieces[-1]
+            raw_tweet = "".join(
+                [
+                    piece[piece.rfind("^") + 1 :].strip().capitalize() + ". "
+                    for piece in pieces
+                ]
+            )
+
+        return _remove_curly_quotes(raw_tweet)
+
+    def _trim_tweet(self, raw_tweet, max_new_lines=None):
+        end = raw_tweet.rfind("^")
+        if end >= 0:
+            # keep the complete lines of tweets, dropping the last sentence of every
+            # line with more than one
+            parts = []
+            num_new_lines = 0
+            for line in raw_tweet[:end].split("^"):
+                if "." in line:
+                    pieces = line.split(".")
+                    del pieces[-1]
+                else:
+                    # a line without periods is kept whole, which splits it into
+                    # letters, every space of it becomes a new line
+                    pieces = line.strip()
+                    num_spaces = len(pieces) - sum(map(len, pieces.split()))
+                    if (max_new_lines is not None) and (
+                        num_new_lines + num_spaces >= max_new_lines
+                    ):
+                        return None
+
+                line_parts = [piece.strip().capitalize() + ". " for piece in pieces]
+                # empty sentences are where new lines were
+                num_line_new_lines = line_parts.count(". ")
+                if num_line_new_lines > 0:
+                    num_new_lines += num_line_new_lines
+                    if (max_new_lines is not None) and (num_new_lines >= max_new_lines):
+                        return None
+                    line_parts = ["^" if part == ". " else part for part in line_parts]
+                parts += line_parts
+            raw_tweet = "".join(parts)
+
+        # missing unique closing quote character, remove the quotes
+        raw_tweet = _remove_curly_quotes(raw_tweet)
+        if raw_tweet.count('"') % 2 != 0:
+            raw_tweet = raw_tweet.replace('"', "")
+
+        return raw_tweet
+
+    def _trim_lyric(self, raw_tweet, max_new_lines=None):
+        if "^" in raw_tweet:
+            lines = raw_tweet.split("^")[:-1]
+            # the complete lines are joined back with one new line fewer
+            if max_new_lines is not None and len(lines) - 1 >= max_new_lines:
+                return None
+            raw_tweet = "^".join([line.capitalize() for line in lines])
+
+        return _remove_curly_quotes(raw_tweet)
+
+    def _trim_other(self, raw_tweet, max_new_lines=None):
+        return raw_tweet
+
+    def trim(self, raw_tweet):
+        """Cleans up generated text to remove incomplete sentences.
+
+        Parameters
+        ----------
+        raw_tweet : str
+            The raw Markov Model generated text string.
+
+        Returns
+        -------
+        str
+            The cleaned up tweet.
+        """
+
+        return self._trim_lines(raw_tweet).capitalize()
+
+    def validate(self, trimmed_tweet):
+        """Checks a trimmed tweet has few enough new lines and is long enough to post.
+
+        Parameters
+        ----------
+        trimmed_tweet : str
+            The generated tweet after trimming before decoding
+
+        Returns
+        -------
+        bool
+            True if it's a valid tweet, False if it's not.
+        """
+
+        return (trimmed_tweet.count("^") < self.max_new_lines) and (
+            len(trimmed_tweet) >= self.min_length
+        )
+
+    def process(self, raw_tweet):
+        """Trims generated text and validates the result.
+
+        Parameters
+        ----------
+        raw_tweet : str
+            The raw Markov Model generated text string.
+
+        Returns
+        -------
+        str or None
+            The trimmed tweet, None if it isn't valid.
+        """
+
+        trimmed_tweet = self._trim_lines(raw_tweet, self.max_new_lines)
+        if trimmed_tweet is None:
+            return None
+
+        trimmed_tweet = trimmed_tweet.capitalize()
+
+        return trimmed_tweet if self.validate(trimmed_tweet) else None
+
+    def process_batch(self, raw_tweets):
+        """Trims and validates many generated texts.
+
+        Parameters
+        ----------
+        raw_tweets : list of str
+            The raw Markov Model generated text strings.
+
+        Returns
+        -------
+        list of str or None
+            The trimmed tweet of every text, None for the invalid ones.
+        """
+
+        process = self.process
+
+        return [process(raw_tweet) for raw_tweet in raw_tweets]
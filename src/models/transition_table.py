@@ -0,0 +1,738 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+from src.models.ngram_engine import (
+    decode_ngram_ids,
+    merge_transition_counts,
+    ngram_id_dtype,
+    remap_codes,
+    remap_ngram_ids,
+)
+
+
+def smallest_code_dtype(base):
+    """Gets the smallest unsigned integer type able to hold codes of an alphabet.
+
+    Parameters
+    ----------
+    base : int
+        The size of the alphabet.
+
+    Returns
+    -------
+    np.dtype
+        One of uint8, uint16 or uint32.
+    """
+
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if base <= np.iinfo(dtype).max + 1:
+            return np.dtype(dtype)
+
+    raise ValueError(f"Alphabet of {base} characters is too large to pack")
+
+
+def sum_rows(weights, offsets):
+    """Sums the weights of every row of a CSR table.
+
+    Parameters
+    ----------
+    weights : np.ndarray
+        The weight of every transition.
+    offsets : np.ndarray
+        Start of each row's transitions, one longer than the number of rows.
+
+    Returns
+    -------
+    np.ndarray
+        The float64 total weight of every row.
+    """
+
+    if len(offsets) <= 1:
+        return np.zeros(0, dtype=np.float64)
+
+    return np.add.reduceat(weights, offsets[:-1], dtype=np.float64)
+
+
+def cumulative_rows(weights, offsets, row_totals):
+    """Builds the cumulative probabilities of every row of a CSR table.
+
+    Entry i holds the probability of drawing any of the row's transitions up to and
+    including i, the last entry of each row is exactly 1.
+
+    Parameters
+    ----------
+    weights : np.ndarray
+        The weight of every transition.
+    offsets : np.ndarray
+        Start of each row's transitions, one longer than the number of rows.
+    row_totals : np.ndarray
+        The total weight of every row, see sum_rows.
+
+    Returns
+    -------
+    np.ndarray
+        float32 cumulative probabilities aligned with the weights.
+    """
+
+    cumulative = np.cumsum(weights, dtype=np.float64)
+    row_lengths = np.diff(offsets)
+    row_starts = offsets[:-1]
+    preceding = cumulative[row_starts] - weights[row_starts]
+    cdf = (cumulative - np.repeat(preceding, row_lengths)) / np.repeat(
+        row_totals, row_lengths
+    )
+    cdf[offsets[1:] - 1] = 1.0
+
+    return cdf.astype(np.float32)
+
+
+def sample_rows(offsets, cdf, next_codes, rows, uniforms):
+    """Draws a transition from many rows of a CSR table at once.
+
+    Runs a binary search over every row's cumulative distribution in lockstep, so the
+    number of array passes grows with the log of the longest row.
+
+    Parameters
+    ----------
+    offsets : np.ndarray
+        Start of each row's transitions, one longer than the number of rows.
+    cdf : np.ndarray
+        Cumulative probabilities of every row, see cumulative_rows.
+    next_codes : np.ndarray
+        The code of every transition.
+    rows : np.ndarray
+        The rows to draw from.
+    uniforms : np.ndarray
+        A uniform random draw in [0, 1) for every row.
+
+    Returns
+    -------
+    np.ndarray
+        The code of the sampled transition for every row.
+    """
+
+    low = offsets[rows]
+    high = offsets[rows + 1] - 1
+    # the last entry of a row is 1 so it never needs comparing against a draw
+    while True:
+        searching = low < high
+        if not searching.any():
+            break
+        middle = (low + high) // 2
+        go_right = searching & (cdf[middle] <= uniforms)
+        low = np.where(go_right, middle + 1, low)
+        high = np.where(searching & ~go_right, middle, high)
+
+    return next_codes[low]
+
+
+class TransitionTable:
+    def __init__(
+        self,
+        alphabet,
+        n,
+        ngram_ids,
+        offsets,
+        next_codes,
+        weights,
+        cdf=None,
+        row_totals=None,
+        quantize=None,
+    ):
+        """A compact, CSR style table of the letters following every n-gram.
+
+        Row i holds the transitions of the n-gram with id ngram_ids[i], they are stored
+        in next_codes[offsets[i] : offsets[i + 1]] with matching weights.
+
+        Parameters
+        ----------
+        alphabet : str
+            The sorted characters the codes index into.
+        n : int
+            How large the n-grams are.
+        ngram_ids : np.ndarray
+            Sorted id of every n-gram, see ngram_engine.ngram_ids, Python ints when
+            the ids overflow int64.
+        offsets : np.ndarray
+            Start of each n-gram's transitions, one longer than ngram_ids.
+        next_codes : np.ndarray
+            Packed code of the letter following the n-gram.
+        weights : np.ndarray
+            uint32 occurence counts, or float32 probabilities for tables converted
+            from models that only stored probabilities.
+        cdf : np.ndarray, optional
+            Precomputed cumulative probabilities of each row, see build_cdf, by
+            default built from the weights.
+        row_totals : np.ndarray, optional
+            Precomputed float64 sum of the weights of each row, by default summed
+            from the weights.
+        quantize : str, optional
+            "uint16" or "uint8" when the weights are counts scaled down to fit that
+            type by compressed_format.quantize_counts, by default None for true
+            occurence counts.
+        """
+
+        self.alphabet = alphabet
+        self.n = n
+        self.base = len(alphabet)
+        self.ngram_ids = ngram_ids
+        self.offsets = offsets
+        self.next_codes = next_codes
+        self.weights = weights
+        self.quantize = quantize
+
+        self.char_codes = {char: code for code, char in enumerate(alphabet)}
+        # shifting an n-gram id by one letter drops its leading code
+        self.leading_power = self.base ** (n - 1)
+        self.row_totals = sum_rows(weights, offsets) if row_totals is None else row_totals
+        self.cdf = self.build_cdf() if cdf is None else cdf
+
+    def build_cdf(self):
+        """Builds the cumulative next letter probabilities of every row.
+
+        Entry i holds the probability of drawing any of the row's letters up to and
+        including i, the last entry of each row is exactly 1.
+
+        Returns
+        -------
+        np.ndarray
+            float32 cumulative probabilities aligned with next_codes.
+        """
+
+        return cumulative_rows(self.weights, self.offsets, self.row_totals)
+
+    @classmethod
+    def from_transitions(cls, alphabet, n, context_ids, next_codes, weights):
+        """Builds a table from the sorted transition counts of the training engine.
+
+        Parameters
+        ----------
+        alphabet : str
+            The sorted characters the codes index into.
+        n : int
+            How large the n-grams are.
+        context_ids : np.ndarray
+            The n-gram id of every transition, sorted ascending.
+        next_codes : np.ndarray
+            The code following the n-gram for every transition.
+        weights : np.ndarray
+            How many times each transition occured, floating point weights are kept
+            as float32 probabilities.
+
+        Returns
+        -------
+        TransitionTable
+            The packed transition table.
+        """
+
+        weights = np.asarray(weights)
+        if np.issubdtype(weights.dtype, np.floating):
+            weights = weights.astype(np.float32)
+        else:
+            weights = weights.astype(np.uint32)
+
+        context_ids = np.asarray(context_ids, dtype=ngram_id_dtype(len(alphabet), n))
+        row_starts = np.flatnonzero(np.diff(context_ids)) + 1
+        row_starts = np.concatenate(([0], row_starts)) if len(context_ids) else row_starts
+        offsets = np.concatenate((row_starts, [len(context_ids)])).astype(np.int64)
+
+        return cls(
+            alphabet,
+            n,
+            context_ids[row_starts],
+            offsets,
+            np.asarray(next_codes).astype(smallest_code_dtype(len(alphabet))),
+            weights,
+        )
+
+    def with_alphabet(self, alphabet):
+        """Re-encodes the table with the codes of a superset alphabet.
+
+        Parameters
+        ----------
+        alphabet : str
+            A sorted alphabet containing every character of the table's alphabet.
+
+        Returns
+        -------
+        TransitionTable
+            The same transitions over the new alphabet.
+        """
+
+        if alphabet == self.alphabet:
+            return self
+
+        return TransitionTable(
+            alphabet,
+            self.n,
+            remap_ngram_ids(self.ngram_ids, self.n, self.alphabet, alphabet),
+            self.offsets,
+            remap_codes(self.next_codes, self.alphabet, alphabet).astype(
+                smallest_code_dtype(len(alphabet))
+            ),
+            self.weights,
+            cdf=self.cdf,
+            row_totals=self.row_totals,
+            quantize=self.quantize,
+        )
+
+    def add_counts(self, alphabet, context_ids, next_codes, counts):
+        """Merges new transition counts into the table.
+
+        Only the rows of n-grams that received new counts are merged and
+        renormalized, then spliced in between the other rows, which are copied over.
+
+        Parameters
+        ----------
+        alphabet : str
+            The sorted alphabet the new counts were built from, may contain
+            characters the table hasn't seen yet.
+        context_ids : np.ndarray
+            The n-gram id of every new transition.
+        next_codes : np.ndarray
+            The code following the n-gram for every new transition.
+        counts : np.ndarray
+            How many times each new transition occured.
+
+        Returns
+        -------
+        TransitionTable
+            A new table holding the combined counts.
+
+        Raises
+        ------
+        ValueError
+            If the table only stores probabilities or quantized counts, as models
+            converted from older pickles or loaded from compressed files do.
+        """
+
+        if not np.issubdtype(self.weights.dtype, np.integer):
+            raise ValueError(
+                "Can't add counts to a table that only stores probabilities, retrain it"
+            )
+        if self.quantize is not None:
+            raise ValueError(
+                f"Can't add counts to a table with counts quantized to {self.quantize}, "
+                "retrain it or load weights saved without quantization"
+            )
+
+        if len(context_ids) == 0:
+            return self
+
+        merged_alphabet = "".join(sorted(set(self.alphabet) | set(alphabet)))
+        table = self.with_alphabet(merged_alphabet)
+        if alphabet != merged_alphabet:
+            context_ids = remap_ngram_ids(context_ids, self.n, alphabet, merged_alphabet)
+            next_codes = remap_codes(next_codes, alphabet, merged_alphabet)
+        context_ids = np.asarray(context_ids, dtype=table.ngram_ids.dtype)
+
+        # the existing rows of the n-grams receiving new counts
+        positions = np.searchsorted(table.ngram_ids, context_ids)
+        in_table = positions < len(table.ngram_ids)
+        in_table[in_table] = table.ngram_ids[positions[in_table]] == context_ids[in_table]
+        old_touched_rows = np.zeros(len(table.ngram_ids), dtype=bool)
+        old_touched_rows[positions[in_table]] = True
+        old_lengths = np.diff(table.offsets)
+        old_touched_transitions = np.repeat(old_touched_rows, old_lengths)
+
+        # merge the counts of the touched rows only
+        touched_context_ids, touched_next_codes, touched_counts = (
+            merge_transition_counts(
+                [
+                    (
+                        np.repeat(
+                            table.ngram_ids[old_touched_rows],
+                            old_lengths[old_touched_rows],
+                        ),
+                        table.next_codes[old_touched_transitions],
+                        table.weights[old_touched_transitions],
+                    ),
+                    (context_ids, next_codes, counts),
+                ],
+                table.base,
+                table.n,
+            )
+        )
+        touched_weights = touched_counts.astype(np.uint32)
+        touched_starts = np.flatnonzero(np.diff(touched_context_ids)) + 1
+        touched_starts = np.concatenate(([0], touched_starts)).astype(np.int64)
+        touched_ids = touched_context_ids[touched_starts]
+        touched_offsets = np.concatenate(
+            (touched_starts, [len(touched_weights)])
+        ).astype(np.int64)
+        touched_totals = sum_rows(touched_weights, touched_offsets)
+
+        # splice the touched rows in between the untouched ones, both are sorted
+        kept_ids = table.ngram_ids[~old_touched_rows]
+        num_rows = len(kept_ids) + len(touched_ids)
+        touched_rows = np.zeros(num_rows, dtype=bool)
+        touched_rows[
+            np.searchsorted(kept_ids, touched_ids) + np.arange(len(touched_ids))
+        ] = True
+
+        ngram_ids = np.empty(num_rows, dtype=table.ngram_ids.dtype)
+        ngram_ids[touched_rows] = touched_ids
+        ngram_ids[~touched_rows] = kept_ids
+        row_lengths = np.empty(num_rows, dtype=np.int64)
+        row_lengths[touched_rows] = np.diff(touched_offsets)
+        row_lengths[~touched_rows] = old_lengths[~old_touched_rows]
+        offsets = np.concatenate(([0], np.cumsum(row_lengths))).astype(np.int64)
+        row_totals = np.empty(num_rows, dtype=np.float64)
+        row_totals[touched_rows] = touched_totals
+        row_totals[~touched_rows] = table.row_totals[~old_touched_rows]
+
+        code_dtype = smallest_code_dtype(len(merged_alphabet))
+        touched_transitions = np.repeat(touched_rows, row_lengths)
+        merged_next_codes = np.empty(offsets[-1], dtype=code_dtype)
+        merged_next_codes[touched_transitions] = touched_next_codes
+        merged_next_codes[~touched_transitions] = table.next_codes[
+            ~old_touched_transitions
+        ]
+        weights = np.empty(offsets[-1], dtype=np.uint32)
+        weights[touched_transitions] = touched_weights
+        weights[~touched_transitions] = table.weights[~old_touched_transitions]
+
+        # untouched rows keep their cumulative probabilities, only touched ones are
+        # renormalized
+        cdf = np.empty(offsets[-1], dtype=np.float32)
+        cdf[touched_transitions] = cumulative_rows(
+            touched_weights, touched_offsets, touched_totals
+        )
+        cdf[~touched_transitions] = table.cdf[~old_touched_transitions]
+
+        return TransitionTable(
+            merged_alphabet,
+            self.n,
+            ngram_ids,
+            offsets,
+            merged_next_codes,
+            weights,
+            cdf=cdf,
+            row_totals=row_totals,
+        )
+
+    @classmethod
+    def from_dict(cls, ngram_dict, n):
+        """Builds a table from a dict of n-gram to next letter counts or probabilities.
+
+        Parameters
+        ----------
+        ngram_dict : dict
+            Mapping of n-gram string to a dict of next letter to count or probability.
+        n : int
+            How large the n-grams are.
+
+        Returns
+        -------
+        TransitionTable
+            The packed transition table, weights are uint32 if every value is an
+            integer count, otherwise float32 probabilities.
+        """
+
+        chars = set()
+        for ngram, next_letters in ngram_dict.items():
+            chars.update(ngram)
+            chars.update(next_letters)
+        alphabet = "".join(sorted(chars))
+        char_codes = {char: code for code, char in enumerate(alphabet)}
+        base = len(alphabet)
+
+        context_ids, next_codes, weights = [], [], []
+        for ngram, next_letters in ngram_dict.items():
+            ngram_id = 0
+            for char in ngram:
+                ngram_id = ngram_id * base + char_codes[char]
+            for letter, weight in next_letters.items():
+                context_ids.append(ngram_id)
+                next_codes.append(char_codes[letter])
+                weights.append(weight)
+
+        context_ids = np.array(context_ids, dtype=ngram_id_dtype(base, n))
+        next_codes = np.array(next_codes, dtype=np.int64)
+        order = np.lexsort((next_codes, context_ids))
+        is_count = all(isinstance(weight, (int, np.integer)) for weight in weights)
+        weights = np.array(weights, dtype=np.int64 if is_count else np.float32)
+
+        return cls.from_transitions(
+            alphabet, n, context_ids[order], next_codes[order], weights[order]
+        )
+
+    def __len__(self):
+        return len(self.ngram_ids)
+
+    @property
+    def nbytes(self):
+        """Total size of the table arrays in bytes."""
+
+        return (
+            self.ngram_ids.nbytes
+            + self.offsets.nbytes
+            + self.next_codes.nbytes
+            + self.weights.nbytes
+            + self.row_totals.nbytes
+            + self.cdf.nbytes
+        )
+
+    def encode_ngram(self, ngram):
+        """Gets the id of an n-gram string.
+
+        Parameters
+        ----------
+        ngram : str
+            The n-gram to look up.
+
+        Returns
+        -------
+        int or None
+            The n-gram id, None if it contains characters outside the alphabet.
+        """
+
+        ngram_id = 0
+        for char in ngram:
+            code = self.char_codes.get(char)
+            if code is None:
+                return None
+            ngram_id = ngram_id * self.base + code
+
+        return ngram_id
+
+    def shift_ngram_id(self, ngram_id, code):
+        """Gets the id of the n-gram formed by appending a letter to an n-gram.
+
+        Parameters
+        ----------
+        ngram_id : int
+            The id of the current n-gram.
+        code : int
+            The code of the appended letter.
+
+        Returns
+        -------
+        int
+            The id of the last n letters after appending.
+        """
+
+        return (ngram_id % self.leading_power) * self.base + code
+
+    def find_row_id(self, ngram_id):
+        """Finds the row holding the transitions of an n-gram id.
+
+        Parameters
+        ----------
+        ngram_id : int or None
+            The n-gram id to look up.
+
+        Returns
+        -------
+        int
+            The row index, -1 if the n-gram was never seen.
+        """
+
+        if ngram_id is None:
+            return -1
+        row = int(np.searchsorted(self.ngram_ids, ngram_id))
+        if row < len(self.ngram_ids) and self.ngram_ids[row] == ngram_id:
+            return row
+
+        return -1
+
+    def find_rows(self, ngram_ids):
+        """Finds the rows of many n-gram ids at once.
+
+        Parameters
+        ----------
+        ngram_ids : np.ndarray
+            The n-gram ids to look up.
+
+        Returns
+        -------
+        np.ndarray
+            The row index of every id, -1 where the n-gram was never seen.
+        """
+
+        rows = np.searchsorted(self.ngram_ids, ngram_ids)
+        clipped = np.minimum(rows, max(len(self.ngram_ids) - 1, 0))
+        if len(self.ngram_ids) == 0:
+            return np.full(len(rows), -1, dtype=np.int64)
+        found = self.ngram_ids[clipped] == ngram_ids
+
+        return np.where(found, rows, -1)
+
+    def find_row(self, ngram):
+        """Finds the row holding the transitions of an n-gram.
+
+        Parameters
+        ----------
+        ngram : str
+            The n-gram to look up, must be of length n.
+
+        Returns
+        -------
+        int
+            The row index, -1 if the n-gram was never seen.
+        """
+
+        if len(ngram) != self.n:
+            return -1
+
+        return self.find_row_id(self.encode_ngram(ngram))
+
+    def sample_code(self, row, uniform):
+        """Draws the next letter of a row by inverting its cumulative distribution.
+
+        Parameters
+        ----------
+        row : int
+            The row index from find_row.
+        uniform : float
+            A uniform random draw in [0, 1).
+
+        Returns
+        -------
+        int
+            The code of the sampled next letter.
+        """
+
+        start, end = self.offsets[row], self.offsets[row + 1]
+        index = np.searchsorted(self.cdf[start:end], uniform, side="right")
+
+        return int(self.next_codes[start + index])
+
+    def row_probabilities(self, row):
+        """Gets the next letter codes and their probabilities for a row.
+
+        Parameters
+        ----------
+        row : int
+            The row index from find_row.
+
+        Returns
+        -------
+        next_codes : np.ndarray
+            The codes of the letters that can follow the n-gram.
+        probabilities : np.ndarray
+            The float64 probability of each letter.
+        """
+
+        start, end = self.offsets[row], self.offsets[row + 1]
+
+        return (
+            self.next_codes[start:end],
+            self.weights[start:end].astype(np.float64) / self.row_totals[row],
+        )
+
+    def sample_codes(self, rows, uniforms):
+        """Draws the next letter of many rows at once, see sample_rows.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            Valid row indices from find_rows.
+        uniforms : np.ndarray
+            A uniform random draw in [0, 1) for every row.
+
+        Returns
+        -------
+        np.ndarray
+            The code of the sampled next letter for every row.
+        """
+
+        return sample_rows(self.offsets, self.cdf, self.next_codes, rows, uniforms)
+
+    def next_letter_probabilities(self, row):
+        """Gets the next letter probabilities of a row in the original dict format.
+
+        Parameters
+        ----------
+        row : int
+            The row index from find_row.
+
+        Returns
+        -------
+        dict
+            Mapping of next letter to its probability.
+        """
+
+        next_codes, probabilities = self.row_probabilities(row)
+
+        return {
+            self.alphabet[code]: probability
+            for code, probability in zip(next_codes.tolist(), probabilities.tolist())
+        }
+
+    def ngrams(self):
+        """Decodes the n-gram string of every row.
+
+        Returns
+        -------
+        list of str
+            The n-grams in row order.
+        """
+
+        return decode_ngram_ids(self.ngram_ids, self.n, self.alphabet)
+
+    def get_state(self):
+        """Gets the table as a dict of plain arrays for serialization."""
+
+        return {
+            "alphabet": self.alphabet,
+            "n": self.n,
+            "ngram_ids": self.ngram_ids,
+            "offsets": self.offsets,
+            "next_codes": self.next_codes,
+            "weights": self.weights,
+            "quantize": self.quantize,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuilds a table from the output of get_state.
+
+        The state may also hold precomputed "cdf" and "row_totals" arrays, which are
+        used as is instead of being rebuilt from the weights.
+        """
+
+        return cls(
+            state["alphabet"],
+            state["n"],
+            state["ngram_ids"],
+            state["offsets"],
+            state["next_codes"],
+            state["weights"],
+            cdf=state.get("cdf"),
+            row_totals=state.get("row_totals"),
+            quantize=state.get("quantize"),
+        )
+
+
+class TransitionDictView(Mapping):
+    def __init__(self, table):
+        """Read only dict of dicts view of a TransitionTable.
+
+        Exposes the table in the original letter_probabilities format of n-gram to a
+        dict of next letter probabilities, rows are only converted when accessed.
+
+        Parameters
+        ----------
+        table : TransitionTable
+            The table to view.
+        """
+
+        self.table = table
+
+    def __getitem__(self, ngram):
+        row = self.table.find_row(ngram) if isinstance(ngram, str) else -1
+        if row < 0:
+            raise KeyError(ngram)
+
+        return self.table.next_letter_probabilities(row)
+
+    def __contains__(self, ngram):
+        return isinstance(ngram, str) and self.table.find_row(ngram) >= 0
+
+    def __iter__(self):
+        return iter(self.table.ngrams())
+
+    def __len__(self):
+        return len(self.table)
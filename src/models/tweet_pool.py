@@ -0,0 +1,306 @@
+"""Pools of pre-generated tweets stored on disk.
+
+Every model has a pool file of validated, decoded tweets ready to post, kept at a
+target depth by a PoolRefiller running in the background, so posting a tweet only
+pops one off the pool instead of loading a model and generating on the spot.
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # no file locking on Windows, pools must then only be refilled by one process
+    fcntl = None
+
+from src.config import get_settings
+from src.twitter.tweet_formatting import get_seq_len
+
+logger = logging.getLogger("markov-model")
+
+# tweets kept ready to post in every pool
+DEFAULT_POOL_DEPTH = 50
+
+# posted tweets remembered to reject duplicates of them
+RECENT_POSTS_KEPT = 1000
+
+# seconds between checks of the pool depths by the PoolRefiller
+DEFAULT_REFILL_INTERVAL = 60
+
+
+def default_pool_dir():
+    """Gets the directory pools are stored in when none is given, data/interim/tweet-pools."""
+
+    return get_settings().interim_path("tweet-pools")
+
+
+def normalize_tweet(tweet):
+    """Gets the key two tweets are duplicates by, ignoring case and whitespace."""
+
+    return " ".join(tweet.casefold().split())
+
+
+class TweetPool:
+    def __init__(
+        self,
+        model_name,
+        pool_dir=None,
+        target_depth=DEFAULT_POOL_DEPTH,
+        recent_limit=RECENT_POSTS_KEPT,
+    ):
+        """Tweets of one model pre-generated and stored on disk until posted.
+
+        The pool file is read and rewritten on every change under a file lock, so
+        the tweets can be popped by one process while another refills the pool.
+
+        Parameters
+        ----------
+        model_name : str
+            The model the tweets are generated from.
+        pool_dir : str, optional
+            Directory of the pool files, by default data/interim/tweet-pools
+        target_depth : int, optional
+            How many tweets refill keeps in the pool, by default 50
+        recent_limit : int, optional
+            How many popped tweets are kept to reject duplicates, by default 1000
+        """
+
+        self.model_name = model_name
+        self.pool_dir = default_pool_dir() if pool_dir is None else pool_dir
+        self.path = os.path.join(self.pool_dir, f"{model_name}.json")
+        self.target_depth = target_depth
+        self.recent_limit = recent_limit
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self, save=True):
+        """Holds the pool lock and yields the pool contents, saving them on exit."""
+
+        if not os.path.isdir(self.pool_dir):
+            os.makedirs(self.pool_dir, exist_ok=True)
+
+        with self._lock, open(f"{self.path}.lock", "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            if os.path.exists(self.path):
+                with open(self.path, encoding="utf8") as f:
+                    contents = json.load(f)
+            else:
+                contents = {"tweets": [], "recent": []}
+
+            yield contents
+
+            if not save:
+                return
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf8") as f:
+                json.dump(contents, f)
+            os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        if not os.path.exists(self.path):
+            return 0
+
+        with self._locked(save=False) as contents:
+            return len(contents["tweets"])
+
+    def pop(self):
+        """Takes the oldest tweet out of the pool and remembers it as posted.
+
+        Returns
+        -------
+        str or None
+            The tweet, None if the pool is empty.
+        """
+
+        with self._locked() as contents:
+            if len(contents["tweets"]) == 0:
+                return None
+            tweet = contents["tweets"].pop(0)
+            contents["recent"] = (contents["recent"] + [normalize_tweet(tweet)])[
+                -self.recent_limit :
+            ]
+
+        return tweet
+
+    def mark_posted(self, tweet):
+        """Remembers a tweet posted without going through the pool.
+
+        Parameters
+        ----------
+        tweet : str
+            The tweet about to be posted.
+
+        Returns
+        -------
+        bool
+            True if it was remembered, False if it duplicates a recently posted
+            tweet and shouldn't be posted.
+        """
+
+        key = normalize_tweet(tweet)
+        with self._locked() as contents:
+            if key in contents["recent"]:
+                return False
+            contents["recent"] = (contents["recent"] + [key])[-self.recent_limit :]
+
+        return True
+
+    def add(self, tweets):
+        """Adds tweets to the pool, skipping duplicates of pooled or recent tweets.
+
+        Parameters
+        ----------
+        tweets : list of str
+            Validated, decoded tweets.
+
+        Returns
+        -------
+        int
+            How many tweets were added.
+        """
+
+        with self._locked() as contents:
+            seen = set(contents["recent"])
+            seen.update(normalize_tweet(tweet) for tweet in contents["tweets"])
+            num_added = 0
+            for tweet in tweets:
+                key = normalize_tweet(tweet)
+                if key not in seen:
+                    seen.add(key)
+                    contents["tweets"].append(tweet)
+                    num_added += 1
+
+        return num_added
+
+    def refill(self, model, max_rounds=5):
+        """Generates tweets until the pool is back at its target depth.
+
+        Parameters
+        ----------
+        model : MarkovModel
+            The loaded model to generate with.
+        max_rounds : int, optional
+            Batches generated before giving up on duplicates, by default 5
+
+        Returns
+        -------
+        int
+            How many tweets were added.
+        """
+
+        num_added = 0
+        for _ in range(max_rounds):
+            deficit = self.target_depth - len(self)
+            if deficit <= 0:
+                break
+            tweets = model.generate_tweets(deficit, seq_len=get_seq_len(self.model_name))
+            num_added += self.add(tweets)
+
+        return num_added
+
+
+class PoolRefiller:
+    def __init__(
+        self,
+        models,
+        pool_dir=None,
+        target_depth=DEFAULT_POOL_DEPTH,
+        interval=DEFAULT_REFILL_INTERVAL,
+    ):
+        """Keeps the pool of every model topped up from a background thread.
+
+        Parameters
+        ----------
+        models : Mapping
+            MarkovModel keyed by model name, a dict or a ModelRegistry.
+        pool_dir : str, optional
+            Directory of the pool files, by default data/interim/tweet-pools
+        target_depth : int, optional
+            How many tweets to keep in every pool, by default 50
+        interval : float, optional
+            Seconds between checks of the pool depths, by default 60
+        """
+
+        self.models = models
+        self.pools = {
+            model_name: TweetPool(model_name, pool_dir=pool_dir, target_depth=target_depth)
+            for model_name in models
+        }
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refill_once(self):
+        """Refills every pool below its target depth.
+
+        Returns
+        -------
+        dict
+            How many tweets were added to each pool.
+        """
+
+        # models are loaded by now, importing numpy with them costs nothing extra
+        from src.models.markov_model import GenerationBudgetExceeded
+
+        added = {}
+        for model_name, pool in self.pools.items():
+            if len(pool) >= pool.target_depth:
+                continue
+            try:
+                added[model_name] = pool.refill(self.models[model_name])
+            except (GenerationBudgetExceeded, FileNotFoundError):
+                logger.error(f"Error refilling tweet pool {model_name}", exc_info=True)
+                continue
+            logger.info(f"Added {added[model_name]} tweets to pool {model_name}")
+
+        return added
+
+    def _run(self):
+        # refills at least once, even if stopped straight after starting
+        while True:
+            self.refill_once()
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self):
+        """Starts refilling in a daemon thread."""
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the refill thread after its current pass."""
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+if __name__ == "__main__":
+    from src.models.model_registry import ModelRegistry
+
+    parser = argparse.ArgumentParser(description="Keep pre-generated tweet pools full.")
+    parser.add_argument("--models", nargs="+", default=None)
+    parser.add_argument("--depth", type=int, default=DEFAULT_POOL_DEPTH)
+    parser.add_argument("--interval", type=float, default=DEFAULT_REFILL_INTERVAL)
+    parser.add_argument("--once", action="store_true", help="Refill once and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    refiller = PoolRefiller(
+        ModelRegistry(args.models), target_depth=args.depth, interval=args.interval
+    )
+    refiller.refill_once()
+    while not args.once:
+        time.sleep(args.interval)
+        refiller.refill_once()
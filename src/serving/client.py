@@ -0,0 +1,129 @@
+import http.client
+import json
+import socket
+from urllib.parse import urlencode
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+class GenerationServerError(RuntimeError):
+    """Raised when the generation server answers a request with an error."""
+
+
+def _error_message(body):
+    # a proxy in front of the server may answer with html instead of the json error
+    try:
+        return json.loads(body)["error"]
+    except (ValueError, TypeError, KeyError):
+        return body.decode("utf8", errors="replace").strip()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, unix_socket, timeout=None):
+        """An HTTP connection over a Unix domain socket.
+
+        Parameters
+        ----------
+        unix_socket : str
+            Path of the socket the server listens on.
+        timeout : float, optional
+            Socket timeout in seconds, by default None for no timeout.
+        """
+
+        super().__init__("localhost", timeout=timeout)
+        self.unix_socket = unix_socket
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.unix_socket)
+        self.sock = sock
+
+
+class GenerationClient:
+    def __init__(
+        self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None, timeout=30
+    ):
+        """A client of a running generation server.
+
+        Only uses the standard library so callers don't pay for importing numpy or
+        loading models.
+
+        Parameters
+        ----------
+        host : str, optional
+            Host the server listens on, by default "127.0.0.1"
+        port : int, optional
+            Port the server listens on, by default 8765
+        unix_socket : str, optional
+            Path of a Unix socket to connect to instead of host and port, by default None
+        timeout : float, optional
+            Seconds to wait for a response, by default 30
+        """
+
+        self.host = host
+        self.port = port
+        self.unix_socket = unix_socket
+        self.timeout = timeout
+
+    def _connection(self):
+        if self.unix_socket is not None:
+            return UnixHTTPConnection(self.unix_socket, timeout=self.timeout)
+
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _request(self, path):
+        connection = self._connection()
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            body = response.read()
+        finally:
+            connection.close()
+
+        if response.status != 200:
+            raise GenerationServerError(
+                f"Generation server returned {response.status}: {_error_message(body)}"
+            )
+
+        return body
+
+    def generate(self, model_name=None):
+        """Asks the server for a new tweet.
+
+        Parameters
+        ----------
+        model_name : str, optional
+            Which production model to generate from, by default None for a random one.
+
+        Returns
+        -------
+        model_name : str
+            The model the tweet was generated from.
+        tweet : str
+            The generated tweet, without introduction or hashtags.
+        """
+
+        path = "/generate"
+        if model_name is not None:
+            path += "?" + urlencode({"model": model_name})
+        payload = json.loads(self._request(path))
+
+        return payload["model"], payload["tweet"]
+
+    def health(self):
+        """Gets the loaded models and their acceptance statistics.
+
+        Returns
+        -------
+        dict
+            The "models" served and the "acceptance" report.
+        """
+
+        return json.loads(self._request("/health"))
+
+    def metrics(self):
+        """Gets the server's instrumentation metrics in the Prometheus text format."""
+
+        return self._request("/metrics").decode("utf8")
@@ -0,0 +1,323 @@
+"""Long running tweet generation server.
+
+Keeps production models loaded between requests, in a ModelRegistry bounded by a
+memory budget, and answers HTTP requests over TCP or a Unix socket:
+
+    GET /generate?model=<name>   {"model": name, "tweet": text}, random model if omitted
+    GET /health                  {"models": [...], "acceptance": {...}, "registry": {...}}
+    GET /metrics                 instrumentation metrics in the Prometheus text format
+
+Concurrent requests for the same model are generated together in one batch.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+from urllib.parse import parse_qs, urlsplit
+
+from src.models import instrumentation
+from src.models.generation_stats import acceptance_report
+from src.models.markov_model import GenerationBudgetExceeded
+from src.models.model_registry import DEFAULT_MEMORY_BUDGET, ModelRegistry
+from src.models.tweet_pool import PoolRefiller
+from src.serving.client import DEFAULT_HOST, DEFAULT_PORT
+from src.twitter.tweet_formatting import get_seq_len
+
+logger = logging.getLogger("markov-model")
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 503: "Service Unavailable"}
+
+
+class GenerationServer:
+    def __init__(self, models, max_batch_size=64, batch_window=0.005, max_rounds=20):
+        """Serves tweets from loaded models, batching concurrent requests.
+
+        Parameters
+        ----------
+        models : Mapping
+            MarkovModel keyed by model name, a dict or a ModelRegistry.
+        max_batch_size : int, optional
+            Most requests of one model answered by a single batch, by default 64
+        batch_window : float, optional
+            Seconds to wait for more requests after the first of a batch, by default 0.005
+        max_rounds : int, optional
+            Batches of candidates generated before giving up on a request, by default 20
+        """
+
+        self.models = models
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.max_rounds = max_rounds
+        self._queues = {}
+        self._batchers = []
+
+    @classmethod
+    def from_production_models(
+        cls, model_names=None, memory_budget=DEFAULT_MEMORY_BUDGET, **kwargs
+    ):
+        """Creates a server loading production models on first request.
+
+        Parameters
+        ----------
+        model_names : list of str, optional
+            Which production models to serve, by default every model in the
+            production models folder.
+        memory_budget : int, optional
+            Total bytes of model weights kept loaded, least recently used models are
+            evicted past it, by default 1 GiB
+        **kwargs
+            Passed on to GenerationServer.
+
+        Returns
+        -------
+        GenerationServer
+            The server backed by a ModelRegistry.
+        """
+
+        return cls(ModelRegistry(model_names, memory_budget=memory_budget), **kwargs)
+
+    def generate_tweets(self, model_name, num):
+        """Generates valid tweets from a model, blocking until done.
+
+        Parameters
+        ----------
+        model_name : str
+            Which loaded model to generate from.
+        num : int
+            How many tweets to generate.
+
+        Returns
+        -------
+        list of str
+            num valid tweets.
+        """
+
+        return self.models[model_name].generate_tweets(
+            num, seq_len=get_seq_len(model_name), max_rounds=self.max_rounds
+        )
+
+    async def generate(self, model_name):
+        """Generates one tweet, batched with concurrent requests for the same model.
+
+        Parameters
+        ----------
+        model_name : str
+            Which loaded model to generate from.
+
+        Returns
+        -------
+        str
+            The generated tweet.
+        """
+
+        if model_name not in self.models:
+            raise KeyError(model_name)
+
+        if model_name not in self._queues:
+            self._queues[model_name] = asyncio.Queue()
+            self._batchers.append(
+                asyncio.create_task(
+                    self._run_batches(model_name, self._queues[model_name])
+                )
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queues[model_name].put(future)
+
+        return await future
+
+    async def _run_batches(self, model_name, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            if self.batch_window > 0:
+                await asyncio.sleep(self.batch_window)
+            while len(batch) < self.max_batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            batch = [future for future in batch if not future.cancelled()]
+            if len(batch) == 0:
+                continue
+
+            # generation is CPU bound, run it off the event loop so requests keep queueing
+            try:
+                tweets = await loop.run_in_executor(
+                    None, self.generate_tweets, model_name, len(batch)
+                )
+            except Exception as e:
+                for future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for future, tweet in zip(batch, tweets):
+                if not future.done():
+                    future.set_result(tweet)
+
+    async def route(self, method, target):
+        """Answers a request.
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method.
+        target : str
+            The request path and query string.
+
+        Returns
+        -------
+        status : int
+            The HTTP status code.
+        payload : dict or str
+            The JSON response body, or the plain text body for /metrics.
+        """
+
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+
+        if method not in ("GET", "POST"):
+            return 400, {"error": f"Unsupported method {method}"}
+
+        if url.path == "/health":
+            payload = {"models": list(self.models), "acceptance": acceptance_report()}
+            if isinstance(self.models, ModelRegistry):
+                payload["registry"] = self.models.stats()
+            return 200, payload
+
+        if url.path == "/metrics":
+            return 200, instrumentation.to_prometheus()
+
+        if url.path == "/generate":
+            if "model" in query:
+                model_name = query["model"][0]
+            elif len(self.models) > 0:
+                model_name = random.choice(list(self.models))
+            else:
+                return 503, {"error": "No models are configured"}
+            if model_name not in self.models:
+                return 404, {"error": f"No model by the name: {model_name}"}
+            try:
+                tweet = await self.generate(model_name)
+            except GenerationBudgetExceeded as e:
+                return 503, {"error": str(e)}
+
+            return 200, {"model": model_name, "tweet": tweet}
+
+        return 404, {"error": f"Unknown path {url.path}"}
+
+    async def handle_connection(self, reader, writer):
+        """Reads one HTTP request from a connection and writes the response."""
+
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            # request bodies aren't used, read them so the client isn't cut off
+            await reader.readexactly(int(headers.get("content-length", 0)))
+
+            if len(request_line) != 3:
+                status, payload = 400, {"error": "Malformed request line"}
+            else:
+                status, payload = await self.route(request_line[0], request_line[1])
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, payload = 400, {"error": str(e)}
+
+        if isinstance(payload, str):
+            body = payload.encode("utf8")
+            content_type = "text/plain; version=0.0.4"
+        else:
+            body = json.dumps(payload).encode("utf8")
+            content_type = "application/json"
+        writer.write(
+            (
+                f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode("latin-1")
+            + body
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None):
+        """Starts listening for requests.
+
+        Parameters
+        ----------
+        host : str, optional
+            Host to listen on, by default "127.0.0.1"
+        port : int, optional
+            Port to listen on, 0 picks a free port, by default 8765
+        unix_socket : str, optional
+            Path of a Unix socket to listen on instead of host and port, by default None
+
+        Returns
+        -------
+        asyncio.Server
+            The listening server.
+        """
+
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(
+                self.handle_connection, path=unix_socket
+            )
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+
+        for sock in server.sockets:
+            logger.info(f"Generation server listening on {sock.getsockname()}")
+
+        return server
+
+    async def close(self):
+        """Stops the batch workers."""
+
+        for batcher in self._batchers:
+            batcher.cancel()
+        await asyncio.gather(*self._batchers, return_exceptions=True)
+        self._batchers = []
+        self._queues = {}
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None):
+        """Serves requests until cancelled, see start for the parameters."""
+
+        server = await self.start(host=host, port=port, unix_socket=unix_socket)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve tweets from production models.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix-socket", default=None)
+    parser.add_argument("--models", nargs="+", default=None)
+    parser.add_argument("--memory-budget", type=int, default=DEFAULT_MEMORY_BUDGET)
+    parser.add_argument(
+        "--pool-depth",
+        type=int,
+        default=0,
+        help="Keep this many pre-generated tweets per model on disk, 0 disables pools",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = GenerationServer.from_production_models(
+        args.models, memory_budget=args.memory_budget
+    )
+    if args.pool_depth > 0:
+        PoolRefiller(server.models, target_depth=args.pool_depth).start()
+    asyncio.run(server.serve(host=args.host, port=args.port, unix_socket=args.unix_socket))
@@ -0,0 +1,479 @@
+"""Asynchronous, rate limit aware posting of tweets.
+
+Tweets are appended to an Outbox persisted on disk before posting, so tweets not
+yet posted when the process stops are posted by the next run. A PostingQueue posts
+them through a transport as fast as a TokenBucket tracking the API rate limit
+window allows, sleeping on the event loop instead of blocking the process.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+from src.config import get_settings
+from src.models import instrumentation
+
+logger = logging.getLogger("markov-model")
+
+# tweets per window allowed by the statuses/update endpoint
+DEFAULT_RATE_LIMIT = 300
+DEFAULT_RATE_LIMIT_WINDOW = 3 * 60 * 60
+
+# posts of a tweet tried before it is dropped from the outbox
+MAX_POST_ATTEMPTS = 5
+
+# seconds waited after a failed post, doubled on every further failure
+RETRY_DELAY = 1.0
+
+
+def default_outbox_path():
+    """Gets the outbox file used when none is given, data/interim/tweet-outbox.json."""
+
+    return get_settings().interim_path("tweet-outbox.json")
+
+
+def rate_limit_state(headers):
+    """Reads the rate limit state from the headers of an API response.
+
+    Parameters
+    ----------
+    headers : Mapping
+        The response headers, looked up by their lower case name.
+
+    Returns
+    -------
+    remaining : int or None
+        Posts left in the current window, "x-rate-limit-remaining".
+    reset : float or None
+        Epoch time the window resets, "x-rate-limit-reset".
+    """
+
+    remaining = headers.get("x-rate-limit-remaining")
+    reset = headers.get("x-rate-limit-reset")
+
+    return (
+        int(remaining) if remaining is not None else None,
+        float(reset) if reset is not None else None,
+    )
+
+
+class RateLimited(Exception):
+    def __init__(self, reset=None):
+        """Raised by a transport when the API rejects a post for exceeding its rate limit.
+
+        Parameters
+        ----------
+        reset : float, optional
+            Epoch time the rate limit window resets, by default None if unknown.
+        """
+
+        super().__init__(f"Rate limited until {reset}")
+        self.reset = reset
+
+
+class TokenBucket:
+    def __init__(
+        self,
+        capacity=DEFAULT_RATE_LIMIT,
+        window=DEFAULT_RATE_LIMIT_WINDOW,
+        clock=time.time,
+    ):
+        """Schedules posts so they stay within a rate limit window.
+
+        Every post takes one token. Tokens refill continuously at capacity per
+        window, until the API reports the end of its current window, then the bucket
+        follows the API and refills all at once when that window resets.
+
+        Parameters
+        ----------
+        capacity : int, optional
+            Posts allowed per window, by default 300
+        window : float, optional
+            Length of the rate limit window in seconds, by default 3 hours
+        clock : callable, optional
+            Returns the current epoch time, by default time.time
+        """
+
+        self.capacity = capacity
+        self.refill_rate = capacity / window
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+        # epoch time the API reported its current window resets, None if unknown
+        self.window_reset = None
+
+    def _refill(self):
+        now = self.clock()
+        if self.window_reset is None:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.refill_rate
+            )
+        elif now >= self.window_reset:
+            # the API's window is over, it grants a full window of posts again
+            self.tokens = float(self.capacity)
+            self.window_reset = None
+        self.updated = now
+
+        return now
+
+    def delay(self):
+        """Seconds until a post is allowed, 0 if one is allowed now."""
+
+        now = self._refill()
+        if self.tokens >= 1:
+            return 0.0
+
+        if self.window_reset is not None:
+            return self.window_reset - now
+
+        return (1 - self.tokens) / self.refill_rate
+
+    def try_acquire(self):
+        """Takes a token if a post is allowed now.
+
+        Returns
+        -------
+        bool
+            Whether a token was taken.
+        """
+
+        if self.delay() > 0:
+            return False
+        self.tokens -= 1
+
+        return True
+
+    async def acquire(self):
+        """Waits until a post is allowed and takes a token."""
+
+        while not self.try_acquire():
+            await asyncio.sleep(self.delay())
+
+    def observe(self, remaining=None, reset=None):
+        """Updates the bucket from the rate limit state reported by the API.
+
+        Parameters
+        ----------
+        remaining : int, optional
+            Posts left in the current window, by default None if not reported.
+        reset : float, optional
+            Epoch time the current window resets, by default None if not reported.
+        """
+
+        self._refill()
+        if remaining is not None:
+            self.tokens = min(self.tokens, float(remaining))
+        if reset is not None:
+            self.window_reset = float(reset)
+        # a reset already in the past refills the bucket straight away
+        self._refill()
+
+
+class Outbox:
+    def __init__(self, path=None):
+        """Tweets waiting to be posted, persisted to a JSON file on every change.
+
+        Parameters
+        ----------
+        path : str, optional
+            The outbox file, by default data/interim/tweet-outbox.json
+        """
+
+        self.path = default_outbox_path() if path is None else path
+        self.entries = []
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf8") as f:
+                self.entries = json.load(f)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _save(self):
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+
+        # write then rename so a crash never leaves a partially written outbox
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+    def put(self, text):
+        """Adds a tweet to the end of the outbox.
+
+        Parameters
+        ----------
+        text : str
+            The full tweet text to post.
+
+        Returns
+        -------
+        str
+            The id of the outbox entry.
+        """
+
+        entry = {"id": uuid.uuid4().hex, "text": text, "attempts": 0}
+        self.entries.append(entry)
+        self._save()
+
+        return entry["id"]
+
+    def peek(self):
+        """Gets the oldest entry, None if the outbox is empty."""
+
+        return self.entries[0] if self.entries else None
+
+    def record_attempt(self, entry_id):
+        """Counts a failed post of an entry and returns its total failed attempts."""
+
+        for entry in self.entries:
+            if entry["id"] == entry_id:
+                entry["attempts"] += 1
+                self._save()
+                return entry["attempts"]
+
+        return 0
+
+    def remove(self, entry_id):
+        """Removes an entry once it is posted or given up on."""
+
+        self.entries = [entry for entry in self.entries if entry["id"] != entry_id]
+        self._save()
+
+
+class TweepyTransport:
+    def __init__(self, twitter_bot=None):
+        """Posts tweets through the authenticated tweepy API of a TwitterBot.
+
+        The API is created without waiting on rate limits, a rate limited post
+        raises RateLimited so the PostingQueue schedules the retry.
+
+        Parameters
+        ----------
+        twitter_bot : TwitterBot, optional
+            An authenticated bot, by default one is created and authenticated on
+            the first post.
+        """
+
+        self.twitter_bot = twitter_bot
+
+    def post(self, text):
+        """Posts a tweet.
+
+        Parameters
+        ----------
+        text : str
+            The tweet text.
+
+        Returns
+        -------
+        dict
+            The posted tweet "id" and the "rate_limit_remaining" and
+            "rate_limit_reset" reported by the API, None when not reported.
+        """
+
+        import tweepy
+
+        if self.twitter_bot is None:
+            from src.twitter.twitter_bot import TwitterBot
+
+            self.twitter_bot = TwitterBot()
+            self.twitter_bot.create_authenticate_api(wait_on_rate_limit=False)
+
+        api = self.twitter_bot.verified_api
+        try:
+            status = api.update_status(text)
+        except tweepy.TooManyRequests as e:
+            _, reset = rate_limit_state(e.response.headers)
+            raise RateLimited(reset) from e
+        except tweepy.Unauthorized:
+            # credentials trusted from an earlier run's verification were revoked
+            from src.twitter.twitter_bot import clear_verification
+
+            clear_verification()
+            raise
+
+        # tweepy keeps the requests response of its last call
+        response = getattr(api, "last_response", None)
+        remaining, reset = rate_limit_state({} if response is None else response.headers)
+
+        return {
+            "id": status.id,
+            "rate_limit_remaining": remaining,
+            "rate_limit_reset": reset,
+        }
+
+
+class HTTPTransport:
+    def __init__(self, base_url, bearer_token=None, timeout=30):
+        """Posts tweets to a statuses/update endpoint with plain HTTP.
+
+        Used to run the posting pipeline against a local fake Twitter server.
+
+        Parameters
+        ----------
+        base_url : str
+            The API root, e.g. "http://127.0.0.1:8000".
+        bearer_token : str, optional
+            Token sent in the Authorization header, by default None
+        timeout : float, optional
+            Seconds to wait for a response, by default 30
+        """
+
+        self.url = base_url.rstrip("/") + "/1.1/statuses/update.json"
+        self.bearer_token = bearer_token
+        self.timeout = timeout
+
+    def post(self, text):
+        """Posts a tweet, see TweepyTransport.post."""
+
+        request = urllib.request.Request(
+            self.url, data=urllib.parse.urlencode({"status": text}).encode("utf8")
+        )
+        if self.bearer_token is not None:
+            request.add_header("Authorization", f"Bearer {self.bearer_token}")
+
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                payload = json.loads(response.read())
+                headers = response.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 429:
+                _, reset = rate_limit_state(e.headers)
+                raise RateLimited(reset) from e
+            raise
+
+        remaining, reset = rate_limit_state(headers)
+
+        return {
+            "id": payload.get("id"),
+            "rate_limit_remaining": remaining,
+            "rate_limit_reset": reset,
+        }
+
+
+class PostingQueue:
+    def __init__(self, outbox, transport, bucket=None):
+        """Posts the tweets of an outbox in order without blocking the event loop.
+
+        Parameters
+        ----------
+        outbox : Outbox
+            The persisted tweets to post.
+        transport : TweepyTransport or HTTPTransport
+            Any object with a blocking post(text) method returning the posted tweet id
+            and rate limit state.
+        bucket : TokenBucket, optional
+            Rate limit scheduler, by default the statuses/update limit.
+        """
+
+        self.outbox = outbox
+        self.transport = transport
+        self.bucket = TokenBucket() if bucket is None else bucket
+        self.posted = []
+        # outbox entry id of every tweet posted by this queue
+        self.posted_entries = set()
+
+    async def enqueue(self, text):
+        """Adds a tweet to the outbox, it is posted by the next drain."""
+
+        return self.outbox.put(text)
+
+    async def post_next(self):
+        """Posts the oldest tweet of the outbox once the rate limit allows it.
+
+        Returns
+        -------
+        bool
+            Whether the tweet was posted, False if the post failed and was kept for a
+            retry or dropped after MAX_POST_ATTEMPTS failures.
+        """
+
+        entry = self.outbox.peek()
+        await self.bucket.acquire()
+
+        loop = asyncio.get_running_loop()
+        try:
+            with instrumentation.timed("twitter_send_seconds"):
+                result = await loop.run_in_executor(
+                    None, self.transport.post, entry["text"]
+                )
+        except RateLimited as e:
+            instrumentation.increment("twitter_rate_limited_total")
+            logger.warning(f"Rate limited posting tweet, retrying after {e.reset}")
+            self.bucket.observe(remaining=0, reset=e.reset)
+            return False
+        except Exception:
+            instrumentation.increment("twitter_send_errors_total")
+            attempts = self.outbox.record_attempt(entry["id"])
+            logger.error(f"Error posting tweet, attempt {attempts}", exc_info=True)
+            if attempts >= MAX_POST_ATTEMPTS:
+                logger.error(f"Dropping tweet after {attempts} attempts: {entry['text']}")
+                self.outbox.remove(entry["id"])
+            else:
+                await asyncio.sleep(RETRY_DELAY * 2 ** (attempts - 1))
+            return False
+
+        self.bucket.observe(result["rate_limit_remaining"], result["rate_limit_reset"])
+        self.outbox.remove(entry["id"])
+        self.posted.append(result["id"])
+        self.posted_entries.add(entry["id"])
+        instrumentation.increment("twitter_tweets_sent_total")
+        logger.info("Tweet sent")
+
+        return True
+
+    def entry_state(self, entry_id):
+        """Gets what became of an enqueued tweet.
+
+        Parameters
+        ----------
+        entry_id : str
+            The outbox entry id returned by enqueue.
+
+        Returns
+        -------
+        str
+            "posted" if this queue posted it, "queued" if it is still in the outbox,
+            e.g. waiting on the rate limit, or "dropped" after MAX_POST_ATTEMPTS
+            failed posts.
+        """
+
+        if entry_id in self.posted_entries:
+            return "posted"
+        if any(entry["id"] == entry_id for entry in self.outbox.entries):
+            return "queued"
+
+        return "dropped"
+
+    async def drain(self, max_wait=None):
+        """Posts every tweet in the outbox.
+
+        Parameters
+        ----------
+        max_wait : float, optional
+            Stop instead of waiting longer than this many seconds for the rate limit,
+            leaving the remaining tweets in the outbox, by default None to always wait.
+
+        Returns
+        -------
+        int
+            How many tweets were posted.
+        """
+
+        num_posted = 0
+        while len(self.outbox) > 0:
+            if max_wait is not None and self.bucket.delay() > max_wait:
+                logger.info(
+                    f"Rate limited, leaving {len(self.outbox)} tweets in the outbox"
+                )
+                break
+            num_posted += await self.post_next()
+
+        return num_posted
@@ -0,0 +1,30 @@
+# generation length of models missing from TWEET_FORMATTING
+DEFAULT_SEQ_LEN = 80
+
+# production models tweets are generated from
+MODELS = ["taylor-swift", "arthur-conan-doyle", "trump-tweets"]
+
+# generation length and text wrapped around the generated tweet of every model
+TWEET_FORMATTING = {
+    "taylor-swift": {
+        "seq_len": 180,
+        "introduction": "Taylor Swifts new lyrics:\n",
+        "hashtags": " #TaylorSwift",
+    },
+    "arthur-conan-doyle": {
+        "seq_len": 240,
+        "introduction": "From Arthur Conan Doyle: ",
+        "hashtags": " #SherlockHolmes",
+    },
+    "trump-tweets": {
+        "seq_len": 180,
+        "introduction": "Trump Tweeting - ",
+        "hashtags": " #Trump",
+    },
+}
+
+
+def get_seq_len(model_name):
+    """Gets the generation length of a model, DEFAULT_SEQ_LEN if it has no formatting."""
+
+    return TWEET_FORMATTING.get(model_name, {}).get("seq_len", DEFAULT_SEQ_LEN)
@@ -1,20 +1,119 @@
 # text
-import tweepy
 import os
-from dotenv import load_dotenv
 import logging
 
+from src.models import instrumentation
+
 # cur_dir = os.getcwd()
 # SRC_PATH = cur_dir[
 #     : cur_dir.index("my-little-markov-model") + len("my-little-markov-model")
 # ]
-# searches for .env file path
-load_dotenv(os.path.join(os.getcwd(), ".env"))
 
 
 # creates a logger
 logger = logging.getLogger("markov-model")
 
+# verified apis keyed by credentials and rate limit handling, reused for the process
+_VERIFIED_APIS = {}
+
+# seconds a credential check is trusted for by later processes, main.py runs once
+# per tweet so verifying in every process would double the API calls
+VERIFICATION_TTL = 24 * 60 * 60
+
+_env_loaded = False
+
+
+def load_env():
+    """Loads the .env file of the project root into the environment, once."""
+
+    global _env_loaded
+    if _env_loaded:
+        return
+
+    from dotenv import load_dotenv
+
+    from src.config import get_settings
+
+    # searches for .env file path
+    load_dotenv(os.path.join(get_settings().project_root, ".env"))
+    _env_loaded = True
+
+
+def verification_path():
+    """Gets the file recording the last credential check, data/interim."""
+
+    from src.config import get_settings
+
+    return get_settings().interim_path("twitter-verification.json")
+
+
+def credentials_digest(credentials):
+    """Hashes credentials so the verification record never holds the secrets."""
+
+    import hashlib
+
+    joined = "\0".join("" if value is None else value for value in credentials)
+
+    return hashlib.sha256(joined.encode("utf8")).hexdigest()
+
+
+def is_verified(digest, now=None):
+    """Checks whether credentials were verified within the last VERIFICATION_TTL.
+
+    Parameters
+    ----------
+    digest : str
+        The credentials_digest of the credentials.
+    now : float, optional
+        The current epoch time, by default time.time()
+
+    Returns
+    -------
+    bool
+        Whether the recorded verification is of these credentials and recent.
+    """
+
+    import json
+    import time
+
+    now = time.time() if now is None else now
+    try:
+        with open(verification_path(), encoding="utf8") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    return (record.get("digest") == digest) and (
+        0 <= now - record.get("verified_at", 0) < VERIFICATION_TTL
+    )
+
+
+def record_verification(digest, now=None):
+    """Records that credentials were verified, for the next processes to trust."""
+
+    import json
+    import time
+
+    path = verification_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    record = {"digest": digest, "verified_at": time.time() if now is None else now}
+
+    # write then rename so a crash never leaves a partially written record
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf8") as f:
+        json.dump(record, f)
+    os.replace(tmp_path, path)
+
+
+def clear_verification():
+    """Forgets the recorded verification, e.g. once the API rejects the credentials."""
+
+    _VERIFIED_APIS.clear()
+    try:
+        os.remove(verification_path())
+    except FileNotFoundError:
+        pass
+
 
 class TwitterBot:
     """A twitter bot that will post tweets generated from a Markov model of languages based on character frequencies in text."""
@@ -23,21 +122,41 @@ class TwitterBot:
 
         self.verified_api = None
 
-    def create_authenticate_api(self):
+    def create_authenticate_api(self, wait_on_rate_limit=True):
 
         """creates and authenticates an twiter api . Access token/Cosumer keys
-        must be available
+        must be available. The credentials are only verified once per process,
+        later calls reuse the verified api. A successful check is recorded in
+        data/interim and trusted by later processes for VERIFICATION_TTL seconds.
+
+        Args:
+            wait_on_rate_limit: Whether the api sleeps when rate limited, pass False
+            to get a tweepy.TooManyRequests error instead
 
         Returns:
             twitter_api: An authenticated twitter api that can be used to interact
             with the twitter environment
         """
         # pulls keys/secrets from env
+        load_env()
         consumer_key = os.getenv("TWITTER_CONSUMER_KEY")
         consumer_secret = os.getenv("TWITTER_CONSUMER_SECRET")
         access_token = os.getenv("TWITTER_ACCESS_TOKEN")
         access_token_secret = os.getenv("TWITTER_ACCESS_TOKEN_SECRET")
 
+        cache_key = (
+            consumer_key,
+            consumer_secret,
+            access_token,
+            access_token_secret,
+            wait_on_rate_limit,
+        )
+        if cache_key in _VERIFIED_APIS:
+            self.verified_api = _VERIFIED_APIS[cache_key]
+            return self.verified_api
+
+        import tweepy
+
         # sets up authentication
         auth = tweepy.OAuthHandler(consumer_key, consumer_secret)
         auth.set_access_token(access_token, access_token_secret)
@@ -45,17 +164,29 @@ class TwitterBot:
         # creates twitter api object
         twitter_api = tweepy.API(
             auth,
-            wait_on_rate_limit=True,  # wait_on_rate_limit_notify=True
+            wait_on_rate_limit=wait_on_rate_limit,  # wait_on_rate_limit_notify=True
         )
 
+        digest = credentials_digest(cache_key[:4])
+        if is_verified(digest):
+            logger.info("API created with credentials verified by an earlier run")
+            self.verified_api = twitter_api
+            _VERIFIED_APIS[cache_key] = twitter_api
+            return twitter_api
+
         # tests if authentication is successful
         try:
-            twitter_api.verify_credentials()
+            with instrumentation.timed("twitter_authenticate_seconds"):
+                twitter_api.verify_credentials()
             self.verified_api = twitter_api
         except Exception as e:
             logger.error("Error creating API", exc_info=True)
             raise e
         logger.info("API created")
+        record_verification(digest)
+        _VERIFIED_APIS[cache_key] = twitter_api
+
+        return twitter_api
 
     def send_tweet(self, tweet_text):
 
@@ -64,11 +195,14 @@ class TwitterBot:
 
         # tries to send tweet
         try:
-            self.verified_api.update_status(tweet_text)
+            with instrumentation.timed("twitter_send_seconds"):
+                self.verified_api.update_status(tweet_text)
             success = True
         except Exception as e:
+            instrumentation.increment("twitter_send_errors_total")
             logger.error("Error tweeting tweet", exc_info=False)
             raise e
+        instrumentation.increment("twitter_tweets_sent_total")
 
         logger.info("Tweet sent")
 
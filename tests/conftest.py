@@ -0,0 +1,87 @@
+import string
+
+import numpy as np
+import pytest
+
+from src.models.markov_model import MarkovModel
+
+PROSE_CORPUS = (
+    "It was a bright cold day in April, and the clocks were striking thirteen.\n"
+    "Winston Smith, his chin nuzzled into his breast in an effort to escape the vile "
+    'wind, slipped quickly through the glass doors of Victory Mansions, ""though not '
+    "quickly enough to prevent a swirl of gritty dust from entering along with him.\n"
+    "The hallway smelt of boiled cabbage &amp old rag mats. At one end of it a coloured "
+    "poster, too large for indoor display, had been tacked to the wall.\n"
+) * 3
+
+LYRIC_CORPUS = (
+    "Is this the real life? Is this just fantasy?\n"
+    "Caught in a landslide, no escape from reality.\n"
+    "Open your eyes, look up to the skies and see.\n"
+) * 5
+
+RICK_CORPUS = (
+    "We're no strangers to love\n"
+    "You know the rules and so do I\n"
+    "A full commitment's what I'm thinking of\n"
+    "You wouldn't get this from any other guy\n"
+) * 4
+
+
+@pytest.fixture(scope="session")
+def corpus():
+    """A few paragraphs of prose, with quote pairs and "&amp" for encode_corpus."""
+
+    return PROSE_CORPUS
+
+
+@pytest.fixture(scope="session")
+def rick_corpus():
+    """Four lines of lyrics repeated four times, for multi order models."""
+
+    return RICK_CORPUS
+
+
+@pytest.fixture(scope="session")
+def lyric_corpus():
+    """A few lines of lyrics, repeated so every line start is seen again."""
+
+    return LYRIC_CORPUS
+
+
+@pytest.fixture
+def tweet_model(corpus):
+    """A seeded n = 4 model of the prose corpus named "test", trimming like tweets."""
+
+    model = MarkovModel(random_state=0)
+    model.fit_corpus("test", corpus, 4, "tweet", retrain=True)
+    return model
+
+
+@pytest.fixture
+def lyric_model(lyric_corpus):
+    """A seeded n = 4 model of the lyric corpus named "queen"."""
+
+    model = MarkovModel(random_state=0)
+    model.fit_corpus("queen", lyric_corpus, 4, "lyric", retrain=True)
+    return model
+
+
+@pytest.fixture(scope="session")
+def wide_corpus():
+    """A corpus of over 90 distinct characters, so long n-gram ids overflow int64."""
+
+    alphabet = (
+        string.ascii_lowercase
+        + string.digits
+        + string.punctuation
+        + "αβγδεζηθικλμνξοπρστυφχψω"
+    )
+    rng = np.random.default_rng(0)
+    words = [
+        "".join(rng.choice(list(alphabet), size=rng.integers(2, 8)))
+        for _ in range(300)
+    ]
+    sentences = [" ".join(rng.choice(words, size=30)) for _ in range(100)]
+
+    return ". ".join(sentences)
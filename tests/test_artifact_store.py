@@ -0,0 +1,163 @@
+import io
+import os
+
+import numpy as np
+import pytest
+
+from src import config
+from src.models.artifact_store import (
+    ArtifactIntegrityError,
+    ArtifactStore,
+    iter_content_chunks,
+)
+from src.models.markov_model import MarkovModel
+from src.models.model_registry import production_model_names
+
+
+def write_file(directory, file_name, content):
+    path = os.path.join(directory, file_name)
+    with open(path, "wb") as f:
+        f.write(content)
+
+    return path
+
+
+def count_blobs(store):
+    return sum(
+        len(file_names)
+        for _, _, file_names in os.walk(os.path.join(store.root, "blobs"))
+    )
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ArtifactStore(os.path.join(tmp_path, "store"), chunk_size=16)
+
+
+def test_put_and_checkout_round_trip(store, tmp_path):
+
+    content = bytes(range(100))
+    version = store.put("test", write_file(tmp_path, "test_3-ngrams.mlmm", content))
+
+    assert store.versions("test") == [version]
+    assert store.production_version("test") is None
+
+    path = store.checkout(version)
+    assert os.path.basename(path) == "test_3-ngrams.mlmm"
+    with open(path, "rb") as f:
+        assert f.read() == content
+
+
+def test_versions_share_identical_chunks(store, tmp_path):
+
+    content = bytes(range(100))
+    first = store.put("test", write_file(tmp_path, "first.mlmm", content))
+    num_blobs = count_blobs(store)
+
+    # storing the same weights again writes nothing new
+    assert store.put("test", write_file(tmp_path, "again.mlmm", content)) == first
+    assert count_blobs(store) == num_blobs
+    assert store.versions("test") == [first]
+
+    # only the changed last chunk is stored for the new version
+    second = store.put("test", write_file(tmp_path, "second.mlmm", content[:-1] + b"!"))
+    assert second != first
+    assert count_blobs(store) == num_blobs + 1
+
+
+def test_inserted_bytes_only_change_nearby_chunks(store, tmp_path):
+
+    content = np.random.default_rng(0).bytes(4000)
+    first = store.put("test", write_file(tmp_path, "first.mlmm", content))
+    num_chunks = len(store.read_version(first)["chunks"])
+    num_blobs = count_blobs(store)
+
+    # fixed size chunks would all change after the inserted byte
+    edited = content[:2000] + b"!" + content[2000:]
+    second = store.put("test", write_file(tmp_path, "second.mlmm", edited))
+
+    assert num_chunks > 50
+    assert count_blobs(store) - num_blobs <= 3
+    with open(store.checkout(second), "rb") as f:
+        assert f.read() == edited
+
+
+def test_content_chunk_sizes():
+
+    content = np.random.default_rng(1).bytes(100000) + bytes(10000)
+    chunks = list(iter_content_chunks(io.BytesIO(content), chunk_size=256))
+
+    assert b"".join(chunks) == content
+    assert all(64 <= len(chunk) <= 1024 for chunk in chunks[:-1])
+    assert 128 <= len(content) / len(chunks) <= 512
+    assert list(iter_content_chunks(io.BytesIO(b""), chunk_size=256)) == []
+
+
+def test_changed_checkout_is_rebuilt(store, tmp_path):
+
+    content = bytes(range(100))
+    version = store.put("test", write_file(tmp_path, "test.mlmm", content))
+    path = store.checkout(version)
+
+    # an edit of the same size isn't served as the version's content
+    with open(path, "r+b") as f:
+        f.write(b"edited")
+    os.utime(path, ns=(0, 0))
+
+    assert store.checkout(version) == path
+    with open(path, "rb") as f:
+        assert f.read() == content
+
+
+def test_corrupt_chunk_fails_verification(store, tmp_path):
+
+    version = store.put("test", write_file(tmp_path, "test.mlmm", bytes(range(100))))
+    blob_path = store._blob_path(store.read_version(version)["chunks"][2])
+    with open(blob_path, "wb") as f:
+        f.write(b"not the stored bytes")
+
+    with pytest.raises(ArtifactIntegrityError):
+        store.verify(version)
+    with pytest.raises(ArtifactIntegrityError):
+        store.promote("test", version)
+    with pytest.raises(ArtifactIntegrityError):
+        store.checkout(version)
+    assert store.production_version("test") is None
+    assert os.listdir(store._checkout_dir(version)) == []
+
+
+def test_prune_and_collect_garbage(store, tmp_path):
+
+    versions = [
+        store.put("test", write_file(tmp_path, f"{i}.mlmm", bytes([i]) * 40))
+        for i in range(4)
+    ]
+    store.promote("test", versions[0])
+    store.checkout(versions[1])
+
+    assert store.prune("test", keep=1) == versions[1:3]
+    assert store.versions("test") == [versions[0], versions[3]]
+
+    assert store.collect_garbage() > 0
+    assert not os.path.exists(store._checkout_dir(versions[1]))
+    for version in [versions[0], versions[3]]:
+        store.verify(version)
+
+
+def test_published_model_loaded_in_production(corpus, tmp_path, monkeypatch):
+
+    monkeypatch.setattr(
+        config, "_settings", config.Settings(project_root=str(tmp_path))
+    )
+    model = MarkovModel()
+    model.fit_corpus("test", corpus, 3, "book", retrain=True)
+
+    version = model.publish_model(promote=True)
+    # a second publish of the same weights is the same version
+    assert model.publish_model(promote=True) == version
+    assert production_model_names() == ["test"]
+
+    loaded = MarkovModel()
+    loaded.load_production_model("test")
+
+    assert loaded.letter_probabilities == model.letter_probabilities
@@ -0,0 +1,68 @@
+from benchmarks import run_benchmarks, startup_budget
+from src import config
+
+
+def result(**metrics):
+    case = {"corpus": "synthetic", "corpus_type": "tweet", "n": 4}
+    case.update(metrics)
+    return case
+
+
+def test_compare_flags_regressions_beyond_tolerance():
+
+    baseline = {"results": [result(train_chars_per_sec=100.0, peak_rss_mb=50.0)]}
+    current = {"results": [result(train_chars_per_sec=80.0, peak_rss_mb=54.0)]}
+
+    regressions = run_benchmarks.compare_results(baseline, current, tolerance=0.1)
+
+    assert [regression["metric"] for regression in regressions] == [
+        "train_chars_per_sec"
+    ]
+
+
+def test_compare_ignores_improvements_and_new_cases():
+
+    baseline = {"results": [result(binary_load_seconds=0.01)]}
+    current = {
+        "results": [
+            result(binary_load_seconds=0.001),
+            dict(result(binary_load_seconds=1.0), n=5),
+        ]
+    }
+
+    assert run_benchmarks.compare_results(baseline, current) == []
+
+
+def test_run_case_reports_every_metric(monkeypatch):
+
+    # run_case redirects the model folder, restore it after the test
+    monkeypatch.setattr(config, "_settings", config.get_settings())
+
+    case = run_benchmarks.run_case("synthetic", "tweet", 3, synthetic_chars=20000)
+
+    for metric in run_benchmarks.METRICS:
+        assert metric in case
+    assert case["corpus_chars"] == 20000
+
+
+def test_parse_importtime_keeps_self_and_cumulative_times():
+
+    stderr = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |   json.decoder\n"
+        "import time:       300 |        420 | json\n"
+    )
+
+    assert startup_budget.parse_importtime(stderr) == {
+        "json.decoder": (120, 120),
+        "json": (300, 420),
+    }
+
+
+def test_main_leaves_heavy_modules_to_first_use():
+
+    import_times, modules = startup_budget.measure_import("main")
+
+    assert "main" in import_times
+    for heavy in startup_budget.HEAVY_MODULES:
+        assert heavy not in modules
@@ -0,0 +1,79 @@
+import pytest
+
+from src.features.build_features import (
+    CharacterTokenizer,
+    SubwordTokenizer,
+    WordTokenizer,
+    get_tokenizer,
+    tokenizer_from_state,
+)
+from src.models.markov_model import MarkovModel
+from src.models.ngram_engine import ChunkedEncoder
+
+TEXT = MarkovModel().encode_corpus(
+    "It was a bright cold day in April, and the clocks were striking thirteen.\n"
+    "Winston Smith, his chin nuzzled into his breast in an effort to escape the vile "
+    "wind, slipped quickly through the glass doors of Victory Mansions.\n" * 4
+    + "A quixotic zebra!"
+)
+
+
+@pytest.mark.parametrize("name", ["character", "word", "subword"])
+def test_decode_reverses_encode(name):
+
+    tokenizer = get_tokenizer(name).fit([TEXT])
+
+    assert tokenizer.decode(tokenizer.encode(TEXT)) == TEXT
+
+
+@pytest.mark.parametrize("tokenizer", [WordTokenizer(), SubwordTokenizer()])
+def test_tokens_shorter_than_characters(tokenizer):
+
+    symbols = tokenizer.fit([TEXT]).encode(TEXT)
+
+    assert len(symbols) * 3 < len(TEXT)
+    assert tokenizer.chars_per_token == pytest.approx(len(TEXT) / len(symbols))
+    assert tokenizer.num_steps(240) < 240 / 3
+
+
+def test_rare_words_spelled_out():
+
+    tokenizer = WordTokenizer().fit([TEXT])
+
+    assert tokenizer.encode(" his") != " his"
+    assert tokenizer.encode(" quixotic") == " quixotic"
+
+
+def test_subword_pieces_build_unseen_words():
+
+    tokenizer = SubwordTokenizer().fit([TEXT])
+
+    assert 1 < len(tokenizer.encode(" winstons")) < len(" winstons")
+
+
+@pytest.mark.parametrize("tokenizer", [WordTokenizer(), SubwordTokenizer()])
+def test_chunked_text_tokenized_like_whole_text(tokenizer):
+
+    tokenizer.fit([TEXT])
+    encoder = ChunkedEncoder(MarkovModel().encode_corpus)
+    pieces = [encoder.feed(TEXT[i : i + 7]) for i in range(0, len(TEXT), 7)]
+    pieces.append(encoder.flush())
+
+    assert "".join(tokenizer.encode(piece) for piece in pieces) == tokenizer.encode(TEXT)
+
+
+@pytest.mark.parametrize("name", ["character", "word", "subword"])
+def test_state_round_trip(name):
+
+    tokenizer = get_tokenizer(name).fit([TEXT])
+    loaded = tokenizer_from_state(tokenizer.get_state())
+
+    assert type(loaded) == type(tokenizer)
+    assert loaded.encode(TEXT) == tokenizer.encode(TEXT)
+    assert type(tokenizer_from_state(None)) == CharacterTokenizer
+
+
+def test_private_use_characters_rejected():
+
+    with pytest.raises(ValueError):
+        WordTokenizer().fit(["text with a \U000f0001 symbol"])
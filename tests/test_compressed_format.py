@@ -0,0 +1,118 @@
+import os
+
+import numpy as np
+import pytest
+
+from src import config
+from src.models.compressed_format import (
+    QuantizationError,
+    available_codecs,
+    format_report,
+    quantize_counts,
+    read_compressed_model,
+    write_compressed_model,
+)
+from src.models.markov_model import MarkovModel
+
+
+@pytest.mark.parametrize("codec", available_codecs())
+def test_lossless_round_trip(lyric_model, codec, tmp_path):
+
+    path = os.path.join(tmp_path, "queen_4-ngrams.mlmz")
+    write_compressed_model(path, lyric_model.get_weights(), codec=codec)
+
+    loaded = MarkovModel()
+    loaded._set_weights("queen", read_compressed_model(path))
+
+    assert loaded.corpus_type == "lyric"
+    assert loaded.start_prompts == lyric_model.start_prompts
+    assert np.array_equal(
+        loaded.transitions.ngram_ids, lyric_model.transitions.ngram_ids
+    )
+    assert np.array_equal(loaded.transitions.offsets, lyric_model.transitions.offsets)
+    assert loaded.letter_probabilities == lyric_model.letter_probabilities
+    assert np.array_equal(loaded.transitions.cdf, lyric_model.transitions.cdf)
+
+
+def test_quantized_counts_stay_within_error_bound():
+
+    offsets = np.array([0, 3, 5, 6])
+    weights = np.array([100000, 3, 1, 7, 9, 4], dtype=np.uint32)
+
+    quantized, max_error = quantize_counts(weights, offsets, np.uint8)
+
+    # rows that fit are exact, large rows keep every transition
+    assert quantized.tolist()[3:] == [7, 9, 4]
+    assert quantized.min() >= 1
+    probabilities = weights[:3] / weights[:3].sum()
+    quantized_probabilities = quantized[:3] / quantized[:3].sum()
+    assert max_error == pytest.approx(
+        np.abs(probabilities - quantized_probabilities).max()
+    )
+
+
+def test_quantization_beyond_bound_refused(lyric_model, tmp_path):
+
+    # scale one row far beyond what uint8 can represent
+    table = lyric_model.transitions
+    table.weights = table.weights.copy()
+    row = np.flatnonzero(np.diff(table.offsets) > 1)[0]
+    table.weights[table.offsets[row]] = 10**6
+    path = os.path.join(tmp_path, "queen_4-ngrams.mlmz")
+
+    with pytest.raises(QuantizationError):
+        write_compressed_model(
+            path, lyric_model.get_weights(), quantize="uint8", max_error=1e-6
+        )
+
+    written = write_compressed_model(path, lyric_model.get_weights(), quantize="auto")
+    assert written["max_error"] <= 1e-3
+
+
+def test_saved_compressed_model_loads(lyric_model, tmp_path, monkeypatch):
+
+    monkeypatch.setattr(config, "_settings", config.Settings(project_root=str(tmp_path)))
+    lyric_model.save_model_weights(
+        file_format="compressed", codec="lzma", quantize="uint16"
+    )
+
+    loaded = MarkovModel(random_state=0)
+    loaded.load_model_weights("queen", 4)
+
+    for ngram, probabilities in lyric_model.letter_probabilities.items():
+        loaded_probabilities = loaded.letter_probabilities[ngram]
+        assert loaded_probabilities.keys() == probabilities.keys()
+        for letter, probability in probabilities.items():
+            assert loaded_probabilities[letter] == pytest.approx(probability, abs=1e-3)
+    assert type(loaded.generate_tweet(seq_len=100)) == str
+
+
+@pytest.mark.parametrize("file_format", ["compressed", "binary", "pickle"])
+def test_quantized_model_refuses_new_counts(
+    lyric_model, file_format, tmp_path, monkeypatch
+):
+
+    monkeypatch.setattr(config, "_settings", config.Settings(project_root=str(tmp_path)))
+    lyric_model.save_model_weights(
+        file_format="compressed", quantize="uint8", max_error=1
+    )
+    loaded = MarkovModel()
+    loaded.load_model_weights("queen", 4)
+    # saving again in any format keeps the counts marked as quantized
+    loaded.save_model_weights(file_format=file_format)
+    loaded.load_model_weights("queen", 4)
+
+    assert loaded.transitions.quantize == "uint8"
+    with pytest.raises(ValueError, match="quantized"):
+        loaded.partial_fit("Mama, just killed a man.")
+    assert loaded.pending_deltas == []
+
+
+def test_format_report_compares_sizes(lyric_model):
+
+    rows = format_report(lyric_model.get_weights(), codecs=["gzip"])
+
+    binary, compressed = rows[0], rows[1]
+    assert binary["format"] == "binary"
+    assert compressed["bytes"] < binary["bytes"]
+    assert all(row["max_error"] <= 1e-3 for row in rows)
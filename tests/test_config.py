@@ -0,0 +1,111 @@
+import json
+import os
+
+import pytest
+
+from src import config
+from src.models.markov_model import MarkovModel
+
+
+def test_defaults_follow_package_not_working_directory(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    settings = config.Settings.from_env({})
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(config.__file__)))
+
+    assert settings.project_root == project_root
+    assert settings.model_dir == os.path.join(project_root, "models", "markov-models")
+    assert settings.model_stores == [os.path.join(settings.model_dir, "prod-models")]
+    assert settings.cache_dir is None
+    assert settings.data_dir == os.path.join(project_root, "data")
+
+
+def test_environment_overrides_config_file(tmp_path):
+
+    config_path = os.path.join(tmp_path, "config.json")
+    with open(config_path, "w") as f:
+        json.dump({"project_root": "/srv/markov", "cache_dir": "/file/cache"}, f)
+
+    settings = config.Settings.from_env(
+        {
+            "MARKOV_CONFIG": config_path,
+            "MARKOV_CACHE_DIR": "/dev/shm/markov",
+            "MARKOV_MODEL_STORES": os.pathsep.join(["/mnt/models", "/srv/models"]),
+        }
+    )
+
+    assert settings.model_dir == os.path.join("/srv/markov", "models", "markov-models")
+    assert settings.cache_dir == "/dev/shm/markov"
+    assert settings.model_stores == ["/mnt/models", "/srv/models"]
+
+
+def test_unknown_config_file_setting(tmp_path):
+
+    config_path = os.path.join(tmp_path, "config.json")
+    with open(config_path, "w") as f:
+        json.dump({"model_folder": "/srv"}, f)
+
+    with pytest.raises(ValueError):
+        config.Settings.from_env({"MARKOV_CONFIG": config_path})
+
+
+@pytest.fixture
+def model_stores(tmp_path, monkeypatch, corpus):
+    """A production model in the second of two stores, served through a cache."""
+
+    stores = [os.path.join(tmp_path, "ssd"), os.path.join(tmp_path, "mount")]
+    settings = config.Settings(
+        project_root=str(tmp_path),
+        model_dir=os.path.join(tmp_path, "training"),
+        model_stores=stores,
+        cache_dir=os.path.join(tmp_path, "cache"),
+    )
+    monkeypatch.setattr(config, "_settings", settings)
+
+    model = MarkovModel()
+    model.fit_corpus("test", corpus, 3, "book", retrain=True)
+    model.save_model_weights(file_format="binary")
+    os.renames(settings.model_path("test"), os.path.join(stores[1], "test"))
+
+    return settings, model
+
+
+def test_production_model_served_from_cache(model_stores):
+
+    settings, model = model_stores
+
+    assert settings.production_model_names() == ["test"]
+
+    loaded = MarkovModel()
+    loaded.load_production_model("test")
+
+    assert loaded.letter_probabilities == model.letter_probabilities
+    assert os.listdir(os.path.join(settings.cache_dir, "test")) == os.listdir(
+        os.path.join(settings.model_stores[1], "test")
+    )
+
+
+def test_cache_follows_store(model_stores):
+
+    settings, _ = model_stores
+    store_path = os.path.join(settings.model_stores[1], "test")
+    cache_path = settings.production_model_path("test")
+
+    stale_path = os.path.join(cache_path, "test_2-ngrams.pkl")
+    with open(stale_path, "wb") as f:
+        f.write(b"removed from the store")
+    (file_name,) = os.listdir(store_path)
+    with open(os.path.join(store_path, file_name), "ab") as f:
+        f.write(b"\0")
+
+    assert settings.production_model_path("test") == cache_path
+    assert not os.path.exists(stale_path)
+    with open(os.path.join(store_path, file_name), "rb") as store_file:
+        with open(os.path.join(cache_path, file_name), "rb") as cache_file:
+            assert store_file.read() == cache_file.read()
+
+
+def test_missing_production_model(model_stores):
+
+    with pytest.raises(FileNotFoundError):
+        MarkovModel().load_production_model("does-not-exist")
@@ -1,14 +1,7 @@
 import os
-import sys
 import pytest
 
-cur_dir = os.getcwd()
-src_path = cur_dir[
-    : cur_dir.index("my-little-markov-model") + len("my-little-markov-model")
-]
-if src_path not in sys.path:
-    sys.path.append(src_path)
-
+from src import config
 from src.data.corpus import Corpus
 
 
@@ -33,3 +26,40 @@ def test_invalid_corpus_name(corpus_name):
 
     with pytest.raises(TypeError):
         corp = Corpus(corpus_name)
+
+
+@pytest.fixture
+def multi_file_corpus(tmp_path, monkeypatch):
+
+    for file_name, text in [("b.txt", "second file\n"), ("a.txt", "first file\n")]:
+        with open(os.path.join(tmp_path, file_name), "w", encoding="utf8") as f:
+            f.write(text)
+    with open(os.path.join(tmp_path, "notes.md"), "w", encoding="utf8") as f:
+        f.write("not part of the corpus")
+    monkeypatch.setattr(Corpus, "corpus_path", lambda self: str(tmp_path))
+
+    return Corpus("multi-file")
+
+
+def test_load_corpus_reads_every_file(multi_file_corpus):
+
+    multi_file_corpus.load_corpus()
+
+    assert multi_file_corpus.raw_text == "first file\nsecond file\n"
+
+
+def test_iter_chunks(multi_file_corpus):
+
+    chunks = list(multi_file_corpus.iter_chunks(chunk_size=4))
+
+    assert max(len(chunk) for chunk in chunks) <= 4
+    assert "".join(chunks) == "first file\nsecond file\n"
+
+
+def test_corpus_path_uses_data_folder_of_settings(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(config, "_settings", config.Settings(data_dir=str(tmp_path)))
+
+    assert Corpus("test").corpus_path() == os.path.join(
+        tmp_path, "raw", "corpuses", "test"
+    )
@@ -0,0 +1,121 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.serving.client import GenerationClient, GenerationServerError
+from src.serving.generation_server import GenerationServer
+
+
+@pytest.fixture
+def server(tweet_model):
+    return GenerationServer({"test": tweet_model}, batch_window=0.05)
+
+
+def run_with_server(server, client_calls, unix_socket=None):
+    """Starts the server and runs blocking client calls concurrently against it."""
+
+    async def run():
+        listener = await server.start(port=0, unix_socket=unix_socket)
+        client = GenerationClient(
+            port=listener.sockets[0].getsockname()[1] if unix_socket is None else None,
+            unix_socket=unix_socket,
+        )
+        loop = asyncio.get_running_loop()
+        # the clients block, keep them off the executor the server generates in
+        executor = ThreadPoolExecutor(max_workers=len(client_calls))
+        try:
+            return await asyncio.gather(
+                *[loop.run_in_executor(executor, call, client) for call in client_calls],
+                return_exceptions=True,
+            )
+        finally:
+            executor.shutdown()
+            listener.close()
+            await listener.wait_closed()
+            await server.close()
+
+    return asyncio.run(run())
+
+
+def test_generate_over_http(server):
+
+    (result,) = run_with_server(server, [lambda client: client.generate("test")])
+
+    model_name, tweet = result
+    assert model_name == "test"
+    assert type(tweet) == str and len(tweet) >= 60
+
+
+def test_generate_over_unix_socket(server, tmp_path):
+
+    (result,) = run_with_server(
+        server,
+        [lambda client: client.generate()],
+        unix_socket=str(tmp_path / "generation.sock"),
+    )
+
+    assert result[0] == "test"
+
+
+def test_concurrent_requests_are_batched(server):
+
+    batch_sizes = []
+    generate_tweets = server.generate_tweets
+
+    def record_batch(model_name, num):
+        batch_sizes.append(num)
+        return generate_tweets(model_name, num)
+
+    server.generate_tweets = record_batch
+    results = run_with_server(server, [lambda client: client.generate("test")] * 8)
+
+    assert all(result[0] == "test" for result in results)
+    assert sum(batch_sizes) == 8
+    assert len(batch_sizes) < 8
+
+
+def test_unknown_model_and_health(server):
+
+    unknown, health = run_with_server(
+        server,
+        [lambda client: client.generate("missing"), lambda client: client.health()],
+    )
+
+    assert isinstance(unknown, GenerationServerError)
+    assert health["models"] == ["test"]
+
+
+def test_generate_without_models():
+
+    server = GenerationServer({})
+
+    assert asyncio.run(server.route("GET", "/generate"))[0] == 503
+    assert asyncio.run(server.route("GET", "/generate?model=test"))[0] == 404
+
+
+def test_html_error_from_proxy():
+
+    async def proxy(reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        body = b"<html><body>502 Bad Gateway</body></html>"
+        writer.write(
+            b"HTTP/1.1 502 Bad Gateway\r\nContent-Type: text/html\r\n"
+            b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+        )
+        await writer.drain()
+        writer.close()
+
+    async def run():
+        listener = await asyncio.start_server(proxy, "127.0.0.1", 0)
+        client = GenerationClient(port=listener.sockets[0].getsockname()[1])
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, client.generate
+            )
+        finally:
+            listener.close()
+            await listener.wait_closed()
+
+    with pytest.raises(GenerationServerError, match="502 Bad Gateway"):
+        asyncio.run(run())
@@ -0,0 +1,68 @@
+import pstats
+
+import pytest
+
+from src.models import instrumentation
+from src.models.markov_model import MarkovModel
+
+
+@pytest.fixture
+def enabled():
+    instrumentation.reset()
+    instrumentation.enable()
+    yield
+    instrumentation.disable()
+    instrumentation.reset()
+
+
+def train_and_generate(corpus):
+    model = MarkovModel(random_state=0)
+    model.fit_corpus("test", corpus, 4, "tweet", retrain=True)
+    model.generate_batch(20, seq_len=100)
+    model.generate_tweet(seq_len=100)
+    return model
+
+
+def test_disabled_records_nothing(corpus):
+
+    instrumentation.reset()
+    train_and_generate(corpus)
+
+    assert instrumentation.report() == {"timers": {}, "counters": {}}
+
+
+def test_training_and_generation_metrics(enabled, corpus):
+
+    train_and_generate(corpus)
+    report = instrumentation.report()
+
+    for timer in ["markov_encode_seconds", "markov_count_seconds", "markov_normalize_seconds"]:
+        assert report["timers"][timer][""]["count"] == 1
+    sampling = report["timers"]["markov_sample_seconds_per_char"]["model=test"]
+    assert sampling["count"] >= 21 * 100
+    candidates = report["counters"]["markov_candidates_total"]["model=test"]
+    rejected = report["counters"]["markov_rejected_total"]["model=test"]
+    assert candidates >= 21
+    assert 0 <= rejected < candidates
+
+
+def test_prometheus_export(enabled):
+
+    instrumentation.observe("load_seconds", 0.5, labels={"model": "a"})
+    instrumentation.increment("tweets_total", 3)
+
+    text = instrumentation.to_prometheus()
+
+    assert "# TYPE load_seconds summary" in text
+    assert 'load_seconds_count{model="a"} 1' in text
+    assert 'load_seconds_sum{model="a"} 0.5' in text
+    assert "# TYPE tweets_total counter\ntweets_total 3" in text
+
+
+def test_profile_dumps_stats(corpus, tmp_path):
+
+    with instrumentation.profile(str(tmp_path / "run.prof")):
+        train_and_generate(corpus)
+
+    stats = pstats.Stats(str(tmp_path / "run.prof"))
+    assert any(function[2] == "fit_corpus" for function in stats.stats)
@@ -0,0 +1,540 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from src import config
+from src.models import parallel_counting
+from src.models.markov_model import MarkovModel, GenerationBudgetExceeded
+from src.models.generation_stats import acceptance_report, reset_acceptance_stats
+from src.models.transition_table import TransitionTable, TransitionDictView, sum_rows
+from src.models.ngram_engine import (
+    DENSE_COUNT_LIMIT,
+    ChunkedEncoder,
+    encode_alphabet,
+    use_dense_count,
+)
+from src.features.build_features import WordTokenizer
+
+@pytest.fixture
+def fit_model(corpus):
+    def fit(n, engine, corpus_type="book", random_state=None):
+        model = MarkovModel(random_state=random_state)
+        model.fit_corpus("test", corpus, n, corpus_type, retrain=True, engine=engine)
+        return model
+
+    return fit
+
+
+@pytest.mark.parametrize("n", [1, 3, 6, 10])
+def test_numpy_engine_matches_python_engine(n, fit_model):
+
+    python_model = fit_model(n, "python")
+    numpy_model = fit_model(n, "numpy")
+
+    assert numpy_model.letter_probabilities == python_model.letter_probabilities
+
+
+@pytest.mark.parametrize("file_format", ["pickle", "binary", "compressed"])
+def test_long_ngrams_over_large_alphabet(wide_corpus, file_format, tmp_path, monkeypatch):
+
+    monkeypatch.setattr(config, "_settings", config.Settings(project_root=str(tmp_path)))
+    numpy_model = MarkovModel(random_state=0)
+    numpy_model.fit_corpus("test", wide_corpus, 14, "book", retrain=True)
+    python_model = MarkovModel()
+    python_model.fit_corpus("test", wide_corpus, 14, "book", retrain=True, engine="python")
+
+    # 90+ characters at n = 14 overflow int64 ids, Python int ids are used instead
+    assert numpy_model.transitions.base > 90
+    assert numpy_model.transitions.ngram_ids.dtype == object
+    assert numpy_model.letter_probabilities == python_model.letter_probabilities
+    assert len(numpy_model.generate_batch(10, seq_len=120)) > 0
+
+    numpy_model.save_model_weights(file_format=file_format)
+    loaded = MarkovModel()
+    loaded.load_model_weights("test", 14)
+
+    assert np.array_equal(loaded.transitions.ngram_ids, numpy_model.transitions.ngram_ids)
+    assert loaded.letter_probabilities == numpy_model.letter_probabilities
+
+
+def test_baseline_pickle_loads_at_large_n(wide_corpus, tmp_path, monkeypatch):
+
+    monkeypatch.setattr(config, "_settings", config.Settings(project_root=str(tmp_path)))
+    model = MarkovModel()
+    model.n = 14
+    ngram_dict = model._count_ngrams_python(model.encode_corpus(wide_corpus))
+    # the baseline pickled normalized probabilities as a dict of dicts
+    letter_probabilities = {
+        ngram: {letter: count / sum(counts.values()) for letter, count in counts.items()}
+        for ngram, counts in ngram_dict.items()
+    }
+    model_path = os.path.join(tmp_path, "models", "markov-models", "test")
+    os.makedirs(model_path)
+    with open(os.path.join(model_path, "test_14-ngrams.pkl"), "wb") as f:
+        pickle.dump(
+            {
+                "model_name": "test",
+                "n": 14,
+                "start_prompts": [wide_corpus[:100]],
+                "corpus_type": "book",
+                "letter_probabilities": letter_probabilities,
+            },
+            f,
+        )
+
+    loaded = MarkovModel(random_state=0)
+    loaded.load_model_weights("test", 14)
+
+    assert len(loaded.letter_probabilities) == len(letter_probabilities)
+    for ngram, probabilities in letter_probabilities.items():
+        assert loaded.letter_probabilities[ngram] == pytest.approx(probabilities)
+    raw_tweet = loaded._generate_raw(120)
+    assert len(raw_tweet) == 120
+    assert raw_tweet.startswith(wide_corpus[:14])
+    # only probabilities were pickled, there are no counts to add to
+    with pytest.raises(ValueError):
+        loaded.partial_fit(wide_corpus[:100])
+
+
+def test_dense_counting_depends_on_input_size():
+
+    assert use_dense_count(4 * 1000, 1000)
+    assert not use_dense_count(4 * 1000 + 1, 1000)
+    # a tiny input never allocates a large bincount
+    assert not use_dense_count(2**20, 10)
+    assert not use_dense_count(DENSE_COUNT_LIMIT + 1, DENSE_COUNT_LIMIT)
+
+
+def test_invalid_engine(fit_model):
+
+    with pytest.raises(ValueError):
+        fit_model(3, "cython")
+
+
+def test_transition_table_dict_view_round_trip(fit_model):
+
+    model = fit_model(4, "numpy")
+    view = model.letter_probabilities
+    table = TransitionTable.from_dict(dict(view), 4)
+
+    round_trip = TransitionDictView(table)
+
+    assert len(table) == len(view)
+    assert table.weights.dtype == np.float32
+    for ngram in view:
+        assert round_trip[ngram] == pytest.approx(view[ngram])
+    assert "zzzz" not in view
+
+
+def test_transition_table_state_round_trip(fit_model):
+
+    model = fit_model(4, "numpy")
+    state = model.transitions.get_state()
+    table = TransitionTable.from_state(state)
+
+    assert TransitionDictView(table) == model.letter_probabilities
+    assert table.next_codes.dtype == np.uint8
+    assert table.weights.dtype == np.uint32
+
+
+def test_generate_tweet_length(fit_model):
+
+    model = fit_model(4, "numpy")
+    tweet = model.generate_tweet(seq_len=120)
+
+    assert type(tweet) == str
+    assert len(tweet) <= 120
+
+
+def test_cdf_rows_end_at_one(fit_model):
+
+    table = fit_model(3, "numpy").transitions
+
+    assert np.all(table.cdf[table.offsets[1:] - 1] == 1.0)
+    assert np.all((table.cdf > 0) & (table.cdf <= 1))
+
+
+def test_seeded_generation_is_reproducible(fit_model):
+
+    first = fit_model(4, "numpy", random_state=42).generate_tweet(seq_len=150)
+    second = fit_model(4, "numpy", random_state=42).generate_tweet(seq_len=150)
+
+    assert first == second
+
+
+def test_sample_code_follows_probabilities(fit_model):
+
+    table = fit_model(2, "numpy").transitions
+    row = int(np.argmax(np.diff(table.offsets)))
+    next_codes, probabilities = table.row_probabilities(row)
+    rng = np.random.default_rng(0)
+
+    samples = [table.sample_code(row, u) for u in rng.random(20000)]
+    frequencies = [samples.count(code) / len(samples) for code in next_codes]
+
+    assert frequencies == pytest.approx(probabilities.tolist(), abs=0.02)
+
+
+def test_generate_batch_returns_valid_tweets(fit_model):
+
+    model = fit_model(4, "numpy", corpus_type="tweet", random_state=0)
+    tweets = model.generate_batch(200, seq_len=120)
+
+    assert 0 < len(tweets) <= 200
+    for tweet in tweets:
+        assert type(tweet) == str
+        assert len(tweet) <= 120
+        assert model.validate_tweet(tweet.replace("\n", "^"))
+
+
+def test_batch_and_single_chain_sampling_agree(fit_model):
+
+    table = fit_model(3, "numpy").transitions
+    rows = np.arange(len(table))
+    uniforms = np.random.default_rng(1).random(len(table))
+
+    batch_codes = table.sample_codes(rows, uniforms)
+    single_codes = [table.sample_code(row, u) for row, u in zip(rows, uniforms)]
+
+    assert batch_codes.tolist() == single_codes
+
+
+def test_generation_budget_exceeded(fit_model):
+
+    model = fit_model(4, "numpy", random_state=0)
+    model.post_processor.min_length = 10**6
+
+    with pytest.raises(GenerationBudgetExceeded):
+        model.generate_tweet(seq_len=120, max_attempts=50)
+
+
+class ShortTweetModel(MarkovModel):
+    def trim_tweet(self, raw_tweet):
+        return super().trim_tweet(raw_tweet)[:20]
+
+    def validate_tweet(self, trimmed_tweet):
+        return len(trimmed_tweet) == 20
+
+
+@pytest.mark.parametrize("batch_size", [1, 16])
+def test_generation_uses_overridden_hooks(batch_size, corpus, fit_model):
+
+    model = ShortTweetModel(random_state=0)
+    model.fit_corpus("test", corpus, 4, "tweet", retrain=True)
+
+    assert len(model.generate_tweet(seq_len=120, batch_size=batch_size)) == 20
+    assert all(len(tweet) == 20 for tweet in model.generate_batch(20, seq_len=120))
+
+    # patching an instance works the same as subclassing
+    model = fit_model(4, "numpy", random_state=0)
+    model.validate_tweet = lambda trimmed_tweet: False
+
+    assert model.generate_batch(20, seq_len=120) == []
+    with pytest.raises(GenerationBudgetExceeded):
+        model.generate_tweet(seq_len=120, max_attempts=20)
+
+
+@pytest.mark.parametrize("batch_size", [1, 16])
+def test_acceptance_stats_recorded(batch_size, fit_model):
+
+    reset_acceptance_stats()
+    model = fit_model(4, "numpy", corpus_type="tweet", random_state=0)
+    model.generate_tweet(seq_len=120, batch_size=batch_size)
+
+    stats = acceptance_report()["test/tweet"]
+    assert stats["accepted"] == 1
+    assert stats["candidates"] >= 1
+
+
+class InMemoryCorpus:
+    def __init__(self, text):
+        self.text = text
+
+    def iter_chunks(self, chunk_size):
+        for i in range(0, len(self.text), chunk_size):
+            yield self.text[i : i + chunk_size]
+
+
+@pytest.mark.parametrize("chunk_size", [7, 64, 10000])
+def test_streamed_corpus_matches_in_memory(chunk_size, corpus, fit_model):
+
+    in_memory = fit_model(5, "numpy")
+    streamed = MarkovModel()
+    streamed.fit_corpus(
+        "test",
+        InMemoryCorpus(corpus),
+        5,
+        "book",
+        retrain=True,
+        chunk_size=chunk_size,
+    )
+
+    assert streamed.transitions.alphabet == in_memory.transitions.alphabet
+    assert np.array_equal(streamed.transitions.weights, in_memory.transitions.weights)
+    assert streamed.letter_probabilities == in_memory.letter_probabilities
+    assert streamed.start_prompts == in_memory.start_prompts
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_parallel_training_matches_single_process(
+    workers, monkeypatch, corpus, fit_model
+):
+
+    # shrink shards so the small test corpus is split across every worker
+    monkeypatch.setattr(parallel_counting, "MIN_SHARD_SIZE", 16)
+    single = fit_model(4, "numpy")
+    parallel = MarkovModel()
+    parallel.fit_corpus("test", corpus, 4, "book", retrain=True, workers=workers)
+
+    for name in ["ngram_ids", "offsets", "next_codes", "weights", "cdf", "row_totals"]:
+        single_array = getattr(single.transitions, name)
+        parallel_array = getattr(parallel.transitions, name)
+        assert parallel_array.dtype == single_array.dtype
+        assert np.array_equal(parallel_array, single_array)
+
+
+def test_shard_bounds_cover_every_transition():
+
+    bounds = parallel_counting.shard_bounds(103, 4)
+
+    assert bounds[0][0] == 0 and bounds[-1][1] == 103
+    assert all(stop == start for (_, stop), (start, _) in zip(bounds, bounds[1:]))
+
+
+def test_chunked_encoder_matches_encode_corpus():
+
+    model = MarkovModel()
+    text = 'A  "" b\n&amp;c  \t d""" e ' * 20
+    encoder = ChunkedEncoder(model.encode_corpus)
+    encoded = "".join(encoder.feed(text[i : i + 3]) for i in range(0, len(text), 3))
+    encoded += encoder.flush()
+
+    assert encoded == model.encode_corpus(text)
+
+
+def test_chunked_encoder_bounds_text_without_spaces():
+
+    model = MarkovModel()
+    # CJK and minified text, with the transformations that span letters, a final
+    # sigma is lower cased looking past case ignorable characters like "^"
+    text = ("東京都ΟΔΟΣΑ\n" * 10) + ('xa&AMP;bk""cd"""dΣe{xy:12}ΑΣ^ΑΣpxy' * 20) + "  end"
+    encoder = ChunkedEncoder(model.encode_corpus, max_pending=8)
+    encoded = ""
+    for i in range(0, len(text), 5):
+        encoded += encoder.feed(text[i : i + 5])
+        assert len(encoder.pending) <= 16
+    encoded += encoder.flush()
+
+    assert encoded == model.encode_corpus(text)
+
+
+@pytest.mark.parametrize("max_pending", [0, 1, 2, 3])
+@pytest.mark.parametrize("text", ["ΑΣ^ΑΣp", "ΑΣ\u0301Βx", "aΣ'sΑΣ.x1"])
+def test_chunked_encoder_never_cuts_final_sigma_context(text, max_pending):
+
+    model = MarkovModel()
+    for chunk_size in range(1, len(text) + 1):
+        encoder = ChunkedEncoder(model.encode_corpus, max_pending=max_pending)
+        encoded = "".join(
+            encoder.feed(text[i : i + chunk_size])
+            for i in range(0, len(text), chunk_size)
+        )
+        encoded += encoder.flush()
+
+        assert encoded == model.encode_corpus(text)
+
+
+def reference_encode_corpus(corpus):
+    return " ".join(
+        corpus.lower().replace("\n", "^").replace('""', "").replace("&amp", "&").split()
+    )
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "  \t ",
+        'A  "" b\n&amp;c  \t d""" e ',
+        '&""amp &"""amp """" """"" x&am""p',
+        "Ünïcödé\u3000spaces\xa0and\u2028more İstanbul \U0001F600 tweets\r\n",
+        "trailing &amp",
+    ],
+)
+def test_encode_corpus_matches_string_transformations(text):
+
+    assert MarkovModel().encode_corpus(text) == reference_encode_corpus(text)
+
+
+def test_encode_prose_corpus_matches_string_transformations(corpus):
+
+    assert MarkovModel().encode_corpus(corpus) == reference_encode_corpus(corpus)
+
+
+def test_encode_alphabet_matches_unique(corpus):
+
+    encoded = MarkovModel().encode_corpus(corpus + "\U0001F600 ünï")
+    alphabet, codes = encode_alphabet(encoded)
+
+    expected_codepoints, expected_codes = np.unique(
+        [ord(c) for c in encoded], return_inverse=True
+    )
+    assert alphabet == "".join(chr(c) for c in expected_codepoints)
+    assert np.array_equal(codes, expected_codes)
+
+
+@pytest.mark.parametrize("corpus_type", ["book", "tweet"])
+def test_start_prompts_sampled_from_sentences(corpus_type, corpus):
+
+    model = MarkovModel()
+    model.corpus_type = corpus_type
+    model.n = 6
+    encoded = model.encode_corpus(corpus)
+    model.generate_start_prompts(encoded, num_sentences=4)
+
+    separator, min_char_count = (".", 100) if corpus_type == "book" else ("^", 30)
+    sentences = [s[:6] for s in encoded.split(separator) if len(s) > min_char_count]
+    assert len(model.start_prompts) == min(4, len(sentences))
+    assert all(prompt in sentences for prompt in model.start_prompts)
+
+
+def test_start_prompts_cover_whole_corpus():
+
+    model = MarkovModel()
+    model.corpus_type = "tweet"
+    model.n = 3
+    # every tweet starts with its zero padded line number
+    encoded = "^".join(f"{i:03d} is a long enough tweet for a start prompt" for i in range(1000))
+    model.generate_start_prompts(encoded, num_sentences=50)
+
+    line_numbers = [int(prompt) for prompt in model.start_prompts]
+    assert len(line_numbers) == 50
+    assert line_numbers == sorted(line_numbers)
+    assert max(line_numbers) > 500
+
+
+def test_start_prompt_codes_cached_until_prompts_change(fit_model):
+
+    model = fit_model(4, "numpy")
+    table = model.transitions
+
+    prompt_codes = model.start_prompt_codes(table.char_codes)
+    assert model.start_prompt_codes(table.char_codes) is prompt_codes
+    assert "".join(table.alphabet[c] for c in prompt_codes[0]) == model.start_prompts[0]
+
+    model.start_prompts = ["hallway"]
+    assert model.start_prompt_codes(table.char_codes).tolist() == [
+        [table.char_codes[char] for char in "hall"]
+    ]
+
+
+NEW_TEXT = "Big Brother is watching you. War is peace; freedom is slavery!\n" * 2
+
+
+def test_partial_fit_merges_counts(corpus, fit_model):
+
+    model = fit_model(3, "numpy")
+    model.partial_fit(NEW_TEXT)
+
+    expected = model._count_ngrams_python(model.encode_corpus(corpus + corpus[:3]))
+    for ngram, counts in model._count_ngrams_python(model.encode_corpus(NEW_TEXT)).items():
+        expected[ngram].update(counts)
+    table = model.transitions
+
+    assert ";" in table.alphabet
+    assert TransitionDictView(table) == TransitionDictView(
+        TransitionTable.from_dict(expected, 3)
+    )
+    # renormalizing touched rows only must match rebuilding every row
+    assert np.array_equal(table.cdf, table.build_cdf())
+    assert np.array_equal(table.row_totals, sum_rows(table.weights, table.offsets))
+
+
+def test_delta_log_round_trip(tmp_path, monkeypatch, fit_model):
+
+    monkeypatch.setattr(config, "_settings", config.Settings(project_root=str(tmp_path)))
+    model = fit_model(3, "numpy")
+    model.save_model_weights()
+    model.partial_fit(NEW_TEXT)
+    model.save_model_delta()
+    model.partial_fit("Two and two make five.")
+    model.save_model_delta()
+
+    loaded = MarkovModel()
+    loaded.load_model_weights("test", 3)
+
+    assert loaded.letter_probabilities == model.letter_probabilities
+
+    loaded.save_model_weights()
+    assert os.listdir(os.path.join(tmp_path, "models", "markov-models", "test")) == [
+        "test_3-ngrams.pkl"
+    ]
+
+
+@pytest.mark.parametrize("first_format", ["binary", "compressed"])
+def test_saving_another_format_keeps_delta_updates(
+    first_format, tmp_path, monkeypatch, fit_model
+):
+
+    monkeypatch.setattr(config, "_settings", config.Settings(project_root=str(tmp_path)))
+    model = fit_model(3, "numpy")
+    model.save_model_weights(file_format=first_format)
+    model.partial_fit(NEW_TEXT)
+    model.save_model_delta()
+    model.save_model_weights()
+
+    loaded = MarkovModel()
+    loaded.load_model_weights("test", 3)
+
+    assert ";" in loaded.transitions.alphabet
+    assert loaded.letter_probabilities == model.letter_probabilities
+    assert os.listdir(os.path.join(tmp_path, "models", "markov-models", "test")) == [
+        "test_3-ngrams.pkl"
+    ]
+
+
+@pytest.mark.parametrize("file_format", ["pickle", "binary"])
+def test_word_model_round_trip(file_format, tmp_path, monkeypatch, corpus):
+
+    monkeypatch.setattr(config, "_settings", config.Settings(project_root=str(tmp_path)))
+    model = MarkovModel(random_state=0)
+    model.fit_corpus("test", corpus, 2, "book", retrain=True, tokenizer=WordTokenizer())
+
+    assert model.tokenizer.num_steps(120) < 40
+    raw_tweets = model._generate_raw_batch(5, 120)
+    assert all(len(raw_tweet) <= 120 for raw_tweet in raw_tweets)
+    assert all(raw_tweet.isascii() for raw_tweet in raw_tweets)
+    assert model._generate_raw(120).isascii()
+
+    model.save_model_weights(file_format=file_format)
+    loaded = MarkovModel()
+    loaded.load_model_weights("test", 2)
+
+    assert type(loaded.tokenizer) == WordTokenizer
+    assert loaded.tokenizer.pieces == model.tokenizer.pieces
+    assert loaded.letter_probabilities == model.letter_probabilities
+
+
+def test_streamed_word_model_matches_in_memory(corpus):
+
+    in_memory = MarkovModel()
+    in_memory.fit_corpus(
+        "test", corpus, 2, "book", retrain=True, tokenizer=WordTokenizer()
+    )
+    streamed = MarkovModel()
+    streamed.fit_corpus(
+        "test",
+        InMemoryCorpus(corpus),
+        2,
+        "book",
+        retrain=True,
+        chunk_size=64,
+        tokenizer=WordTokenizer(),
+    )
+
+    assert streamed.tokenizer.pieces == in_memory.tokenizer.pieces
+    assert streamed.letter_probabilities == in_memory.letter_probabilities
+    assert streamed.start_prompts == in_memory.start_prompts
+
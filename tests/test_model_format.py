@@ -0,0 +1,57 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from src.models.markov_model import MarkovModel, read_model_file
+from src.models.model_format import (
+    convert_pickle_model,
+    read_binary_model,
+    write_binary_model,
+)
+
+
+def test_binary_round_trip(lyric_model, tmp_path):
+
+    path = os.path.join(tmp_path, "queen_4-ngrams.mlmm")
+    write_binary_model(path, lyric_model.get_weights())
+
+    loaded = MarkovModel()
+    loaded._set_weights("queen", read_binary_model(path))
+
+    assert loaded.n == lyric_model.n
+    assert loaded.corpus_type == "lyric"
+    assert loaded.start_prompts == lyric_model.start_prompts
+    assert loaded.letter_probabilities == lyric_model.letter_probabilities
+    assert np.array_equal(loaded.transitions.cdf, lyric_model.transitions.cdf)
+    # arrays are views into the memory map rather than copies
+    assert not loaded.transitions.ngram_ids.flags.owndata
+
+
+def test_convert_pickle_model(lyric_model, tmp_path):
+
+    pickle_path = os.path.join(tmp_path, "queen_4-ngrams.pkl")
+    pickle_dict = lyric_model.get_weights()
+    pickle_dict["letter_probabilities"] = dict(lyric_model.letter_probabilities)
+    del pickle_dict["transition_table"]
+    with open(pickle_path, "wb") as f:
+        pickle.dump(pickle_dict, f)
+
+    binary_path = convert_pickle_model(pickle_path)
+    loaded = MarkovModel(random_state=0)
+    loaded._set_weights("queen", read_model_file(binary_path))
+
+    assert binary_path.endswith(".mlmm")
+    assert set(loaded.letter_probabilities) == set(lyric_model.letter_probabilities)
+    assert type(loaded.generate_tweet(seq_len=100)) == str
+
+
+def test_invalid_binary_file(tmp_path):
+
+    path = os.path.join(tmp_path, "not-a-model.mlmm")
+    with open(path, "wb") as f:
+        f.write(b"\x00" * 64)
+
+    with pytest.raises(ValueError):
+        read_binary_model(path)
@@ -0,0 +1,78 @@
+import pytest
+
+from src.models.markov_model import MarkovModel
+from src.models.model_registry import ModelRegistry
+
+
+@pytest.fixture
+def loads():
+    return []
+
+
+@pytest.fixture
+def registry_factory(loads, corpus):
+    def train(model_name):
+        loads.append(model_name)
+        model = MarkovModel()
+        model.fit_corpus(model_name, corpus, 3, "book", retrain=True)
+        return model
+
+    def make_registry(memory_budget):
+        return ModelRegistry(["a", "b", "c"], memory_budget=memory_budget, loader=train)
+
+    return make_registry
+
+
+def test_models_load_lazily_and_are_cached(registry_factory, loads):
+
+    registry = registry_factory(memory_budget=2**30)
+    assert loads == []
+
+    model = registry["a"]
+    assert registry["a"] is model
+    assert loads == ["a"]
+    assert registry.stats()["hits"] == 1
+    assert registry.stats()["misses"] == 1
+
+
+def test_least_recently_used_model_is_evicted(registry_factory, loads):
+
+    model_size = registry_factory(2**30)["a"].nbytes
+    loads.clear()
+    registry = registry_factory(memory_budget=2 * model_size)
+
+    registry["a"]
+    registry["b"]
+    registry["a"]
+    registry["c"]
+
+    assert registry.loaded_models() == ["a", "c"]
+    assert registry.evictions == 1
+    assert registry.nbytes <= registry.memory_budget
+
+    registry["b"]
+    assert loads == ["a", "b", "c", "b"]
+
+
+def test_model_over_budget_is_kept_alone(registry_factory):
+
+    registry = registry_factory(memory_budget=1)
+
+    registry["a"]
+    registry["b"]
+
+    assert registry.loaded_models() == ["b"]
+
+
+def test_unknown_model(registry_factory, loads):
+
+    registry = registry_factory(memory_budget=2**30)
+
+    assert "missing" not in registry
+    assert sorted(registry) == ["a", "b", "c"]
+    with pytest.raises(KeyError):
+        registry["missing"]
+    assert registry.get("missing") is None
+    assert registry.get("missing", "default") == "default"
+    assert loads == []
+    assert registry.get("a") is registry.load("a")
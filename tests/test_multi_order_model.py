@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+
+from src import config
+from src.models.generation_stats import get_acceptance_stats, reset_acceptance_stats
+from src.models.markov_model import MarkovModel
+from src.models.multi_order_model import MultiOrderMarkovModel
+from src.models.ngram_engine import count_transitions, encode_alphabet
+from src.models.ngram_trie import NGramTrie
+
+@pytest.fixture
+def model(rick_corpus):
+    model = MultiOrderMarkovModel(random_state=0)
+    model.fit_corpus("rick", rick_corpus, 6, "lyric", retrain=True)
+    return model
+
+
+@pytest.mark.parametrize("order", [1, 2, 4, 6])
+def test_trie_orders_match_single_order_counts(order, rick_corpus):
+
+    alphabet, codes = encode_alphabet(MarkovModel().encode_corpus(rick_corpus))
+    trie = NGramTrie.from_codes(alphabet, codes, 6)
+    table = trie.transition_table(order)
+
+    # order k counts start at position k, single order counting does the same
+    context_ids, next_codes, counts = count_transitions(codes, order, len(alphabet))
+    expected_rows = context_ids[np.concatenate(([True], np.diff(context_ids) != 0))]
+
+    assert np.array_equal(table.ngram_ids, expected_rows)
+    assert np.array_equal(table.next_codes, next_codes)
+    assert np.array_equal(table.weights, counts)
+    assert np.array_equal(table.cdf, table.build_cdf())
+
+
+def test_long_orders_over_large_alphabet(wide_corpus):
+
+    model = MultiOrderMarkovModel(random_state=0)
+    model.fit_corpus("wide", wide_corpus, 14, "book", retrain=True)
+    single = MarkovModel()
+    single.fit_corpus("wide", wide_corpus, 14, "book", retrain=True)
+
+    model.set_order(14)
+
+    assert model.transitions.ngram_ids.dtype == object
+    assert np.array_equal(model.transitions.ngram_ids, single.transitions.ngram_ids)
+    assert np.array_equal(model.transitions.weights, single.transitions.weights)
+    assert len(model.generate_batch(10, seq_len=120)) > 0
+
+
+def test_find_context_backs_off_to_longest_suffix(model):
+
+    trie = model.trie
+    # "qqq" never occurs, the longest known suffix is " rules" of order 6
+    codes = [trie.char_codes.get(char) for char in "qqq rules"]
+
+    order, node = trie.find_context(codes)
+
+    assert order == 6
+    assert trie.find_context(codes, max_order=2)[0] == 2
+    assert trie.find_context([None])[0] == 0
+
+
+def test_set_order_generates_without_retraining(model):
+
+    for n in [2, 4, 6]:
+        model.set_order(n)
+        assert model.n == n
+        assert type(model.generate_tweet(seq_len=100)) == str
+
+    with pytest.raises(ValueError):
+        model.set_order(7)
+
+
+def test_save_and_load(model, tmp_path, monkeypatch):
+
+    monkeypatch.setattr(config, "_settings", config.Settings(project_root=str(tmp_path)))
+    model.save_model_weights()
+
+    loaded = MultiOrderMarkovModel()
+    loaded.load_model_weights("rick", 6)
+    loaded.set_order(3)
+    model.set_order(3)
+
+    assert loaded.letter_probabilities == model.letter_probabilities
+
+
+def test_backoff_generates_real_letters_after_unseen_prompt(rick_corpus):
+
+    model = MultiOrderMarkovModel(random_state=0, smoothing="backoff")
+    model.fit_corpus("rick", rick_corpus, 6, "lyric", retrain=True)
+    # none of the prompt occurs in the corpus so the first context is unseen
+    model.start_prompts = ["qqqqqq"]
+
+    texts = [model._generate_raw(60)] + model._generate_raw_batch(20, 60)
+
+    for text in texts:
+        assert len(text) == 60
+        assert set(text[6:]) <= set(model.trie.alphabet)
+        # without backoff an unseen context only ever yields spaces
+        assert text[6:].strip() != ""
+
+
+def test_backoff_replaces_space_fallback_for_unseen_prompts(rick_corpus):
+
+    def generate(smoothing):
+        model = MultiOrderMarkovModel(random_state=0, smoothing=smoothing)
+        model.fit_corpus("rick", rick_corpus, 6, "lyric", retrain=True)
+        model.start_prompts = ["qqqqqq"]
+        return model._generate_raw(80)
+
+    # the default fallback never leaves the unseen context, its padding is left off
+    assert generate(None) == "qqqqqq"
+    assert len(generate("backoff")[6:].split()) > 3
+
+
+def test_backoff_lowers_rejection_rate(rick_corpus):
+
+    reset_acceptance_stats()
+    for smoothing in [None, "backoff"]:
+        model = MultiOrderMarkovModel(random_state=0, smoothing=smoothing)
+        model.fit_corpus(f"rick-{smoothing}", rick_corpus, 6, "lyric", retrain=True)
+        # half of the prompts are n-grams the corpus never had
+        model.start_prompts = list(model.start_prompts[:5]) + [
+            "oooooo",
+            "eeeeee",
+            "kkkkkk",
+            "tttttt",
+            "uuuuuu",
+        ]
+        model.generate_batch(200, seq_len=100)
+
+    fallback = get_acceptance_stats("rick-None", "lyric").acceptance_rate
+    backoff = get_acceptance_stats("rick-backoff", "lyric").acceptance_rate
+
+    # candidates of unseen prompts never get past the prompt and are too short
+    assert fallback < 0.6
+    assert backoff > 0.9
+
+
+def test_invalid_smoothing():
+
+    with pytest.raises(ValueError):
+        MultiOrderMarkovModel(smoothing="laplace")
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from src.models.post_processing import PostProcessor
+
+
+def reference_trim_tweet(trimmed_tweet, corpus_type):
+    # the string splitting implementation the post processor replaced
+    if corpus_type == "book":
+        if "^" in trimmed_tweet:
+            lines = trimmed_tweet.split("^")[0:-1]
+            sentences = [l.split(".")[0:-1] for l in lines]
+            trimmed_tweet = "".join(
+                [sent.strip().capitalize() + ". " for line in sentences for sent in line]
+            )
+        trimmed_tweet = trimmed_tweet.replace("“", "").replace("”", "")
+    elif corpus_type == "tweet":
+        if "^" in trimmed_tweet:
+            lines = trimmed_tweet.split("^")[0:-1]
+            sentences = [
+                l.split(".")[0:-1] if len(l.split(".")) > 1 else l.strip() for l in lines
+            ]
+            trimmed_tweet = [
+                sent.strip().capitalize() + ". " for line in sentences for sent in line
+            ]
+            trimmed_tweet = ["^" if sent == ". " else sent for sent in trimmed_tweet]
+            trimmed_tweet = "".join(trimmed_tweet)
+        trimmed_tweet = trimmed_tweet.replace("“", "").replace("”", "")
+        if trimmed_tweet.count('"') % 2 != 0:
+            trimmed_tweet = trimmed_tweet.replace('"', "")
+    elif corpus_type == "lyric":
+        if "^" in trimmed_tweet:
+            lines = trimmed_tweet.split("^")[0:-1]
+            trimmed_tweet = "^".join([l.capitalize() for l in lines])
+        trimmed_tweet = trimmed_tweet.replace("“", "").replace("”", "")
+
+    return trimmed_tweet.capitalize()
+
+
+def random_texts(num, seed=0):
+    rng = np.random.default_rng(seed)
+    letters = list("abcdefgh   ..^^\"“ß")
+    return [
+        "".join(rng.choice(letters, size=rng.integers(0, 120))) for _ in range(num)
+    ]
+
+
+@pytest.mark.parametrize("corpus_type", ["book", "tweet", "lyric", "other"])
+def test_trim_matches_reference(corpus_type):
+
+    processor = PostProcessor(corpus_type)
+
+    for raw_tweet in random_texts(2000) + ["", "^", "a.^", "ab^^cd", ". .^x"]:
+        assert processor.trim(raw_tweet) == reference_trim_tweet(raw_tweet, corpus_type)
+
+
+@pytest.mark.parametrize("corpus_type", ["book", "tweet", "lyric"])
+def test_process_matches_trim_and_validate(corpus_type):
+
+    processor = PostProcessor(corpus_type, min_length=20)
+    raw_tweets = random_texts(2000, seed=1)
+
+    processed = processor.process_batch(raw_tweets)
+
+    expected = []
+    for raw_tweet in raw_tweets:
+        trimmed_tweet = processor.trim(raw_tweet)
+        expected.append(trimmed_tweet if processor.validate(trimmed_tweet) else None)
+    assert processed == expected
+    assert any(tweet is None for tweet in processed)
+    assert any(tweet is not None for tweet in processed)
+
+
+def test_validate():
+
+    processor = PostProcessor("tweet")
+
+    assert processor.validate("a" * 60)
+    assert not processor.validate("a" * 59)
+    assert not processor.validate("a^" * 3 + "a" * 60)
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+from src.twitter.posting_queue import (
+    HTTPTransport,
+    Outbox,
+    PostingQueue,
+    RateLimited,
+    TokenBucket,
+    rate_limit_state,
+)
+
+
+class FakeTwitterHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf8")
+        server = self.server
+        if server.rate_limited_posts > 0:
+            server.rate_limited_posts -= 1
+            self.send_response(429)
+            self.send_header("x-rate-limit-reset", "0")
+            self.end_headers()
+            return
+
+        server.statuses.append(parse_qs(body)["status"][0])
+        payload = json.dumps({"id": len(server.statuses)}).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("x-rate-limit-remaining", "299")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_twitter():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTwitterHandler)
+    server.statuses = []
+    server.rate_limited_posts = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_queue(fake_twitter, outbox_path, bucket=None):
+    transport = HTTPTransport(f"http://127.0.0.1:{fake_twitter.server_address[1]}")
+    return PostingQueue(Outbox(str(outbox_path)), transport, bucket=bucket)
+
+
+def test_drain_posts_in_order(fake_twitter, tmp_path):
+
+    queue = make_queue(fake_twitter, tmp_path / "outbox.json")
+
+    async def post():
+        for text in ["first", "second", "third"]:
+            await queue.enqueue(text)
+        return await queue.drain()
+
+    assert asyncio.run(post()) == 3
+    assert fake_twitter.statuses == ["first", "second", "third"]
+    assert queue.posted == [1, 2, 3]
+    assert len(Outbox(str(tmp_path / "outbox.json"))) == 0
+
+
+def test_outbox_persists_unposted_tweets(fake_twitter, tmp_path):
+
+    outbox = Outbox(str(tmp_path / "outbox.json"))
+    outbox.put("left over")
+
+    # a new run picks up the tweet written by the earlier one
+    queue = make_queue(fake_twitter, tmp_path / "outbox.json")
+    asyncio.run(queue.drain())
+
+    assert fake_twitter.statuses == ["left over"]
+
+
+def test_rate_limited_post_is_retried(fake_twitter, tmp_path):
+
+    fake_twitter.rate_limited_posts = 1
+    queue = make_queue(fake_twitter, tmp_path / "outbox.json")
+
+    async def post():
+        await queue.enqueue("retry me")
+        return await queue.drain()
+
+    assert asyncio.run(post()) == 1
+    assert fake_twitter.statuses == ["retry me"]
+
+
+def test_http_transport_raises_rate_limited(fake_twitter):
+
+    fake_twitter.rate_limited_posts = 1
+    transport = HTTPTransport(f"http://127.0.0.1:{fake_twitter.server_address[1]}")
+
+    with pytest.raises(RateLimited):
+        transport.post("too many")
+
+
+def test_drain_stops_instead_of_waiting_on_rate_limit(fake_twitter, tmp_path):
+
+    bucket = TokenBucket(capacity=1, window=3600)
+    queue = make_queue(fake_twitter, tmp_path / "outbox.json", bucket=bucket)
+
+    async def post():
+        entry_ids = [await queue.enqueue("now"), await queue.enqueue("later")]
+        await queue.drain(max_wait=1)
+        return entry_ids
+
+    now_id, later_id = asyncio.run(post())
+    assert [entry["text"] for entry in queue.outbox.entries] == ["later"]
+    # the state of each tweet, not just that the run ended, is reported
+    assert queue.entry_state(now_id) == "posted"
+    assert queue.entry_state(later_id) == "queued"
+
+
+def test_token_bucket_refills_and_observes_headers():
+
+    now = [0.0]
+    bucket = TokenBucket(capacity=2, window=10, clock=lambda: now[0])
+
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert bucket.delay() == pytest.approx(5)
+
+    now[0] = 5
+    assert bucket.try_acquire()
+
+    now[0] = 20
+    bucket.observe(remaining=0, reset=30)
+    assert bucket.delay() == pytest.approx(10)
+
+
+def test_rate_limit_state_read_from_headers():
+
+    headers = {"x-rate-limit-remaining": "12", "x-rate-limit-reset": "1700000000"}
+
+    assert rate_limit_state(headers) == (12, 1700000000.0)
+    assert rate_limit_state({}) == (None, None)
@@ -0,0 +1,69 @@
+import pytest
+
+from src.models.tweet_pool import PoolRefiller, TweetPool
+
+
+def test_pop_in_order_and_persisted(tmp_path):
+
+    pool = TweetPool("test", pool_dir=str(tmp_path))
+    assert pool.add(["first tweet", "second tweet"]) == 2
+
+    # a second process sees the same pool file
+    assert TweetPool("test", pool_dir=str(tmp_path)).pop() == "first tweet"
+    assert len(pool) == 1
+    assert pool.pop() == "second tweet"
+    assert pool.pop() is None
+
+
+def test_duplicates_of_pooled_and_posted_tweets_are_rejected(tmp_path):
+
+    pool = TweetPool("test", pool_dir=str(tmp_path))
+    pool.add(["A tweet"])
+    assert pool.mark_posted("Posted  tweet")
+    assert not pool.mark_posted("posted tweet")
+
+    assert pool.add(["a tweet", "posted tweet", "new tweet", "New tweet"]) == 1
+
+    pool.pop()
+    # popped tweets count as posted
+    assert pool.add(["A tweet"]) == 0
+
+
+def test_refill_reaches_target_depth(tweet_model, tmp_path):
+
+    pool = TweetPool("test", pool_dir=str(tmp_path), target_depth=5)
+
+    pool.refill(tweet_model)
+
+    assert len(pool) == 5
+    tweets = [pool.pop() for _ in range(5)]
+    assert all(tweet_model.validate_tweet(tweet.replace("\n", "^")) for tweet in tweets)
+
+
+def test_refiller_tops_up_every_pool(tweet_model, tmp_path):
+
+    refiller = PoolRefiller(
+        {"test": tweet_model}, pool_dir=str(tmp_path), target_depth=3
+    )
+
+    refiller.start()
+    refiller.stop()
+
+    assert len(refiller.pools["test"]) == 3
+    assert refiller.refill_once() == {}
+
+
+def test_refiller_waits_for_server_generation(tweet_model, tmp_path):
+
+    refiller = PoolRefiller(
+        {"test": tweet_model}, pool_dir=str(tmp_path), target_depth=3
+    )
+
+    # a server worker generating with the same model holds its generation lock
+    with tweet_model._generation_lock:
+        refiller.start()
+        refiller._thread.join(timeout=0.2)
+        assert len(refiller.pools["test"]) == 0
+    refiller.stop()
+
+    assert len(refiller.pools["test"]) == 3
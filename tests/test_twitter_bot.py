@@ -0,0 +1,25 @@
+import os
+
+from src import config
+from src.twitter import twitter_bot
+
+
+def test_verification_trusted_until_expired(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(config, "_settings", config.Settings(project_root=str(tmp_path)))
+    digest = twitter_bot.credentials_digest(("key", "secret", "token", "token secret"))
+
+    assert not twitter_bot.is_verified(digest)
+
+    twitter_bot.record_verification(digest, now=1000)
+    with open(twitter_bot.verification_path()) as f:
+        assert "secret" not in f.read()
+
+    assert twitter_bot.is_verified(digest, now=1000 + 60)
+    assert not twitter_bot.is_verified(digest, now=1000 + twitter_bot.VERIFICATION_TTL)
+    other = twitter_bot.credentials_digest(("key", "secret", "token", "rotated"))
+    assert not twitter_bot.is_verified(other, now=1000 + 60)
+
+    twitter_bot.clear_verification()
+    assert not os.path.exists(twitter_bot.verification_path())
+    assert not twitter_bot.is_verified(digest, now=1000 + 60)